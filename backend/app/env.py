@@ -0,0 +1,36 @@
+"""
+环境变量加载
+导入时加载 backend/.env；各服务模块在导入时读取配置，API 进程和 worker 进程都必须先导入本模块
+"""
+
+import os
+from pathlib import Path
+
+
+def load_env_file(env_path: Path) -> bool:
+    """手动加载.env文件，确保兼容性"""
+    if not env_path.exists():
+        return False
+    try:
+        # 使用utf-8-sig自动处理BOM
+        with open(env_path, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    key = key.strip()
+                    value = value.strip().strip('"').strip("'")
+                    if key and value:
+                        os.environ[key] = value
+        return True
+    except Exception as e:
+        print(f"[ERROR] Failed to load .env: {e}")
+        return False
+
+
+# 加载环境变量 - 使用可靠的手动加载方式
+env_path = Path(__file__).parent.parent / ".env"
+if load_env_file(env_path):
+    print(f"[INFO] Environment loaded from: {env_path}")
+else:
+    print(f"[WARN] .env not found at: {env_path}")
@@ -5,32 +5,8 @@ AI 毛坯房精装修效果图生成器 - 主入口
 import os
 from pathlib import Path
 
-def load_env_file(env_path: Path) -> bool:
-    """手动加载.env文件，确保兼容性"""
-    if not env_path.exists():
-        return False
-    try:
-        # 使用utf-8-sig自动处理BOM
-        with open(env_path, 'r', encoding='utf-8-sig') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    if key and value:
-                        os.environ[key] = value
-        return True
-    except Exception as e:
-        print(f"[ERROR] Failed to load .env: {e}")
-        return False
-
-# 加载环境变量 - 使用可靠的手动加载方式
-env_path = Path(__file__).parent.parent / ".env"
-if load_env_file(env_path):
-    print(f"[INFO] Environment loaded from: {env_path}")
-else:
-    print(f"[WARN] .env not found at: {env_path}")
+# 加载 .env（必须早于各服务模块的导入）
+from app.env import load_env_file  # noqa: F401
 
 # 验证关键环境变量
 api_key = os.getenv('APIYI_KEY')
@@ -56,6 +32,9 @@ from fastapi.staticfiles import StaticFiles
 
 from app.routes import image
 from app.routes import segment
+from app.routes import webhook
+from app.services.endpoint_pool import grsai_endpoints
+from app.services.job_worker import job_worker
 
 # 输出目录
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "output"
@@ -79,11 +58,35 @@ app.add_middleware(
 # 注册路由
 app.include_router(image.router, prefix="/api/v1", tags=["image"])
 app.include_router(segment.router, tags=["segment"])
+app.include_router(webhook.router, tags=["webhook"])
 
 # 静态文件服务 - 用于访问生成的图片
 app.mount("/output", StaticFiles(directory=str(OUTPUT_DIR)), name="output")
 
 
+@app.on_event("startup")
+async def start_endpoint_probes():
+    """启动上游镜像地址的定期延迟探测"""
+    grsai_endpoints.start()
+
+
+@app.on_event("shutdown")
+async def stop_endpoint_probes():
+    await grsai_endpoints.stop()
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    """启动后台生成任务的 worker（JOB_WORKER_MODE=external 时由 python -m app.worker 执行）"""
+    if job_worker.inline:
+        job_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_worker.stop()
+
+
 @app.get("/")
 async def root():
     return {"message": "AI 装修效果图生成器 API 服务已启动"}
@@ -2,8 +2,8 @@
 任务数据模型
 """
 
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -22,11 +22,57 @@ class Task(BaseModel):
     status: TaskStatus
     style: str
     room_type: Optional[str] = None
+    custom_prompt: Optional[str] = None
+    aspect_ratio: str = "auto"
+    image_size: str = "1K"
+    model: str = "nano-banana"
+    upload_path: Optional[str] = None  # 原始上传文件（由后台任务预处理）
+    input_image: Optional[str] = None  # 预处理后的输入文件名
+    prompt: Optional[str] = None
+    progress: int = 0
     original_image_url: Optional[str] = None
     result_image_url: Optional[str] = None
+    result_urls: List[str] = Field(default_factory=list)
     error_message: Optional[str] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None  # 执行该任务的 worker（主机名:进程号:实例标记）
+    stage: Optional[str] = None  # 当前阶段: queued / preprocess / prompt / generate / store / done
+    upstream_task_id: Optional[str] = None  # 已提交到 Grsai 的任务ID（进程重启后据此继续等待结果）
+    heartbeat_at: Optional[datetime] = None  # 执行者最近一次续约时间
+    priority: int = 1  # 优先级（越小越先执行，见 job_scheduler.PRIORITY_CLASSES）
+    owner: Optional[str] = None  # 所属用户（API Key 哈希 / IP）
+    cost: float = 1.0  # 按模型和尺寸估计的成本
+    vstart: float = 0.0  # 加权公平排队的虚拟开始时间
+    vfinish: float = 0.0  # 加权公平排队的虚拟完成时间
     created_at: datetime
     updated_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (TaskStatus.COMPLETED, TaskStatus.FAILED)
+
+    def to_response(self) -> dict:
+        """/task/{task_id} 的响应数据"""
+        return {
+            "task_id": self.task_id,
+            "status": self.status.value,
+            "progress": self.progress,
+            "stage": self.stage,
+            "style": self.style,
+            "room_type": self.room_type,
+            "model": self.model,
+            "image_size": self.image_size,
+            "input_image": self.input_image,
+            "output_urls": self.result_urls,
+            "results": [{"url": url} for url in self.result_urls],
+            "prompt": self.prompt,
+            "error": self.error_message,
+            "created_at": self.created_at.isoformat(timespec="seconds"),
+            "updated_at": self.updated_at.isoformat(timespec="seconds"),
+            "finished_at": self.finished_at.isoformat(timespec="seconds") if self.finished_at else None
+        }
 
 
 class GenerateRequest(BaseModel):
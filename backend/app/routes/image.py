@@ -4,26 +4,47 @@
 """
 
 import os
-import uuid
-import aiofiles
-from datetime import datetime
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-
-from app.services.getgoapi_client import getgoapi_client, GetGoModel, AspectRatio, ImageSize, DEFAULT_MODEL_PRIORITY
-from app.services.llm_client import llm_client, LLMModel, DEFAULT_LLM_MODEL_PRIORITY
+import json
+import time
+import asyncio
+import httpx
+from typing import Optional
+from fastapi import APIRouter, File, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+
+from app.services.getgoapi_client import getgoapi_client, GetGoModel, DEFAULT_MODEL_PRIORITY
 from app.services.image_processor import image_processor
-from app.utils.prompt_builder import build_prompt
+from app.services.generation_pipeline import (
+    prepare_input, build_generation_prompt, analyze_room_facts,
+    build_style_prompt, map_aspect_ratio, output_urls, is_llm_enabled, generate_images
+)
+from app.services.event_bus import event_bus
+from app.services.rate_limiter import rate_limiter, priority_scope
+from app.services.result_cache import result_cache
+from app.services.timeout_manager import adaptive_timeouts
+from app.services.quality_ladder import quality_ladder
+from app.services.service_tiers import service_tiers
+from app.services.endpoint_pool import grsai_endpoints
+from app.services.lazy_result import lazy_results
+from app.services.nano_banana import NanoBananaModel
+from app.services.job_store import job_store
+from app.services.job_scheduler import job_scheduler, client_ip
+from app.services.job_worker import job_worker, submit_job, job_events
+from app.services.reference_store import reference_store, handle_cache
+from app.services.model_compare import model_comparer, parse_models, COMPARE_MODELS
+from app.utils.deadline import deadline_scope, parse_deadline
 
 router = APIRouter()
 
-# 输入输出目录
-INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "input")
-OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "output")
+# 单次请求最多生成的方案数
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "4"))
+
+# 多风格生成单次最多风格数
+MAX_STYLES = int(os.getenv("MAX_STYLES", "6"))
 
-# 确保目录存在
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 渐进式生成的预览模型与尺寸
+PREVIEW_MODEL = os.getenv("PREVIEW_MODEL", GetGoModel.GEMINI_25_FLASH_IMAGE.value)
+PREVIEW_IMAGE_SIZE = os.getenv("PREVIEW_IMAGE_SIZE", "1K")
 
 
 @router.post("/generate")
@@ -33,7 +54,13 @@ async def generate_renovation_image(
     room_type: str = Form(None, description="房间类型"),
     custom_prompt: str = Form(None, description="自定义提示词"),
     aspect_ratio: str = Form("auto", description="输出比例"),
-    image_size: str = Form("1K", description="输出大小")
+    image_size: str = Form("1K", description="输出大小"),
+    variants: int = Form(1, description="生成方案数量"),
+    no_cache: bool = Form(False, description="跳过结果缓存，强制重新生成"),
+    deadline_seconds: Optional[float] = Form(None, description="本次请求的时间预算（秒）"),
+    tier: Optional[str] = Form(None, description="服务等级（fast/standard/premium）"),
+    x_request_deadline: Optional[str] = Header(None, description="时间预算（秒）或截止的 Unix 时间戳"),
+    x_api_key: Optional[str] = Header(None, description="API Key，用于映射服务等级")
 ):
     """
     生成装修效果图
@@ -41,174 +68,501 @@ async def generate_renovation_image(
     1. 上传毛坯房图片
     2. 选择装修风格
     3. 调用Grsai Nano Banana API生成效果图
+    
+    variants > 1 时复用同一张预处理图片和提示词，并发生成多个方案；
+    部分方案失败时仍返回已成功的结果。
+    相同输入命中结果缓存时直接返回（cached 为 true），no_cache=true 强制重新生成。
+    LLM 分析、生成、重试共用一个时间预算（deadline_seconds 或 X-Request-Deadline，
+    默认为服务等级的预算），用完后不再发起上游调用并返回 504。
+    服务等级（X-API-Key 映射 > 默认等级，tier 参数只能降级）决定模型列表、尺寸上限、
+    时间预算、对冲策略和排队优先级。
+    """
+    try:
+        service_tier = service_tiers.resolve(tier, x_api_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    with deadline_scope(service_tier.deadline(x_request_deadline, deadline_seconds)) as deadline, \
+            priority_scope(service_tier.priority):
+        if not 1 <= variants <= MAX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"variants 取值范围为 1-{MAX_VARIANTS}")
+    
+        # 1. 读取并验证图片
+        image_data = await image.read()
+        is_valid, error_msg = image_processor.validate_image(image_data)
+        if not is_valid:
+            raise HTTPException(status_code=400, detail=error_msg)
+    
+        # 2. 预处理并保存原始图片到input目录
+        prepared = await prepare_input(image_data)
+    
+        # 3. 使用 LLM 智能分析并生成提示词
+        use_llm = is_llm_enabled() and service_tier.use_llm
+        prompt, llm_analysis = await build_generation_prompt(
+            prepared, style, room_type, custom_prompt, use_cache=not no_cache, use_llm=service_tier.use_llm
+        )
+    
+        # 4. 映射宽高比
+        mapped_ratio = map_aspect_ratio(aspect_ratio)
+    
+        # 5. 调用 API易 生成效果图（使用模型降级机制），图片流式写入 output 目录
+        result = await generate_images(
+            prepared,
+            prompt=prompt,
+            aspect_ratio=mapped_ratio,
+            image_size=service_tier.cap_size(image_size),
+            model_priority=service_tier.models,
+            number_of_images=variants,
+            use_cache=not no_cache,
+            hedge_after=service_tier.hedge_after,
+            allow_degrade=service_tier.allow_degrade
+        )
+    
+        # 6. 处理结果
+        if result.get("code") != 0:
+            return JSONResponse({
+                "code": -1,
+                "message": result.get("msg", "生成失败"),
+                "data": None
+            }, status_code=504 if deadline.expired else 500)
+    
+        data = result.get("data", {})
+        # API易 返回 images 字段（已写入文件的路径列表）
+        images = data.get("images", [])
+    
+        if not images:
+            return JSONResponse({
+                "code": -1,
+                "message": "未获取到生成结果",
+                "data": None
+            }, status_code=500)
+    
+        # 7. 返回生成图片的 URL
+        return JSONResponse({
+            "code": 0,
+            "message": "success",
+            "data": {
+                "task_id": prepared.task_id,
+                "status": "succeeded",
+                "input_image": prepared.input_filename,
+                "output_urls": output_urls(images),
+                "style": style,
+                "prompt": prompt,
+                "used_model": data.get("used_model", "unknown"),
+                "cached": data.get("cached", False),
+                "coalesced": data.get("coalesced", False),
+                "degraded": data.get("degraded"),
+                "tier": service_tier.name,
+                "hedged": data.get("hedged", False),
+                "variants_requested": variants,
+                "variant_errors": data.get("errors", []),
+                "llm_analysis": llm_analysis.get("analysis") if llm_analysis else None,
+                "llm_enabled": use_llm
+            }
+        })
+
+
+@router.post("/generate-multi")
+async def generate_multi_style(
+    image: UploadFile = File(..., description="毛坯房图片(PNG/JPG)"),
+    styles: str = Form(..., description="装修风格列表，逗号分隔"),
+    room_type: str = Form(None, description="房间类型"),
+    custom_prompt: str = Form(None, description="自定义提示词"),
+    aspect_ratio: str = Form("auto", description="输出比例"),
+    image_size: str = Form("1K", description="输出大小"),
+    no_cache: bool = Form(False, description="跳过结果缓存，强制重新生成"),
+    deadline_seconds: Optional[float] = Form(None, description="本次请求的时间预算（秒）"),
+    x_request_deadline: Optional[str] = Header(None, description="时间预算（秒）或截止的 Unix 时间戳")
+):
+    """
+    多风格生成：一次上传，多个风格并发出图
+    
+    预处理和空间事实分析只做一次，每个风格用 build_prompt_v2 单独构建提示词。
+    响应为 NDJSON 流，每个风格完成时输出一行，最后输出 {"event": "done"}。
     """
+    style_list = list(dict.fromkeys(s.strip() for s in styles.split(",") if s.strip()))
+    if not style_list:
+        raise HTTPException(status_code=400, detail="请至少选择一个装修风格")
+    if len(style_list) > MAX_STYLES:
+        raise HTTPException(status_code=400, detail=f"单次最多支持 {MAX_STYLES} 个风格")
+    
     # 1. 读取并验证图片
     image_data = await image.read()
     is_valid, error_msg = image_processor.validate_image(image_data)
     if not is_valid:
         raise HTTPException(status_code=400, detail=error_msg)
     
-    # 2. 保存原始图片到input目录
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    task_id = str(uuid.uuid4())[:8]
-    input_filename = f"{timestamp}_{task_id}_input.jpg"
-    input_path = os.path.join(INPUT_DIR, input_filename)
-    
-    # 预处理图片
-    processed_image = image_processor.preprocess(image_data)
-    async with aiofiles.open(input_path, 'wb') as f:
-        await f.write(processed_image)
+    # 2. 预处理 + 空间事实分析（所有风格共用），所有风格共用一个时间预算
+    deadline = parse_deadline(x_request_deadline, deadline_seconds)
+    prepared = await prepare_input(image_data)
+    with deadline_scope(deadline):
+        room_facts = await analyze_room_facts(prepared, room_type, custom_prompt, use_cache=not no_cache)
+    mapped_ratio = map_aspect_ratio(aspect_ratio)
     
-    # 3. 使用 LLM 智能分析并生成提示词
-    use_llm = os.getenv("USE_LLM_PROMPT", "true").lower() == "true"
-    llm_analysis = None
+    async def generate_style(index: int, style: str) -> dict:
+        prompt = build_style_prompt(style, room_type, room_facts, custom_prompt)
+        # 每个风格在自己的任务中运行，需要在任务内设置截止时间
+        with deadline_scope(deadline):
+            result = await generate_images(
+                prepared,
+                prompt=prompt,
+                aspect_ratio=mapped_ratio,
+                image_size=image_size,
+                model_priority=DEFAULT_MODEL_PRIORITY,
+                tag=f"style{index}",
+                use_cache=not no_cache
+            )
+        if result.get("code") != 0:
+            return {
+                "event": "style",
+                "code": -1,
+                "style": style,
+                "message": result.get("msg", "生成失败"),
+                "output_urls": []
+            }
+        data = result.get("data", {})
+        return {
+            "event": "style",
+            "code": 0,
+            "style": style,
+            "message": "success",
+            "output_urls": output_urls(data.get("images", [])),
+            "used_model": data.get("used_model", "unknown"),
+            "cached": data.get("cached", False),
+            "degraded": data.get("degraded"),
+            "prompt": prompt
+        }
     
-    if use_llm:
+    async def event_stream():
+        yield json.dumps({
+            "event": "accepted",
+            "task_id": prepared.task_id,
+            "input_image": prepared.input_filename,
+            "styles": style_list,
+            "llm_analysis": room_facts
+        }, ensure_ascii=False) + "\n"
+        
+        tasks = [asyncio.create_task(generate_style(i, style)) for i, style in enumerate(style_list)]
+        succeeded = 0
         try:
-            print(f"[LLM] 开始分析毛坯房图片...")
-            llm_result = await llm_client.analyze_room_and_generate_prompt(
-                image_data=processed_image,
-                style=style,
-                room_type=room_type,
-                custom_prompt=custom_prompt,
-                model=DEFAULT_LLM_MODEL_PRIORITY[0]
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                succeeded += item["code"] == 0
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消剩余风格
+            for task in tasks:
+                task.cancel()
+        
+        yield json.dumps({
+            "event": "done",
+            "task_id": prepared.task_id,
+            "succeeded": succeeded,
+            "total": len(style_list)
+        }) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@router.post("/generate-progressive")
+async def generate_progressive(
+    image: UploadFile = File(..., description="毛坯房图片(PNG/JPG)"),
+    style: str = Form(..., description="装修风格"),
+    room_type: str = Form(None, description="房间类型"),
+    custom_prompt: str = Form(None, description="自定义提示词"),
+    aspect_ratio: str = Form("auto", description="输出比例"),
+    image_size: str = Form("1K", description="输出大小"),
+    no_cache: bool = Form(False, description="跳过结果缓存，强制重新生成"),
+    deadline_seconds: Optional[float] = Form(None, description="本次请求的时间预算（秒）"),
+    x_request_deadline: Optional[str] = Header(None, description="时间预算（秒）或截止的 Unix 时间戳")
+):
+    """
+    渐进式生成：先出预览图，再替换为正式效果图
+    
+    提示词生成后同时发起两路生成：快速模型（PREVIEW_MODEL）在 PREVIEW_IMAGE_SIZE 下出预览，
+    正式模型按请求尺寸出最终图。两路共用一个任务ID和时间预算，
+    正式图先完成时取消预览。
+    
+    响应为 NDJSON 流：accepted → preview（可能没有）→ final；
+    同样的事件也发布到 GET /task/{task_id}/events。
+    """
+    # 1. 读取并验证图片
+    image_data = await image.read()
+    is_valid, error_msg = image_processor.validate_image(image_data)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    deadline = parse_deadline(x_request_deadline, deadline_seconds)
+    prepared = await prepare_input(image_data)
+    mapped_ratio = map_aspect_ratio(aspect_ratio)
+    task_id = prepared.task_id
+    
+    async def run_stage(stage: str, prompt: str, model_priority: list, size: str) -> tuple:
+        with deadline_scope(deadline):
+            result = await generate_images(
+                prepared,
+                prompt=prompt,
+                aspect_ratio=mapped_ratio,
+                image_size=size,
+                model_priority=model_priority,
+                tag="output" if stage == "final" else stage,
+                use_cache=not no_cache
             )
-            
-            if llm_result.get("code") == 0:
-                llm_analysis = llm_result.get("data", {})
-                prompt = llm_analysis.get("enhanced_prompt", "")
-                print(f"[LLM] 智能提示词生成成功")
-            else:
-                print(f"[LLM] 分析失败: {llm_result.get('message')}, 使用静态提示词")
-                prompt = build_prompt(style, room_type, custom_prompt)
-        except Exception as e:
-            print(f"[LLM] 异常: {str(e)}, 使用静态提示词")
-            prompt = build_prompt(style, room_type, custom_prompt)
-    else:
-        prompt = build_prompt(style, room_type, custom_prompt)
-    
-    # 4. 映射宽高比
-    ratio_map = {
-        "auto": "4:3",
-        "1:1": "1:1",
-        "16:9": "16:9",
-        "9:16": "9:16",
-        "4:3": "4:3",
-        "3:4": "3:4",
-    }
-    mapped_ratio = ratio_map.get(aspect_ratio, "4:3")
-    
-    # 5. 调用 API易 生成效果图（使用模型降级机制）
-    result = await getgoapi_client.generate_with_fallback(
-        prompt=prompt,
-        reference_image=processed_image,
-        model_priority=DEFAULT_MODEL_PRIORITY,
-        aspect_ratio=mapped_ratio,
-        image_size=image_size
-    )
+        return stage, size, result
     
-    # 6. 处理结果
-    if result.get("code") != 0:
-        return JSONResponse({
-            "code": -1,
-            "message": result.get("msg", "生成失败"),
-            "data": None
-        }, status_code=500)
+    def stage_event(stage: str, size: str, result: dict, started: float) -> dict:
+        event = {"event": stage, "task_id": task_id, "image_size": size, "elapsed": round(time.monotonic() - started, 2)}
+        if result.get("code") != 0:
+            event.update({
+                "code": -1,
+                "status": "failed" if stage == "final" else "preview_failed",
+                "message": result.get("msg", "生成失败"),
+                "output_urls": []
+            })
+        else:
+            data = result.get("data", {})
+            event.update({
+                "code": 0,
+                "status": "succeeded" if stage == "final" else "preview",
+                "message": "success",
+                "output_urls": output_urls(data.get("images", [])),
+                "used_model": str(getattr(data.get("used_model"), "value", data.get("used_model", "unknown"))),
+                "cached": data.get("cached", False),
+                "degraded": data.get("degraded")
+            })
+        return event
     
-    data = result.get("data", {})
-    # API易 返回 images 字段（base64 数据列表）
-    images = data.get("images", [])
+    def emit(event: dict) -> str:
+        event_bus.publish(task_id, event)
+        return json.dumps(event, ensure_ascii=False) + "\n"
     
-    if not images:
-        return JSONResponse({
-            "code": -1,
-            "message": "未获取到生成结果",
-            "data": None
-        }, status_code=500)
+    async def event_stream():
+        yield emit({
+            "event": "accepted",
+            "task_id": task_id,
+            "status": "running",
+            "input_image": prepared.input_filename,
+            "style": style
+        })
+        
+        # 2. 提示词（预览与正式图共用，保证预览与最终效果一致）
+        with deadline_scope(deadline):
+            prompt, llm_analysis = await build_generation_prompt(
+                prepared, style, room_type, custom_prompt, use_cache=not no_cache
+            )
+        
+        # 3. 预览与正式图并发生成
+        started = time.monotonic()
+        final_task = asyncio.create_task(run_stage("final", prompt, DEFAULT_MODEL_PRIORITY, image_size))
+        preview_task = asyncio.create_task(run_stage("preview", prompt, [PREVIEW_MODEL], PREVIEW_IMAGE_SIZE))
+        try:
+            for finished in asyncio.as_completed([final_task, preview_task]):
+                stage, size, result = await finished
+                if stage == "preview":
+                    yield emit(stage_event(stage, size, result, started))
+                    continue
+                # 正式图完成（成功或失败）即结束，不再等待预览
+                preview_task.cancel()
+                event = stage_event(stage, size, result, started)
+                event["prompt"] = prompt
+                event["llm_analysis"] = llm_analysis.get("analysis") if llm_analysis else None
+                yield emit(event)
+                break
+        finally:
+            # 客户端断开时取消两路生成
+            final_task.cancel()
+            preview_task.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@router.post("/compare")
+async def compare_models(
+    image: UploadFile = File(..., description="毛坯房图片(PNG/JPG)"),
+    models: str = Form(..., description="参与对比的模型ID列表，逗号分隔"),
+    style: str = Form(..., description="装修风格"),
+    room_type: str = Form(None, description="房间类型"),
+    custom_prompt: str = Form(None, description="自定义提示词"),
+    prompt: str = Form(None, description="完整提示词，提供时跳过提示词生成"),
+    aspect_ratio: str = Form("auto", description="输出比例"),
+    image_size: str = Form("1K", description="输出大小"),
+    deadline_seconds: Optional[float] = Form(None, description="本次对比的时间预算（秒）"),
+    x_request_deadline: Optional[str] = Header(None, description="时间预算（秒）或截止的 Unix 时间戳")
+):
+    """
+    多模型对比：同一张图、同一提示词并发交给多个模型生成
+    
+    响应为 NDJSON 流，每个模型完成时输出一行（耗时、输出字节数、图片地址）；
+    结果同时追加到对比记录，GET /compare/summary 按风格和模型汇总。
+    """
+    try:
+        model_list = parse_models(models)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # 7. 保存生成的图片并返回 URL
-    output_urls = []
-    for i, img_data in enumerate(images):
-        output_filename = f"{timestamp}_{task_id}_output_{i}.png"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        async with aiofiles.open(output_path, 'wb') as f:
-            await f.write(img_data["data"])
-        output_urls.append(f"/output/{output_filename}")
+    image_data = await image.read()
+    is_valid, error_msg = image_processor.validate_image(image_data)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    deadline = parse_deadline(x_request_deadline, deadline_seconds)
+    prepared = await prepare_input(image_data)
+    mapped_ratio = map_aspect_ratio(aspect_ratio)
+    run_id = prepared.task_id
+    
+    async def run_model(final_prompt: str, model: str) -> dict:
+        with deadline_scope(deadline):
+            entry = await model_comparer.run_model(prepared, final_prompt, model, mapped_ratio, image_size)
+        await model_comparer.record({
+            "type": "result",
+            "run_id": run_id,
+            "style": style,
+            "room_type": room_type,
+            "aspect_ratio": mapped_ratio,
+            "image_size": image_size,
+            "input_hash": prepared.content_hash,
+            **entry
+        })
+        return entry
+    
+    async def event_stream():
+        yield json.dumps({
+            "event": "accepted",
+            "run_id": run_id,
+            "input_image": prepared.input_filename,
+            "models": model_list
+        }, ensure_ascii=False) + "\n"
+        
+        # 所有模型使用同一提示词
+        final_prompt = prompt
+        if not final_prompt:
+            with deadline_scope(deadline):
+                final_prompt, _ = await build_generation_prompt(prepared, style, room_type, custom_prompt)
+        
+        tasks = [asyncio.create_task(run_model(final_prompt, model)) for model in model_list]
+        results = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                entry = await finished
+                results.append(entry)
+                yield json.dumps({"event": "model", "run_id": run_id, **entry}, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        yield json.dumps({
+            "event": "done",
+            "run_id": run_id,
+            "prompt": final_prompt,
+            "succeeded": sum(1 for r in results if r["code"] == 0),
+            "total": len(model_list)
+        }, ensure_ascii=False) + "\n"
     
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@router.post("/compare/{run_id}/rating")
+async def rate_compare_result(
+    run_id: str,
+    model: str = Form(..., description="被评分的模型ID"),
+    score: int = Form(..., description="质量评分（1-5）"),
+    reviewer: str = Form(None, description="评分人"),
+    comment: str = Form(None, description="备注")
+):
+    """
+    为一次对比中某个模型的结果打分（汇总时计入该风格的平均分）
+
+    run_id 与 model 必须对应一条已记录的对比结果，否则返回 404
+    """
+    if not 1 <= score <= 5:
+        raise HTTPException(status_code=400, detail="score 取值范围为 1-5")
+    if model not in COMPARE_MODELS:
+        raise HTTPException(status_code=400, detail=f"不支持的模型: {model}")
+    if not await asyncio.to_thread(model_comparer.has_result, run_id, model):
+        raise HTTPException(status_code=404, detail=f"对比记录不存在: run_id={run_id}, model={model}")
+    await model_comparer.record({
+        "type": "rating",
+        "run_id": run_id,
+        "model": model,
+        "score": score,
+        "reviewer": reviewer,
+        "comment": comment
+    })
+    return JSONResponse({"code": 0, "message": "success", "data": None})
+
+
+@router.get("/compare/summary")
+async def get_compare_summary(style: Optional[str] = None):
+    """
+    按 (风格, 模型) 汇总对比记录：成功率、耗时 p50/p95、平均输出大小、平均评分
+    """
     return JSONResponse({
         "code": 0,
-        "message": "success",
-        "data": {
-            "task_id": task_id,
-            "status": "succeeded",
-            "input_image": input_filename,
-            "output_urls": output_urls,
-            "style": style,
-            "prompt": prompt,
-            "used_model": data.get("used_model", "unknown"),
-            "llm_analysis": llm_analysis.get("analysis") if llm_analysis else None,
-            "llm_enabled": use_llm
-        }
+        "data": await asyncio.to_thread(model_comparer.summary, style)
     })
 
 
 @router.post("/generate-async")
 async def generate_renovation_image_async(
+    request: Request,
     image: UploadFile = File(..., description="毛坯房图片(PNG/JPG)"),
     style: str = Form(..., description="装修风格"),
     room_type: str = Form(None, description="房间类型"),
     custom_prompt: str = Form(None, description="自定义提示词"),
     aspect_ratio: str = Form("auto", description="输出比例"),
-    image_size: str = Form("1K", description="输出大小")
+    image_size: str = Form("1K", description="输出大小"),
+    model: str = Form(NanoBananaModel.NANO_BANANA.value, description="Nano Banana 模型"),
+    priority: Optional[str] = Form(None, description="优先级（interactive/standard/bulk），不能高于按在途任务数判断的默认值"),
+    x_api_key: Optional[str] = Header(None, description="API Key，已配置的 Key 用于公平排队")
 ):
     """
     异步生成装修效果图（立即返回任务ID，需轮询获取结果）
+    
+    任务持久化到本地任务表，由后台 worker 执行 预处理 → 提示词 → 生成 → 保存；
+    通过 GET /task/{task_id} 查询状态（含排队位置和预计完成时间），或订阅 GET /task/{task_id}/events。
+    任务按优先级执行，同一优先级内按用户（已配置的 API Key > 客户端 IP）加权公平排队。
     """
-    # 1. 读取并验证图片
+    if model not in {m.value for m in NanoBananaModel}:
+        raise HTTPException(status_code=400, detail=f"不支持的模型: {model}")
+    owner, weight = job_scheduler.resolve_owner(x_api_key, client_ip(
+        request.headers.get("x-forwarded-for"), request.client.host if request.client else None
+    ))
+    try:
+        priority_value = await job_scheduler.resolve_priority(owner, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 1. 读取并验证图片（预处理在后台执行）
     image_data = await image.read()
     is_valid, error_msg = image_processor.validate_image(image_data)
     if not is_valid:
         raise HTTPException(status_code=400, detail=error_msg)
     
-    # 2. 保存原始图片
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    local_task_id = str(uuid.uuid4())[:8]
-    input_filename = f"{timestamp}_{local_task_id}_input.jpg"
-    input_path = os.path.join(INPUT_DIR, input_filename)
-    
-    processed_image = image_processor.preprocess(image_data)
-    async with aiofiles.open(input_path, 'wb') as f:
-        await f.write(processed_image)
-    
-    # 3. 构建提示词并调用API
-    prompt = build_prompt(style, room_type, custom_prompt)
-    image_base64 = nano_banana_client.image_to_base64(processed_image)
-    
-    result = await nano_banana_client.generate_image(
-        prompt=prompt,
-        image_base64_list=[image_base64],
-        model=NanoBananaModel.NANO_BANANA,
+    # 2. 登记任务
+    task = await submit_job(
+        image_data,
+        style=style,
+        room_type=room_type,
+        custom_prompt=custom_prompt,
         aspect_ratio=aspect_ratio,
-        image_size=image_size
+        image_size=image_size,
+        model=model,
+        owner=owner,
+        weight=weight,
+        priority=priority_value
     )
-    
-    if result.get("code") != 0:
-        return JSONResponse({
-            "code": -1,
-            "message": result.get("msg", "提交任务失败"),
-            "data": None
-        }, status_code=500)
-    
-    task_id = result.get("data", {}).get("id")
+    queue = await job_scheduler.queue_info(task)
     
     return JSONResponse({
         "code": 0,
         "message": "success",
         "data": {
-            "task_id": task_id,
-            "status": "processing",
-            "input_image": input_filename,
-            "estimated_time": 60
+            "task_id": task.task_id,
+            "status": task.status.value,
+            **queue,
+            "estimated_time": queue["eta_seconds"]
         }
     })
 
@@ -216,40 +570,51 @@ async def generate_renovation_image_async(
 @router.get("/task/{task_id}")
 async def get_task_status(task_id: str):
     """
-    查询任务状态
+    查询任务状态（读取本地任务表）
     """
-    result = await nano_banana_client.get_result(task_id)
-    
-    if result.get("code") == -22:
+    task = await job_store.get(task_id)
+    if task is None:
         return JSONResponse({
             "code": -1,
             "message": "任务不存在",
             "data": None
         }, status_code=404)
     
-    if result.get("code") != 0:
-        return JSONResponse({
-            "code": -1,
-            "message": result.get("msg", "查询失败"),
-            "data": None
-        }, status_code=500)
-    
-    data = result.get("data", {})
-    
     return JSONResponse({
         "code": 0,
         "message": "success",
-        "data": {
-            "task_id": data.get("id"),
-            "status": data.get("status"),
-            "progress": data.get("progress", 0),
-            "results": data.get("results", []),
-            "failure_reason": data.get("failure_reason"),
-            "error": data.get("error")
-        }
+        "data": {**task.to_response(), **(await job_scheduler.queue_info(task))}
     })
 
 
+@router.get("/task/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """
+    订阅任务进度事件（Server-Sent Events）
+    
+    事件来自进程内事件总线：上游进度流、预览图、最终结果等。
+    收到终态（succeeded / completed / failed）后结束，空闲时每 15 秒发送心跳。
+    """
+    async def event_stream():
+        # 异步任务在独立 worker 进程执行时，进度从任务表轮询
+        if not job_worker.inline and await job_store.get(task_id) is not None:
+            async for event in job_events(task_id):
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            return
+        with event_bus.subscribe(task_id) as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if event.get("status") in ("succeeded", "completed", "failed"):
+                    break
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.get("/styles")
 async def get_styles():
     """
@@ -276,6 +641,133 @@ async def get_room_types():
     })
 
 
+@router.get("/rate-limits")
+async def get_rate_limits():
+    """
+    查看上游服务限流器状态（在途数、排队数、排队耗时等）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": rate_limiter.stats()
+    })
+
+
+@router.get("/endpoints")
+async def get_endpoints():
+    """
+    查看上游镜像地址池（当前地址、各镜像的健康状态与探测延迟）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": {"grsai": grsai_endpoints.stats()}
+    })
+
+
+@router.get("/refs/{name}")
+async def get_reference(name: str, expires: int, sig: str):
+    """
+    签名 URL 对应的参考图（供上游服务商拉取，见 reference_store）
+    """
+    path = reference_store.resolve(name, expires, sig)
+    if path is None:
+        raise HTTPException(status_code=403, detail="链接无效或已过期")
+    return FileResponse(path, headers={"Cache-Control": "private, max-age=300"})
+
+
+@router.get("/results/{result_id}")
+async def get_result_image(result_id: str):
+    """
+    上游托管的结果图片：已保存到本地时返回本地文件，否则直接代理上游字节流
+    （结果索引过期或服务重启后，按 id 返回已保存的本地文件）
+    """
+    result = lazy_results.get(result_id)
+    if result is None:
+        path = lazy_results.find_file(result_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail="结果不存在或已过期")
+        return FileResponse(path)
+    try:
+        body, media_type = await lazy_results.open(result)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"结果图片获取失败: {str(e)}")
+    return StreamingResponse(body, media_type=media_type)
+
+
+@router.get("/references")
+async def get_reference_stats():
+    """
+    查看参考图句柄缓存（签名 URL 与 Files API 上传句柄的数量与命中次数）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": {
+            "signed_url": {"enabled": reference_store.enabled, **reference_store.handles.stats()},
+            "files_api": {"enabled": getgoapi_client.FILES_API_ENABLED, **handle_cache.stats()}
+        }
+    })
+
+
+@router.get("/jobs")
+async def get_job_stats():
+    """
+    查看后台任务队列（各状态任务数、各用户排队情况、单位成本耗时、本进程 worker 状态）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": {
+            "jobs": await job_store.counts(),
+            "pending_by_owner": await job_store.pending_by_owner(),
+            "seconds_per_cost": await job_store.seconds_per_cost(),
+            "capacity": job_scheduler.capacity,
+            "worker": job_worker.stats()
+        }
+    })
+
+
+@router.get("/tiers")
+async def get_service_tiers():
+    """
+    获取服务等级列表（模型、尺寸上限、时间预算、对冲策略、排队优先级）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": service_tiers.describe()
+    })
+
+
+@router.get("/quality-ladder")
+async def get_quality_ladder():
+    """
+    查看负载自适应质量阶梯的状态（当前等级、负载压力、降级次数）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": quality_ladder.stats()
+    })
+
+
+@router.get("/timeouts")
+async def get_adaptive_timeouts():
+    """
+    查看按 (服务商, 模型, 尺寸) 学习到的上游耗时分位数和读超时
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": adaptive_timeouts.stats()
+    })
+
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """
+    查看生成结果缓存状态（条目数、占用字节、命中/淘汰次数）
+    """
+    return JSONResponse({
+        "code": 0,
+        "data": result_cache.stats()
+    })
+
+
 @router.get("/models")
 async def get_models():
     """
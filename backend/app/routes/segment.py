@@ -14,6 +14,7 @@ import numpy as np
 
 from app.services.sam_service import sam3_service, create_rgba_mask, extract_masked_region
 from app.services.inpaint_service import inpaint_service
+from app.services.lazy_result import LazyResult
 
 
 router = APIRouter(prefix="/api/v1/segment", tags=["Segmentation"])
@@ -46,6 +47,21 @@ def image_to_base64(image: Image.Image, format: str = "PNG") -> str:
     return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
 
+async def result_payload(result: LazyResult, response_format: str) -> dict:
+    """
+    替换结果的响应数据
+    
+    url: 返回本服务的结果地址（后台保存中，首次访问时直接代理上游），不等待下载
+    base64: 等待下载完成后返回原始字节的 data URL（不解码、不重新编码）
+    """
+    if response_format == "base64":
+        data = await result.read()
+        result_image = f"data:{result.mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+    else:
+        result_image = result.url
+    return {"result_image": result_image, "result_url": result.url}
+
+
 @router.post("/by-point")
 async def segment_by_point(
     image: UploadFile = File(...),
@@ -223,7 +239,8 @@ async def inpaint_region(
     mask_base64: str = Form(...),
     prompt: str = Form(...),
     negative_prompt: Optional[str] = Form(None),
-    strength: float = Form(0.85)
+    strength: float = Form(0.85),
+    response_format: str = Form("url", description="结果格式: url / base64")
 ):
     """
     局部替换 (Inpainting)
@@ -233,6 +250,7 @@ async def inpaint_region(
     - **prompt**: 描述新内容的提示词
     - **negative_prompt**: 负向提示词
     - **strength**: 替换强度 (0-1)
+    - **response_format**: url（默认，结果地址）或 base64（data URL）
     """
     try:
         contents = await image.read()
@@ -242,7 +260,7 @@ async def inpaint_region(
         mask_image = Image.open(io.BytesIO(mask_data)).convert("L")
         mask_array = np.array(mask_image)
         
-        result_image = await inpaint_service.inpaint(
+        result = await inpaint_service.inpaint_result(
             image=pil_image,
             mask=mask_array,
             prompt=prompt,
@@ -250,14 +268,10 @@ async def inpaint_region(
             strength=strength
         )
         
-        result_b64 = image_to_base64(result_image, "PNG")
-        
         return JSONResponse({
             "code": 0,
             "message": "替换成功",
-            "data": {
-                "result_image": f"data:image/png;base64,{result_b64}"
-            }
+            "data": await result_payload(result, response_format)
         })
         
     except Exception as e:
@@ -273,7 +287,8 @@ async def replace_furniture(
     image: UploadFile = File(...),
     mask_base64: str = Form(...),
     furniture_type: str = Form(...),
-    style: str = Form("modern")
+    style: str = Form("modern"),
+    response_format: str = Form("url", description="结果格式: url / base64")
 ):
     """
     替换家具
@@ -282,6 +297,7 @@ async def replace_furniture(
     - **mask_base64**: 家具区域的mask
     - **furniture_type**: 家具类型 (sofa, chair, table, lamp, bed, desk, cabinet)
     - **style**: 风格 (modern, scandinavian, chinese, light_luxury, industrial)
+    - **response_format**: url（默认，结果地址）或 base64（data URL）
     """
     try:
         contents = await image.read()
@@ -291,21 +307,17 @@ async def replace_furniture(
         mask_image = Image.open(io.BytesIO(mask_data)).convert("L")
         mask_array = np.array(mask_image)
         
-        result_image = await inpaint_service.replace_furniture(
+        result = await inpaint_service.replace_furniture(
             image=pil_image,
             mask=mask_array,
             furniture_type=furniture_type,
             style=style
         )
         
-        result_b64 = image_to_base64(result_image, "PNG")
-        
         return JSONResponse({
             "code": 0,
             "message": "家具替换成功",
-            "data": {
-                "result_image": f"data:image/png;base64,{result_b64}"
-            }
+            "data": await result_payload(result, response_format)
         })
         
     except Exception as e:
@@ -321,7 +333,8 @@ async def replace_decoration(
     image: UploadFile = File(...),
     mask_base64: str = Form(...),
     decoration_type: str = Form(...),
-    description: Optional[str] = Form(None)
+    description: Optional[str] = Form(None),
+    response_format: str = Form("url", description="结果格式: url / base64")
 ):
     """
     替换装饰物
@@ -330,6 +343,7 @@ async def replace_decoration(
     - **mask_base64**: 装饰物区域的mask
     - **decoration_type**: 装饰物类型 (painting, plant, vase, curtain, rug, lamp)
     - **description**: 额外描述
+    - **response_format**: url（默认，结果地址）或 base64（data URL）
     """
     try:
         contents = await image.read()
@@ -339,21 +353,17 @@ async def replace_decoration(
         mask_image = Image.open(io.BytesIO(mask_data)).convert("L")
         mask_array = np.array(mask_image)
         
-        result_image = await inpaint_service.replace_decoration(
+        result = await inpaint_service.replace_decoration(
             image=pil_image,
             mask=mask_array,
             decoration_type=decoration_type,
             description=description
         )
         
-        result_b64 = image_to_base64(result_image, "PNG")
-        
         return JSONResponse({
             "code": 0,
             "message": "装饰物替换成功",
-            "data": {
-                "result_image": f"data:image/png;base64,{result_b64}"
-            }
+            "data": await result_payload(result, response_format)
         })
         
     except Exception as e:
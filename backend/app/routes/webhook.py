@@ -0,0 +1,53 @@
+"""
+回调路由
+接收 Grsai Nano Banana 任务完成通知
+"""
+
+import json
+from typing import Optional
+from fastapi import APIRouter, Request, Header, Query
+from fastapi.responses import JSONResponse
+
+from app.services.webhook_receiver import webhook_receiver
+
+
+router = APIRouter(prefix="/api/v1/webhooks", tags=["Webhook"])
+
+
+@router.post("/nano-banana")
+async def nano_banana_webhook(
+    request: Request,
+    token: Optional[str] = Query(None),
+    x_webhook_signature: Optional[str] = Header(None)
+):
+    """
+    Nano Banana 完成回调
+
+    - **token**: 回调密钥（附在回调 URL 上）
+    - **X-Webhook-Signature**: 或者使用请求体的 HMAC-SHA256 签名
+
+    同一任务的重复回调只处理一次。
+    """
+    body = await request.body()
+    if not webhook_receiver.verify(body, token, x_webhook_signature):
+        return JSONResponse({
+            "code": -1,
+            "message": "回调校验失败",
+            "data": None
+        }, status_code=401)
+
+    try:
+        payload = json.loads(body)
+        result = webhook_receiver.handle(payload)
+    except (ValueError, AttributeError) as e:
+        return JSONResponse({
+            "code": -1,
+            "message": f"回调格式错误: {str(e)}",
+            "data": None
+        }, status_code=400)
+
+    return JSONResponse({
+        "code": 0,
+        "message": "success",
+        "data": result
+    })
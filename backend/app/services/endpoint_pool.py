@@ -0,0 +1,195 @@
+"""
+上游镜像地址池
+同一服务商的多个基础地址（如 Grsai 的国内 / 海外域名），定期探测延迟，
+请求固定发往最快的健康地址，出错时自动切换
+
+- 探测: 对每个地址发一个轻量 GET（PROBE_PATH），记录响应头到达耗时的 EWMA；
+  任何 HTTP 响应（< 500）都视为可达
+- 粘性: 只有另一地址明显更快（耗时低于当前的 SWITCH_RATIO 倍）时才切换，避免来回抖动
+- 故障切换: 调用方请求出现网络错误或 5xx 时 report_failure()，与探测失败一起计入连续失败次数，
+  达到阈值即标记不健康并切换；不健康的地址在下一次探测成功后恢复
+- 所有地址都不健康时仍返回当前地址（让请求自己报错），不会返回空
+
+配置（环境变量，以 Grsai 为例）:
+    GRSAI_API_URLS               逗号分隔的基础地址，默认 GRSAI_API_URL 或国内 + 海外两个域名
+    GRSAI_PROBE_PATH             探测路径，默认 /
+    ENDPOINT_PROBE_INTERVAL      探测间隔（秒），默认 30
+    ENDPOINT_PROBE_TIMEOUT       探测超时（秒），默认 5
+    ENDPOINT_SWITCH_RATIO        切换阈值，默认 0.7
+    ENDPOINT_FAILURE_THRESHOLD   连续失败多少次标记不健康，默认 2
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Endpoint:
+    """一个镜像地址的探测状态"""
+    url: str
+    latency: Optional[float] = None
+    healthy: bool = True
+    failures: int = 0
+    last_probe: float = 0.0
+    last_error: Optional[str] = None
+
+
+class EndpointPool:
+    """一个服务商的镜像地址池"""
+
+    # 探测耗时 EWMA 系数
+    ALPHA = 0.3
+
+    def __init__(self, name: str, urls: List[str], probe_path: str = "/"):
+        if not urls:
+            raise ValueError(f"{name} 至少需要一个地址")
+        self.name = name
+        self.endpoints = [Endpoint(url.rstrip("/")) for url in dict.fromkeys(urls)]
+        self.probe_path = probe_path
+        self.probe_interval = float(os.getenv("ENDPOINT_PROBE_INTERVAL", "30"))
+        self.probe_timeout = float(os.getenv("ENDPOINT_PROBE_TIMEOUT", "5"))
+        self.switch_ratio = float(os.getenv("ENDPOINT_SWITCH_RATIO", "0.7"))
+        self.failure_threshold = int(os.getenv("ENDPOINT_FAILURE_THRESHOLD", "2"))
+
+        self._current = self.endpoints[0]
+        self._task: Optional[asyncio.Task] = None
+        self.switches = 0
+
+    @property
+    def url(self) -> str:
+        """当前使用的基础地址"""
+        return self._current.url
+
+    def _find(self, url: str) -> Optional[Endpoint]:
+        url = url.rstrip("/")
+        for endpoint in self.endpoints:
+            if endpoint.url == url:
+                return endpoint
+        return None
+
+    def _switch_to(self, endpoint: Endpoint, reason: str):
+        if endpoint is self._current:
+            return
+        logger.warning(f"[EndpointPool] {self.name} 切换 {self._current.url} -> {endpoint.url}（{reason}）")
+        self._current = endpoint
+        self.switches += 1
+
+    def _reselect(self):
+        """按健康状态和延迟重新选择（带粘性）"""
+        candidates = [e for e in self.endpoints if e.healthy]
+        if not candidates:
+            return
+        measured = [e for e in candidates if e.latency is not None]
+        fastest = min(measured, key=lambda e: e.latency) if measured else candidates[0]
+        current = self._current
+        if not current.healthy:
+            self._switch_to(fastest, "当前地址不可用")
+        elif fastest.latency is not None and current.latency is not None \
+                and fastest.latency < current.latency * self.switch_ratio:
+            self._switch_to(fastest, f"延迟 {fastest.latency * 1000:.0f}ms < {current.latency * 1000:.0f}ms")
+
+    def report_success(self, url: str):
+        """调用方请求成功"""
+        endpoint = self._find(url)
+        if endpoint is not None:
+            endpoint.failures = 0
+
+    def report_failure(self, url: str, error: str = ""):
+        """调用方请求出现网络错误或 5xx；连续失败达到阈值时标记不健康并切换"""
+        endpoint = self._find(url)
+        if endpoint is not None and self._record_failure(endpoint, error[:200]):
+            self._reselect()
+
+    def _record_failure(self, endpoint: Endpoint, error: str) -> bool:
+        """累计一次失败（请求或探测），返回是否因此被标记为不健康"""
+        endpoint.failures += 1
+        endpoint.last_error = error or endpoint.last_error
+        if endpoint.failures >= self.failure_threshold and endpoint.healthy:
+            endpoint.healthy = False
+            logger.warning(f"[EndpointPool] {self.name} {endpoint.url} 连续失败 {endpoint.failures} 次，标记不可用")
+            return True
+        return False
+
+    async def _probe(self, client: httpx.AsyncClient, endpoint: Endpoint):
+        started = time.monotonic()
+        try:
+            response = await client.get(f"{endpoint.url}{self.probe_path}", timeout=self.probe_timeout)
+            elapsed = time.monotonic() - started
+            if response.status_code >= 500:
+                raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+        except httpx.HTTPError as e:
+            # 与请求失败使用同一阈值，单次探测超时不会让地址下线
+            self._record_failure(endpoint, f"{type(e).__name__}: {str(e)[:200]}")
+        else:
+            endpoint.latency = elapsed if endpoint.latency is None else \
+                self.ALPHA * elapsed + (1 - self.ALPHA) * endpoint.latency
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.last_error = None
+        finally:
+            endpoint.last_probe = time.time()
+
+    async def probe(self):
+        """并发探测所有地址并重新选择"""
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(self._probe(client, e) for e in self.endpoints))
+        self._reselect()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.warning(f"[EndpointPool] {self.name} 探测异常: {str(e)}")
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        """启动后台定期探测（只有一个地址时不探测）"""
+        if len(self.endpoints) > 1 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "current": self._current.url,
+            "switches": self.switches,
+            "endpoints": [
+                {
+                    "url": e.url,
+                    "healthy": e.healthy,
+                    "latency_ms": round(e.latency * 1000, 1) if e.latency is not None else None,
+                    "failures": e.failures,
+                    "last_error": e.last_error
+                }
+                for e in self.endpoints
+            ]
+        }
+
+
+def _grsai_urls() -> List[str]:
+    urls = os.getenv("GRSAI_API_URLS")
+    if urls:
+        return [u.strip() for u in urls.split(",") if u.strip()]
+    if os.getenv("GRSAI_API_URL"):
+        return [os.getenv("GRSAI_API_URL")]
+    return ["https://grsai.dakka.com.cn", "https://grsaiapi.com"]
+
+
+# Grsai 镜像（国内 / 海外），Nano Banana 与 Inpaint 共用
+grsai_endpoints = EndpointPool("grsai", _grsai_urls(), probe_path=os.getenv("GRSAI_PROBE_PATH", "/"))
@@ -0,0 +1,74 @@
+"""
+进程内事件总线
+按任务ID发布/订阅任务进度事件（上游进度流、预览图、最终结果等）
+"""
+
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+
+class EventBus:
+    """
+    进程内事件总线
+
+    - publish: 向某个任务的所有订阅者推送事件，同时记住该任务的最新事件
+    - subscribe: 订阅某个任务，订阅时先收到最新事件（晚到的订阅者不会错过当前状态）
+    """
+
+    # 每个订阅队列的容量，满时丢弃最旧事件
+    QUEUE_SIZE = 100
+
+    # 保留最新事件的任务数上限
+    MAX_TRACKED = 5000
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._latest: "OrderedDict[str, dict]" = OrderedDict()
+
+    def publish(self, key: str, event: dict):
+        """发布事件"""
+        self._latest[key] = event
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.MAX_TRACKED:
+            self._latest.popitem(last=False)
+
+        for queue in self._subscribers.get(key, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def latest(self, key: str) -> Optional[dict]:
+        """获取某任务的最新事件"""
+        return self._latest.get(key)
+
+    @contextmanager
+    def subscribe(self, key: str) -> Iterator[asyncio.Queue]:
+        """
+        订阅任务事件
+
+        用法:
+            with event_bus.subscribe(task_id) as queue:
+                event = await queue.get()
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        latest = self._latest.get(key)
+        if latest is not None:
+            queue.put_nowait(latest)
+        self._subscribers.setdefault(key, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def subscriber_count(self, key: str) -> int:
+        return len(self._subscribers.get(key, ()))
+
+
+# 全局事件总线实例
+event_bus = EventBus()
@@ -0,0 +1,321 @@
+"""
+效果图生成流水线
+封装 预处理 → 提示词 → 生成 的公共步骤，供 /generate、多风格生成等接口复用
+"""
+
+import os
+import uuid
+import hashlib
+import aiofiles
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from app.services.llm_client import llm_client, DEFAULT_LLM_MODEL_PRIORITY
+from app.services.getgoapi_client import getgoapi_client, DEFAULT_MODEL_PRIORITY
+from app.services.image_processor import image_processor
+from app.services.single_flight import SingleFlight, make_key
+from app.services.result_cache import result_cache
+from app.services.quality_ladder import QualityPlan, quality_ladder
+from app.utils.prompt_builder import build_prompt, build_prompt_v2
+from app.utils.request_body import EncodedImage
+
+# 输入输出目录
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+INPUT_DIR = os.path.join(PROJECT_ROOT, "input")
+OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output")
+
+# 确保目录存在
+os.makedirs(INPUT_DIR, exist_ok=True)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# 前端比例 -> API易 支持的比例
+RATIO_MAP = {
+    "auto": "4:3",
+    "1:1": "1:1",
+    "16:9": "16:9",
+    "9:16": "9:16",
+    "4:3": "4:3",
+    "3:4": "3:4",
+}
+
+# 相同输入的并发请求合并：LLM 分析与图片生成各一层
+analysis_flight = SingleFlight("analysis-flight")
+generation_flight = SingleFlight("generation-flight")
+
+
+@dataclass
+class PreparedInput:
+    """预处理后的输入图片（一次上传只处理一次）"""
+    timestamp: str
+    task_id: str
+    input_filename: str
+    image: EncodedImage
+
+    @property
+    def content_hash(self) -> str:
+        """预处理后图片内容的哈希（预处理是确定性的，相同上传得到相同哈希）"""
+        cached = self.__dict__.get("_content_hash")
+        if cached is None:
+            cached = hashlib.sha256(self.image.data).hexdigest()
+            self.__dict__["_content_hash"] = cached
+        return cached
+
+    def output_path(self, tag: str = "output") -> Callable[[int], str]:
+        """返回输出文件路径生成函数，tag 用于区分同一任务下的不同结果"""
+        def _path(index: int) -> str:
+            return os.path.join(OUTPUT_DIR, f"{self.timestamp}_{self.task_id}_{tag}_{index}.png")
+        return _path
+
+
+def is_llm_enabled() -> bool:
+    """LLM 智能提示词开关"""
+    return os.getenv("USE_LLM_PROMPT", "true").lower() == "true"
+
+
+def map_aspect_ratio(aspect_ratio: str) -> str:
+    """映射宽高比"""
+    return RATIO_MAP.get(aspect_ratio, "4:3")
+
+
+def output_urls(images: List[dict]) -> List[str]:
+    """已写入 output 目录的图片 -> 访问 URL"""
+    return [f"/output/{os.path.basename(img['path'])}" for img in images]
+
+
+async def prepare_input(image_data: bytes) -> PreparedInput:
+    """预处理上传图片并保存到 input 目录"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    task_id = str(uuid.uuid4())[:8]
+    input_filename = f"{timestamp}_{task_id}_input.jpg"
+    input_path = os.path.join(INPUT_DIR, input_filename)
+
+    processed_image = image_processor.preprocess(image_data)
+    async with aiofiles.open(input_path, 'wb') as f:
+        await f.write(processed_image)
+
+    # 预处理结果固定为 JPEG，LLM 分析与生成共用同一份 Base64 编码
+    return PreparedInput(
+        timestamp=timestamp,
+        task_id=task_id,
+        input_filename=input_filename,
+        image=EncodedImage(processed_image, "image/jpeg")
+    )
+
+
+async def _run_analysis(key: str, analyze: Callable[[], Awaitable[dict]], use_cache: bool) -> dict:
+    """LLM 分析：先查缓存，未命中时合并并发请求，成功结果写入缓存"""
+    if use_cache:
+        cached = await result_cache.get(key)
+        if cached is not None:
+            print("[LLM] 命中分析缓存")
+            return cached["result"]
+
+    async def _analyze() -> dict:
+        result = await analyze()
+        if result.get("code") == 0:
+            await result_cache.put(key, {"result": result})
+        return result
+
+    result, _ = await analysis_flight.do(key, _analyze)
+    return result
+
+
+async def build_generation_prompt(
+    prepared: PreparedInput,
+    style: str,
+    room_type: Optional[str] = None,
+    custom_prompt: Optional[str] = None,
+    use_cache: bool = True,
+    use_llm: bool = True
+) -> Tuple[str, Optional[dict]]:
+    """
+    使用 LLM 智能分析并生成提示词，失败时回退到静态提示词
+
+    分析结果按 (输入图片, 风格, 房间类型, 自定义提示词) 缓存，
+    相同输入得到相同提示词，后续的生成结果缓存才能命中。
+    use_llm=False 时直接使用静态提示词（如低延迟的服务等级）。
+
+    Returns:
+        (提示词, LLM 分析结果或 None)
+    """
+    if not use_llm or not is_llm_enabled():
+        return build_prompt(style, room_type, custom_prompt), None
+
+    try:
+        print("[LLM] 开始分析毛坯房图片...")
+        # 相同图片与参数的并发分析只调用一次 LLM，保证重复请求得到相同提示词
+        key = make_key("analysis", prepared.content_hash, style, room_type, custom_prompt)
+        llm_result = await _run_analysis(key, lambda: llm_client.analyze_room_and_generate_prompt(
+            image_data=prepared.image,
+            style=style,
+            room_type=room_type,
+            custom_prompt=custom_prompt,
+            model=DEFAULT_LLM_MODEL_PRIORITY[0]
+        ), use_cache)
+
+        if llm_result.get("code") == 0:
+            llm_analysis = llm_result.get("data", {})
+            print("[LLM] 智能提示词生成成功")
+            return llm_analysis.get("enhanced_prompt", ""), llm_analysis
+
+        print(f"[LLM] 分析失败: {llm_result.get('message')}, 使用静态提示词")
+    except Exception as e:
+        print(f"[LLM] 异常: {str(e)}, 使用静态提示词")
+
+    return build_prompt(style, room_type, custom_prompt), None
+
+
+async def analyze_room_facts(
+    prepared: PreparedInput,
+    room_type: Optional[str] = None,
+    custom_prompt: Optional[str] = None,
+    use_cache: bool = True
+) -> Optional[dict]:
+    """
+    只做一次与风格无关的空间事实分析（多风格生成共用）
+
+    Returns:
+        分析结果（可直接作为 build_prompt_v2 的 llm_analysis），失败或关闭 LLM 时返回 None
+    """
+    if not is_llm_enabled():
+        return None
+
+    try:
+        print("[LLM] 开始分析空间事实...")
+        key = make_key("facts", prepared.content_hash, room_type, custom_prompt)
+        llm_result = await _run_analysis(key, lambda: llm_client.analyze_room_facts(
+            image_data=prepared.image,
+            room_type=room_type,
+            custom_prompt=custom_prompt,
+            model=DEFAULT_LLM_MODEL_PRIORITY[0]
+        ), use_cache)
+        if llm_result.get("code") == 0:
+            return llm_result["data"]["analysis"]
+        print(f"[LLM] 空间分析失败: {llm_result.get('message')}, 使用静态提示词")
+    except Exception as e:
+        print(f"[LLM] 异常: {str(e)}, 使用静态提示词")
+    return None
+
+
+def build_style_prompt(
+    style: str,
+    room_type: Optional[str],
+    room_facts: Optional[dict],
+    custom_prompt: Optional[str]
+) -> str:
+    """基于共享的空间事实为单个风格构建提示词"""
+    if room_facts is None:
+        return build_prompt(style, room_type, custom_prompt)
+    return build_prompt_v2(
+        style=style,
+        room_type=room_type,
+        llm_analysis=room_facts,
+        custom_prompt=custom_prompt,
+        preserve_structure=True
+    )
+
+
+async def _cached_images(key: str, output_path: Callable[[int], str]) -> Optional[dict]:
+    """结果缓存命中时把图片放到 output 目录并返回结果，未命中返回 None"""
+    cached = await result_cache.get(key)
+    if cached is None:
+        return None
+    try:
+        paths = await result_cache.materialize(cached["files"], output_path)
+    except OSError:
+        # 条目刚好被淘汰，按未命中处理
+        paths = None
+    if not paths:
+        return None
+    print(f"[Cache] 命中结果缓存 {key[:12]}")
+    return {
+        "code": 0,
+        "msg": "success",
+        "data": {
+            **cached["data"],
+            "images": [{"path": p, "mime_type": "image/png"} for p in paths],
+            "cached": True,
+            "coalesced": False
+        }
+    }
+
+
+async def generate_images(
+    prepared: PreparedInput,
+    prompt: str,
+    aspect_ratio: str,
+    image_size: str,
+    model_priority: Optional[List[str]] = None,
+    number_of_images: int = 1,
+    tag: str = "output",
+    use_cache: bool = True,
+    hedge_after: Optional[float] = None,
+    allow_degrade: bool = True
+) -> dict:
+    """
+    调用 API易 生成效果图（模型降级），图片流式写入 output 目录
+    
+    - 相同 (输入图片, 提示词, 模型列表, 比例, 尺寸, 数量) 的结果会被缓存，
+      命中时直接把缓存图片放到 output 目录，data.cached 为 True；use_cache=False 强制重新生成
+    - 相同参数的并发请求合并为一次上游调用，
+      后到的请求共享首个请求写出的图片，data.coalesced 为 True
+    - 上游负载高时按质量阶梯降低尺寸或切换快速模型，data.degraded 说明降级情况（未降级为 None）；
+      allow_degrade=False 时保持请求的尺寸与模型
+    - hedge_after 秒内未返回时发起对冲请求，见 GetGoAPIClient.generate_with_fallback
+    """
+    model_priority = model_priority or DEFAULT_MODEL_PRIORITY
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    output_path = prepared.output_path(tag)
+
+    def _key(models: List[str], size: str) -> str:
+        return make_key("generate", prepared.content_hash, prompt_hash, list(models), aspect_ratio, size, number_of_images)
+
+    # 原始质量的缓存命中时无需降级
+    key = _key(model_priority, image_size)
+    if use_cache:
+        cached = await _cached_images(key, output_path)
+        if cached is not None:
+            cached["data"]["degraded"] = None
+            return cached
+
+    if allow_degrade:
+        plan = quality_ladder.plan(image_size, model_priority)
+    else:
+        plan = QualityPlan(image_size, list(model_priority))
+    if plan.degraded:
+        print(f"[QualityLadder] {plan.reason}: {image_size} -> {plan.image_size}")
+        key = _key(plan.model_priority, plan.image_size)
+        if use_cache:
+            cached = await _cached_images(key, output_path)
+            if cached is not None:
+                cached["data"]["degraded"] = plan.describe()
+                return cached
+
+    async def _generate() -> dict:
+        async with quality_ladder.track():
+            result = await getgoapi_client.generate_with_fallback(
+                prompt=prompt,
+                reference_image=prepared.image,
+                model_priority=plan.model_priority,
+                aspect_ratio=aspect_ratio,
+                image_size=plan.image_size,
+                number_of_images=number_of_images,
+                output_path=output_path,
+                hedge_after=hedge_after
+            )
+        data = result.get("data") or {}
+        # 只缓存完整成功的结果（部分成功的多方案请求不缓存）
+        if result.get("code") == 0 and data.get("images") and not data.get("errors"):
+            meta = {k: v for k, v in data.items() if k != "images"}
+            await result_cache.put(key, {"data": meta}, [img["path"] for img in data["images"]])
+        return result
+
+    result, shared = await generation_flight.do(key, _generate)
+    if result.get("code") == 0 and result.get("data"):
+        # 复制一层，避免共享结果被各调用方修改
+        result = {
+            **result,
+            "data": {**result["data"], "cached": False, "coalesced": shared, "degraded": plan.describe()}
+        }
+    return result
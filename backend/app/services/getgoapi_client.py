@@ -5,12 +5,23 @@ API文档: https://api.apiyi.com
 """
 
 import os
+import time
 import base64
 import httpx
+import asyncio
 import logging
-from typing import Optional, List
+import itertools
+from datetime import datetime
+from typing import Optional, List, Union, Callable
 from enum import Enum
 
+from app.utils.request_body import EncodedImage, StreamingJSONBody
+from app.utils.response_stream import save_inline_images
+from app.utils.deadline import DeadlineExceeded, deadline_guard, httpx_timeout
+from app.services.rate_limiter import rate_limiter, RateLimitTimeout, retry_after_seconds
+from app.services.timeout_manager import adaptive_timeouts
+from app.services.reference_store import ReferenceHandle, handle_cache, content_key
+
 # 配置日志
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -46,8 +57,19 @@ class GetGoAPIClient:
     MAX_RETRIES = 3
     RETRY_DELAY = 2.0
     
-    # API 基础 URL (API易平台)
-    BASE_URL = "https://api.apiyi.com"
+    # 多变体生成时单个请求内的最大并发数
+    MAX_VARIANT_CONCURRENCY = int(os.getenv("MAX_VARIANT_CONCURRENCY", "4"))
+    
+    # 读超时上限（秒），有足够耗时样本后按 (模型, 尺寸) 自适应缩短
+    READ_TIMEOUT = 300.0
+    
+    # API 默认基础 URL (API易平台)
+    DEFAULT_BASE_URL = "https://api.apiyi.com"
+    
+    # Files API：参考图上传一次，之后以 fileUri 引用（需上游支持 /upload/v1beta/files）
+    FILES_API_ENABLED = os.getenv("GEMINI_FILES_API_ENABLED", "false").lower() == "true"
+    # 上传文件的有效期（秒），响应未给出 expirationTime 时使用；Gemini 为 48 小时
+    FILE_TTL = float(os.getenv("GEMINI_FILE_TTL", str(47 * 3600)))
     
     def __init__(self):
         # 增加超时时间
@@ -60,6 +82,11 @@ class GetGoAPIClient:
         """每次动态获取 API Key，不缓存"""
         return os.getenv("APIYI_KEY")
     
+    @property
+    def BASE_URL(self) -> str:
+        """API 基础 URL，可用 APIYI_BASE_URL 覆盖（如指向本地 mock 服务）"""
+        return os.getenv("APIYI_BASE_URL", self.DEFAULT_BASE_URL).rstrip("/")
+    
     def _get_headers(self) -> dict:
         """获取请求头"""
         if not self.api_key:
@@ -88,25 +115,99 @@ class GetGoAPIClient:
         else:
             return "image/jpeg"
     
+    def _encode_reference(
+        self, reference_image: Union[bytes, EncodedImage, ReferenceHandle]
+    ) -> Union[EncodedImage, ReferenceHandle]:
+        """包装参考图，已编码的或已上传的句柄直接复用"""
+        if isinstance(reference_image, (EncodedImage, ReferenceHandle)):
+            return reference_image
+        return EncodedImage(reference_image, self._detect_mime_type(reference_image))
+    
+    async def upload_reference(self, reference_image: EncodedImage) -> Optional[ReferenceHandle]:
+        """
+        通过 Files API 上传参考图，返回可在 fileData 中引用的句柄
+        
+        相同内容的句柄在有效期内缓存复用；上传失败时返回 None，调用方回退到 inlineData。
+        """
+        key = content_key(reference_image.data)
+        handle = handle_cache.get("gemini-files", key)
+        if handle is not None:
+            return handle
+        
+        limiter = rate_limiter.limiter("apiyi", "files")
+        try:
+            async with deadline_guard("上传参考图"), limiter.acquire():
+                headers = self._get_headers()
+                # 断点续传协议：先申请上传地址，再一次性上传并结束
+                start = await self.client.post(
+                    f"{self.BASE_URL}/upload/v1beta/files",
+                    headers={
+                        **headers,
+                        "X-Goog-Upload-Protocol": "resumable",
+                        "X-Goog-Upload-Command": "start",
+                        "X-Goog-Upload-Header-Content-Length": str(len(reference_image.data)),
+                        "X-Goog-Upload-Header-Content-Type": reference_image.mime_type
+                    },
+                    json={"file": {"display_name": f"reference-{key[:12]}"}},
+                    timeout=httpx_timeout(read=60.0)
+                )
+                upload_url = start.headers.get("x-goog-upload-url")
+                if start.status_code != 200 or not upload_url:
+                    raise httpx.HTTPError(f"申请上传地址失败: HTTP {start.status_code} {start.text[:200]}")
+                response = await self.client.post(
+                    upload_url,
+                    headers={
+                        "Authorization": headers["Authorization"],
+                        "Content-Type": reference_image.mime_type,
+                        "X-Goog-Upload-Offset": "0",
+                        "X-Goog-Upload-Command": "upload, finalize"
+                    },
+                    content=reference_image.data,
+                    timeout=httpx_timeout(read=120.0)
+                )
+                response.raise_for_status()
+                file = response.json().get("file", {})
+        except (RateLimitTimeout, DeadlineExceeded, httpx.HTTPError, ValueError) as e:
+            logger.warning(f"[API易] 参考图上传失败，改用 inlineData: {str(e)}")
+            return None
+        
+        uri = file.get("uri")
+        if not uri:
+            logger.warning("[API易] 参考图上传响应缺少 uri，改用 inlineData")
+            return None
+        expires_at = time.time() + self.FILE_TTL
+        if file.get("expirationTime"):
+            try:
+                expires_at = datetime.fromisoformat(file["expirationTime"].replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                pass
+        handle = ReferenceHandle(uri, file.get("mimeType", reference_image.mime_type), expires_at)
+        handle_cache.put("gemini-files", key, handle)
+        logger.info(f"[API易] 参考图已上传: {uri}")
+        return handle
+    
     async def generate_image(
         self,
         prompt: str,
-        reference_image: Optional[bytes] = None,
+        reference_image: Optional[Union[bytes, EncodedImage, ReferenceHandle]] = None,
         model: str = GetGoModel.GEMINI_3_PRO_IMAGE,
         aspect_ratio: str = AspectRatio.RATIO_4_3,
         image_size: str = ImageSize.SIZE_1K,
-        number_of_images: int = 1
+        number_of_images: int = 1,
+        output_path: Optional[Callable[[int], str]] = None
     ) -> dict:
         """
         生成室内设计效果图
         
         Args:
             prompt: 提示词
-            reference_image: 参考图片（原始字节数据）
+            reference_image: 参考图片（原始字节数据或已编码的 EncodedImage）
             model: 使用的模型
             aspect_ratio: 输出图像比例
             image_size: 输出图像大小
             number_of_images: 生成图片数量
+            output_path: 输出路径生成函数（图片序号 -> 文件路径）；
+                提供时响应以流式解析并直接写入文件，images 中返回 path 而非 data
         
         Returns:
             生成结果
@@ -114,16 +215,24 @@ class GetGoAPIClient:
         # 构建 parts
         parts = []
         
-        # 如果有参考图片，先添加图片
+        # 如果有参考图片，先添加图片：已上传的引用句柄，
+        # 否则内联（Base64 在发送时分块编码，不进入 JSON 字符串）
         if reference_image:
-            mime_type = self._detect_mime_type(reference_image)
-            image_base64 = self.image_to_base64(reference_image)
-            parts.append({
-                "inlineData": {
-                    "mimeType": mime_type,
-                    "data": image_base64
-                }
-            })
+            encoded_image = self._encode_reference(reference_image)
+            if isinstance(encoded_image, ReferenceHandle):
+                parts.append({
+                    "fileData": {
+                        "mimeType": encoded_image.mime_type,
+                        "fileUri": encoded_image.uri
+                    }
+                })
+            else:
+                parts.append({
+                    "inlineData": {
+                        "mimeType": encoded_image.mime_type,
+                        "data": encoded_image
+                    }
+                })
         
         # 添加提示词
         parts.append({"text": prompt})
@@ -146,67 +255,67 @@ class GetGoAPIClient:
         model_name = model.value if hasattr(model, 'value') else str(model)
         api_url = f"{self.BASE_URL}/v1beta/models/{model_name}:generateContent"
         
+        # 流式请求体：同一实例在每次重试时重新发送
+        body = StreamingJSONBody(payload)
+        limiter = rate_limiter.limiter("apiyi", model_name)
+        
         last_error = None
         for attempt in range(self.MAX_RETRIES):
+            read_timeout = None
             try:
                 logger.info(f"[API易] 尝试 {attempt + 1}/{self.MAX_RETRIES}，模型: {model}")
                 
-                response = await self.client.post(
-                    api_url,
-                    headers=self._get_headers(),
-                    json=payload
-                )
-                
-                # 检查响应状态
-                if response.status_code == 200:
-                    result = response.json()
+                # 按模型限流，超出部分排队等待；整个尝试不超过请求截止时间
+                async with deadline_guard(f"{model_name} 生成"), limiter.acquire():
+                    headers = {**self._get_headers(), **body.headers}
+                    read_timeout = adaptive_timeouts.read_timeout("apiyi", model_name, image_size, self.READ_TIMEOUT)
+                    timeout = httpx_timeout(read=read_timeout)
+                    started = time.monotonic()
                     
-                    # 解析响应
-                    candidates = result.get("candidates", [])
-                    if not candidates:
-                        return {
-                            "code": -1,
-                            "msg": "API 返回空结果",
-                            "data": None
-                        }
-                    
-                    # 提取图片数据
-                    images = []
-                    for candidate in candidates:
-                        content = candidate.get("content", {})
-                        parts = content.get("parts", [])
-                        for part in parts:
-                            inline_data = part.get("inlineData", {})
-                            if inline_data:
-                                image_base64 = inline_data.get("data", "")
-                                mime_type = inline_data.get("mimeType", "image/jpeg")
-                                if image_base64:
-                                    images.append({
-                                        "data": self.base64_to_image(image_base64),
-                                        "mime_type": mime_type
-                                    })
-                    
-                    if not images:
-                        return {
-                            "code": -1,
-                            "msg": "未获取到生成的图片",
-                            "data": None
-                        }
-                    
-                    logger.info(f"[API易] 生成成功，获取到 {len(images)} 张图片")
-                    return {
-                        "code": 0,
-                        "msg": "success",
-                        "data": {
-                            "images": images,
-                            "model": model
-                        }
-                    }
+                    if output_path is not None:
+                        # 流式模式：图片边接收边解码写入文件，不整体解析响应
+                        async with self.client.stream(
+                            "POST", api_url, headers=headers, content=body, timeout=timeout
+                        ) as response:
+                            if response.status_code == 200:
+                                # 记录首字节耗时（读超时限制的就是这段等待）
+                                adaptive_timeouts.record("apiyi", model_name, image_size, time.monotonic() - started)
+                                images, envelope = await save_inline_images(response.aiter_bytes(), output_path)
+                                if not images:
+                                    empty = b'"candidates"' not in envelope
+                                    return {
+                                        "code": -1,
+                                        "msg": "API 返回空结果" if empty else "未获取到生成的图片",
+                                        "data": None
+                                    }
+                                logger.info(f"[API易] 生成成功，已写入 {len(images)} 张图片")
+                                return {
+                                    "code": 0,
+                                    "msg": "success",
+                                    "data": {
+                                        "images": images,
+                                        "model": model
+                                    }
+                                }
+                            await response.aread()
+                    else:
+                        response = await self.client.post(api_url, headers=headers, content=body, timeout=timeout)
+                        
+                        # 检查响应状态
+                        if response.status_code == 200:
+                            adaptive_timeouts.record("apiyi", model_name, image_size, time.monotonic() - started)
+                            return self._parse_response(response.json(), model)
                 
                 # 处理错误响应
                 error_text = response.text
                 logger.warning(f"[API易] HTTP {response.status_code}: {error_text}")
                 
+                # 被限流：暂停该模型的令牌发放后重试
+                if response.status_code == 429:
+                    limiter.pause(retry_after_seconds(response))
+                    last_error = f"HTTP 429: {error_text}"
+                    continue
+                
                 # 如果是服务端错误，重试
                 if response.status_code >= 500:
                     last_error = f"HTTP {response.status_code}: {error_text}"
@@ -219,9 +328,28 @@ class GetGoAPIClient:
                     "data": None
                 }
                 
+            except (RateLimitTimeout, DeadlineExceeded) as e:
+                # 排队超时或请求截止时间已到，不再重试
+                logger.warning(f"[API易] {str(e)}")
+                return {
+                    "code": -1,
+                    "msg": str(e),
+                    "data": None
+                }
             except httpx.TimeoutException as e:
                 logger.warning(f"[API易] 超时: {str(e)}")
-                last_error = f"请求超时: {str(e)}"
+                last_error = f"请求超时 (timeout): {str(e)}"
+                # 读超时未被截止时间截短时，计入耗时分布
+                if isinstance(e, httpx.ReadTimeout) and read_timeout is not None and timeout.read == read_timeout:
+                    adaptive_timeouts.record_timeout("apiyi", model_name, image_size, read_timeout)
+                    if adaptive_timeouts.is_learned("apiyi", model_name, image_size):
+                        # 已超出该模型正常耗时的高分位：请求很可能卡住，不再重试同一模型，交给降级链
+                        logger.warning(f"[API易] {model_name} 超过自适应读超时 {read_timeout:.0f} 秒，切换模型")
+                        return {
+                            "code": -1,
+                            "msg": f"请求超时 (timeout {read_timeout:.0f}s): {str(e)}",
+                            "data": None
+                        }
                 continue
             except httpx.HTTPError as e:
                 logger.warning(f"[API易] 网络错误: {str(e)}")
@@ -239,14 +367,60 @@ class GetGoAPIClient:
             "data": None
         }
     
+    def _parse_response(self, result: dict, model: str) -> dict:
+        """解析完整读取的响应，提取图片字节数据"""
+        candidates = result.get("candidates", [])
+        if not candidates:
+            return {
+                "code": -1,
+                "msg": "API 返回空结果",
+                "data": None
+            }
+        
+        # 提取图片数据
+        images = []
+        for candidate in candidates:
+            content = candidate.get("content", {})
+            parts = content.get("parts", [])
+            for part in parts:
+                inline_data = part.get("inlineData", {})
+                if inline_data:
+                    image_base64 = inline_data.get("data", "")
+                    mime_type = inline_data.get("mimeType", "image/jpeg")
+                    if image_base64:
+                        images.append({
+                            "data": self.base64_to_image(image_base64),
+                            "mime_type": mime_type
+                        })
+        
+        if not images:
+            return {
+                "code": -1,
+                "msg": "未获取到生成的图片",
+                "data": None
+            }
+        
+        logger.info(f"[API易] 生成成功，获取到 {len(images)} 张图片")
+        return {
+            "code": 0,
+            "msg": "success",
+            "data": {
+                "images": images,
+                "model": model
+            }
+        }
+    
     async def generate_with_fallback(
         self,
         prompt: str,
-        reference_image: Optional[bytes] = None,
+        reference_image: Optional[Union[bytes, EncodedImage, ReferenceHandle]] = None,
         model_priority: Optional[List[str]] = None,
         aspect_ratio: str = AspectRatio.RATIO_4_3,
         image_size: str = ImageSize.SIZE_1K,
-        number_of_images: int = 1
+        number_of_images: int = 1,
+        output_path: Optional[Callable[[int], str]] = None,
+        max_concurrency: Optional[int] = None,
+        hedge_after: Optional[float] = None
     ) -> dict:
         """
         带模型降级的图片生成
@@ -257,7 +431,10 @@ class GetGoAPIClient:
             model_priority: 模型优先级列表
             aspect_ratio: 输出图像比例
             image_size: 输出图像大小
-            number_of_images: 生成图片数量
+            number_of_images: 生成图片数量（大于1时并发生成多个变体）
+            output_path: 输出路径生成函数，见 generate_image
+            max_concurrency: 多变体生成的并发上限，默认 MAX_VARIANT_CONCURRENCY
+            hedge_after: 对冲等待时间（秒），首选请求超过该时间未返回时并发发起对冲请求；None 不对冲
         
         Returns:
             生成结果
@@ -268,6 +445,37 @@ class GetGoAPIClient:
                 GetGoModel.GEMINI_25_FLASH_IMAGE,
             ]
         
+        # 参考图只编码一次（启用 Files API 时只上传一次），所有重试、模型、变体共用
+        if reference_image:
+            reference_image = self._encode_reference(reference_image)
+            if self.FILES_API_ENABLED and isinstance(reference_image, EncodedImage):
+                reference_image = await self.upload_reference(reference_image) or reference_image
+        
+        # 多变体：共用参考图与提示词，并发发起多次生成
+        if number_of_images > 1:
+            return await self._generate_variants(
+                prompt=prompt,
+                reference_image=reference_image,
+                model_priority=model_priority,
+                aspect_ratio=aspect_ratio,
+                image_size=image_size,
+                number_of_images=number_of_images,
+                output_path=output_path,
+                max_concurrency=max_concurrency or self.MAX_VARIANT_CONCURRENCY,
+                hedge_after=hedge_after
+            )
+        
+        if hedge_after is not None:
+            return await self._generate_hedged(
+                prompt=prompt,
+                reference_image=reference_image,
+                model_priority=model_priority,
+                aspect_ratio=aspect_ratio,
+                image_size=image_size,
+                output_path=output_path,
+                hedge_after=hedge_after
+            )
+        
         last_error = None
         for model in model_priority:
             logger.info(f"[API易] 尝试模型: {model}")
@@ -278,7 +486,8 @@ class GetGoAPIClient:
                 model=model,
                 aspect_ratio=aspect_ratio,
                 image_size=image_size,
-                number_of_images=number_of_images
+                number_of_images=1,
+                output_path=output_path
             )
             
             if result.get("code") == 0:
@@ -305,6 +514,155 @@ class GetGoAPIClient:
             "data": None
         }
     
+    async def _generate_hedged(
+        self,
+        prompt: str,
+        reference_image: Optional[Union[EncodedImage, ReferenceHandle]],
+        model_priority: List[str],
+        aspect_ratio: str,
+        image_size: str,
+        output_path: Optional[Callable[[int], str]],
+        hedge_after: float
+    ) -> dict:
+        """
+        对冲生成：首选请求 hedge_after 秒内未返回时，并发发起第二路请求，取先成功的结果
+        
+        第二路从降级链的下一个模型开始（只有一个模型时重复请求同一模型）；
+        任一路成功即取消另一路（另一路也已成功时删除其写出的文件），两路都失败时返回最后完成的一路的错误。
+        """
+        # 两路请求的输出文件序号不能冲突
+        counter = itertools.count()
+        attempt_output_path = None
+        if output_path is not None:
+            attempt_output_path = lambda _index: output_path(next(counter))
+        
+        def start(models: List[str]) -> asyncio.Task:
+            return asyncio.create_task(self.generate_with_fallback(
+                prompt=prompt,
+                reference_image=reference_image,
+                model_priority=models,
+                aspect_ratio=aspect_ratio,
+                image_size=image_size,
+                output_path=attempt_output_path
+            ))
+        
+        primary = start(model_priority)
+        tasks = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                hedge_models = list(model_priority[1:]) or list(model_priority[:1])
+                hedge_model = getattr(hedge_models[0], "value", hedge_models[0])
+                logger.info(f"[API易] 首选请求 {hedge_after:g} 秒未返回，发起对冲请求: {hedge_model}")
+                tasks.append(start(hedge_models))
+            
+            pending = set(tasks)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result.get("code") == 0:
+                        winner = task
+                        result["data"]["hedged"] = task is not primary
+                        return result
+            return result
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    # 被取消的一路会自行清理未写完的文件；已经成功完成的一路需要删除其结果
+                    if task.done() and not task.cancelled() and task.exception() is None:
+                        self._discard_images(task.result())
+    
+    @staticmethod
+    def _discard_images(result: dict):
+        """删除一次生成写到 output 目录的图片文件"""
+        if result.get("code") != 0:
+            return
+        for image in (result.get("data") or {}).get("images", []):
+            path = image.get("path")
+            if path and os.path.exists(path):
+                os.remove(path)
+                logger.info(f"[API易] 删除未采用的对冲结果: {os.path.basename(path)}")
+    
+    async def _generate_variants(
+        self,
+        prompt: str,
+        reference_image: Optional[Union[EncodedImage, ReferenceHandle]],
+        model_priority: List[str],
+        aspect_ratio: str,
+        image_size: str,
+        number_of_images: int,
+        output_path: Optional[Callable[[int], str]],
+        max_concurrency: int,
+        hedge_after: Optional[float] = None
+    ) -> dict:
+        """
+        并发生成多个变体，部分成功也返回已生成的图片
+        
+        每个变体独立走模型降级流程；输出文件序号按完成顺序分配，
+        图片在各自请求返回时立即写入。
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        # 所有变体共享的文件序号分配器
+        counter = itertools.count()
+        variant_output_path = None
+        if output_path is not None:
+            variant_output_path = lambda _index: output_path(next(counter))
+        
+        async def run_variant(variant: int) -> dict:
+            async with semaphore:
+                logger.info(f"[API易] 开始生成变体 {variant + 1}/{number_of_images}")
+                return await self.generate_with_fallback(
+                    prompt=prompt,
+                    reference_image=reference_image,
+                    model_priority=model_priority,
+                    aspect_ratio=aspect_ratio,
+                    image_size=image_size,
+                    output_path=variant_output_path,
+                    hedge_after=hedge_after
+                )
+        
+        results = await asyncio.gather(
+            *(run_variant(i) for i in range(number_of_images)),
+            return_exceptions=True
+        )
+        
+        images = []
+        used_models = []
+        errors = []
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(f"未知错误: {str(result)}")
+            elif result.get("code") == 0:
+                images.extend(result["data"]["images"])
+                used_models.append(result["data"]["used_model"])
+            else:
+                errors.append(result.get("msg", "生成失败"))
+        
+        if not images:
+            return {
+                "code": -1,
+                "msg": f"所有变体都生成失败，最后错误: {errors[-1] if errors else 'unknown'}",
+                "data": None
+            }
+        
+        logger.info(f"[API易] 变体生成完成: 成功 {len(used_models)}/{number_of_images}")
+        return {
+            "code": 0,
+            "msg": "success" if not errors else "partial success",
+            "data": {
+                "images": images,
+                "used_model": used_models[0],
+                "used_models": used_models,
+                "requested": number_of_images,
+                "errors": errors
+            }
+        }
+    
     async def close(self):
         """关闭客户端连接"""
         await self.client.aclose()
@@ -5,12 +5,18 @@ Inpainting 局部替换服务
 
 import os
 import io
+import time
 import base64
 import httpx
 from typing import Optional
 from PIL import Image
 import numpy as np
 
+from app.services.rate_limiter import rate_limiter, retry_after_seconds
+from app.services.endpoint_pool import grsai_endpoints
+from app.services.timeout_manager import adaptive_timeouts
+from app.services.lazy_result import LazyResult, lazy_results
+
 
 class InpaintService:
     """
@@ -20,7 +26,11 @@ class InpaintService:
     
     def __init__(self):
         self.api_key = os.getenv("GRSAI_API_KEY")
-        self.api_url = os.getenv("GRSAI_API_URL", "https://grsai.dakka.com.cn")
+    
+    @property
+    def api_url(self) -> str:
+        """当前使用的 Grsai 镜像地址（与 Nano Banana 共用地址池）"""
+        return grsai_endpoints.url
         
     def _image_to_base64(self, image: Image.Image, format: str = "PNG") -> str:
         """将PIL Image转换为base64字符串"""
@@ -45,7 +55,7 @@ class InpaintService:
         strength: float = 0.85
     ) -> Image.Image:
         """
-        执行局部替换
+        执行局部替换，返回解码后的图像（需要继续做图像变换时使用）
         
         Args:
             image: 原始图像
@@ -57,6 +67,22 @@ class InpaintService:
         Returns:
             替换后的图像
         """
+        result = await self.inpaint_result(image, mask, prompt, negative_prompt, strength)
+        return await result.image()
+    
+    async def inpaint_result(
+        self,
+        image: Image.Image,
+        mask: np.ndarray,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        strength: float = 0.85
+    ) -> LazyResult:
+        """
+        执行局部替换，返回上游结果 URL 的延迟结果（后台保存到 output 目录，不解码）
+        
+        参数同 inpaint()
+        """
         if image.mode != "RGB":
             image = image.convert("RGB")
         
@@ -83,18 +109,37 @@ class InpaintService:
                 "Content-Type": "application/json"
             }
             
-            response = await client.post(
-                f"{self.api_url}/api/v1/images/inpaint",
-                headers=headers,
-                json=payload
-            )
+            limiter = rate_limiter.limiter("grsai", "inpaint")
+            base_url = self.api_url
+            async with limiter.acquire():
+                read_timeout = adaptive_timeouts.read_timeout("grsai", "inpaint", "-", 300.0)
+                started = time.monotonic()
+                try:
+                    response = await client.post(
+                        f"{base_url}/api/v1/images/inpaint",
+                        headers=headers,
+                        json=payload,
+                        timeout=httpx.Timeout(300.0, read=read_timeout)
+                    )
+                except httpx.HTTPError as e:
+                    if isinstance(e, httpx.ReadTimeout):
+                        adaptive_timeouts.record_timeout("grsai", "inpaint", "-", read_timeout)
+                    else:
+                        grsai_endpoints.report_failure(base_url, str(e))
+                    raise
+            if response.status_code >= 500:
+                grsai_endpoints.report_failure(base_url, f"HTTP {response.status_code}")
+            else:
+                grsai_endpoints.report_success(base_url)
+            if response.status_code == 200:
+                adaptive_timeouts.record("grsai", "inpaint", "-", time.monotonic() - started)
+            if response.status_code == 429:
+                limiter.pause(retry_after_seconds(response))
             
             if response.status_code == 200:
                 result = response.json()
                 if result.get("code") == 0 and result.get("data", {}).get("output_urls"):
-                    output_url = result["data"]["output_urls"][0]
-                    img_response = await client.get(output_url)
-                    return Image.open(io.BytesIO(img_response.content))
+                    return lazy_results.create(result["data"]["output_urls"][0], tag="inpaint")
                 else:
                     raise Exception(f"Inpaint API error: {result.get('message', 'Unknown error')}")
             else:
@@ -106,7 +151,7 @@ class InpaintService:
         mask: np.ndarray,
         furniture_type: str,
         style: str = "modern"
-    ) -> Image.Image:
+    ) -> LazyResult:
         """
         替换家具
         
@@ -117,7 +162,7 @@ class InpaintService:
             style: 风格 (modern, scandinavian, chinese等)
             
         Returns:
-            替换后的图像
+            替换结果（延迟物化）
         """
         style_prompts = {
             "modern": "modern minimalist style, clean lines, elegant",
@@ -132,7 +177,7 @@ class InpaintService:
         prompt = f"high quality {furniture_type}, {style_desc}, interior design, professional photo, 8k"
         negative_prompt = "blurry, low quality, distorted, cartoon, anime, sketch"
         
-        return await self.inpaint(image, mask, prompt, negative_prompt)
+        return await self.inpaint_result(image, mask, prompt, negative_prompt)
     
     async def replace_decoration(
         self,
@@ -140,7 +185,7 @@ class InpaintService:
         mask: np.ndarray,
         decoration_type: str,
         description: Optional[str] = None
-    ) -> Image.Image:
+    ) -> LazyResult:
         """
         替换装饰物
         
@@ -151,7 +196,7 @@ class InpaintService:
             description: 额外描述
             
         Returns:
-            替换后的图像
+            替换结果（延迟物化）
         """
         decoration_prompts = {
             "painting": "beautiful framed artwork, oil painting, gallery quality",
@@ -171,7 +216,7 @@ class InpaintService:
         
         negative_prompt = "blurry, low quality, distorted, out of place"
         
-        return await self.inpaint(image, mask, prompt, negative_prompt)
+        return await self.inpaint_result(image, mask, prompt, negative_prompt)
 
 
 inpaint_service = InpaintService()
@@ -0,0 +1,142 @@
+"""
+生成任务调度策略
+决定任务的优先级、所属用户、成本估计，以及排队位置与预计完成时间
+
+- 优先级: interactive（交互式单间）> standard > bulk（批量订单），高优先级的任务总是先被领取；
+  同一用户在途任务少于 JOB_BULK_THRESHOLD 个为 interactive，否则为 bulk；
+  请求指定的优先级只能比该默认值更低（不能把批量订单全部标为 interactive 挤占其他用户）
+- 同一优先级内按用户加权公平排队（start-time fair queuing）: 每个任务的虚拟完成时间 =
+  max(系统虚拟时间, 该用户上一个任务的虚拟完成时间) + 成本 / 用户权重，按虚拟完成时间领取；
+  一个用户一次提交 40 间也只按权重分得一份处理能力，其他用户的任务不必排在其后
+- 成本: 模型系数 × 尺寸系数（nano-banana 1K 为 1），4K pro 约为 1K 预览的 8 倍
+- 预计完成时间: 排在前面的任务成本之和 / 总并发 × 每单位成本的实际耗时（由最近完成的任务统计）
+
+用户标识: 已配置的 X-API-Key（JOB_OWNER_WEIGHTS 或 SERVICE_TIER_API_KEYS 中的 Key，取哈希）> 客户端 IP；
+未配置的 Key 不作为身份（否则客户端可以随意生成新身份绕过 bulk 阈值和公平排队）。
+客户端 IP 取 X-Forwarded-For 中由受信代理追加的地址（Railway 等平台的边缘代理），客户端自己填写的部分不采信
+
+配置（环境变量）:
+    JOB_BULK_THRESHOLD       同一用户在途任务达到该数量后新任务默认为 bulk，默认 3
+    JOB_OWNER_WEIGHTS        用户权重，如 "api-key-a:3,api-key-b:2"（按原始 API Key 配置），默认 1
+    TRUSTED_PROXY_HOPS       API 前面的受信代理层数（Railway 为 1），0 表示直接使用连接地址，默认 1
+    JOB_CAPACITY             所有 worker 的总并发数（用于预计完成时间），默认 JOB_WORKER_CONCURRENCY × JOB_WORKER_PROCESSES
+    JOB_COST_UNIT_SECONDS    没有历史数据时每单位成本的耗时（秒），默认 45
+"""
+
+import os
+import hashlib
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from app.models.task import Task, TaskStatus
+from app.services.job_store import job_store
+from app.services.service_tiers import service_tiers
+
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# 优先级名称 -> 数值（越小越先领取）
+PRIORITY_CLASSES: Dict[str, int] = {"interactive": 0, "standard": 1, "bulk": 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITY_CLASSES.items()}
+
+# 成本系数
+MODEL_COST = {
+    "nano-banana-fast": 0.5,
+    "nano-banana": 1.0,
+    "nano-banana-pro": 2.0,
+    "nano-banana-pro-vt": 2.0,
+    "nano-banana-pro-cl": 2.0,
+    "nano-banana-pro-vip": 2.0,
+    "nano-banana-pro-4k-vip": 2.0,
+}
+SIZE_COST = {"1K": 1.0, "2K": 1.8, "4K": 4.0}
+
+
+def estimate_cost(model: str, image_size: str) -> float:
+    """按模型和尺寸估计任务成本（nano-banana 1K = 1）"""
+    return MODEL_COST.get(model, 1.0) * SIZE_COST.get(image_size.upper(), 1.0)
+
+
+def client_ip(forwarded_for: Optional[str], peer: Optional[str], trusted_hops: int = TRUSTED_PROXY_HOPS) -> Optional[str]:
+    """
+    客户端真实地址
+
+    每层代理在 X-Forwarded-For 末尾追加它看到的来源地址，只有最后 trusted_hops 个是受信代理写入的；
+    取其中最靠前的一个，客户端伪造的前缀被忽略。没有该请求头时（未经代理）使用连接地址
+    """
+    hops = [item.strip() for item in (forwarded_for or "").split(",") if item.strip()]
+    if trusted_hops <= 0 or not hops:
+        return peer
+    return hops[-min(trusted_hops, len(hops))]
+
+
+class JobScheduler:
+    """任务调度策略"""
+
+    def __init__(self):
+        self.bulk_threshold = int(os.getenv("JOB_BULK_THRESHOLD", "3"))
+        self.weights: Dict[str, float] = {}
+        for item in os.getenv("JOB_OWNER_WEIGHTS", "").split(","):
+            key, _, weight = item.strip().rpartition(":")
+            if key and weight:
+                self.weights[key] = float(weight)
+        default_capacity = int(os.getenv("JOB_WORKER_CONCURRENCY", "2")) * int(os.getenv("JOB_WORKER_PROCESSES", "1"))
+        self.capacity = max(1, int(os.getenv("JOB_CAPACITY", str(default_capacity))))
+        self.default_unit_seconds = float(os.getenv("JOB_COST_UNIT_SECONDS", "45"))
+
+    def resolve_owner(self, api_key: Optional[str] = None, client_ip: Optional[str] = None) -> Tuple[str, float]:
+        """
+        确定任务所属用户与权重：已配置的 API Key 按 Key 区分，其他请求按客户端 IP
+
+        Returns:
+            (用户标识, 权重)；API Key 只保存哈希
+        """
+        if api_key and (api_key in self.weights or api_key in service_tiers.api_keys):
+            owner = "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+            return owner, self.weights.get(api_key, 1.0)
+        return f"ip:{client_ip or 'unknown'}", 1.0
+
+    async def resolve_priority(self, owner: str, requested: Optional[str] = None) -> int:
+        """
+        确定优先级: 按在途任务数得到默认优先级，请求指定的优先级只能降低不能提高
+
+        Raises:
+            ValueError: 优先级名称不存在
+        """
+        name = None
+        if requested:
+            name = requested.strip().lower()
+            if name not in PRIORITY_CLASSES:
+                raise ValueError(f"不支持的优先级: {name}，可选: {', '.join(PRIORITY_CLASSES)}")
+        active = await job_store.owner_active(owner)
+        default = PRIORITY_CLASSES["bulk" if active >= self.bulk_threshold else "interactive"]
+        return max(default, PRIORITY_CLASSES[name]) if name else default
+
+    async def queue_info(self, task: Task) -> dict:
+        """
+        排队位置与预计完成时间
+
+        Returns:
+            priority / queue_position（排在前面的待处理任务数，0 表示下一个）/ eta_seconds
+        """
+        info = {"priority": PRIORITY_NAMES.get(task.priority, str(task.priority)), "cost": task.cost}
+        if task.finished:
+            return {**info, "queue_position": None, "eta_seconds": None}
+
+        unit = await job_store.seconds_per_cost() or self.default_unit_seconds
+        now = datetime.now()
+        if task.status == TaskStatus.PROCESSING:
+            elapsed = (now - task.started_at).total_seconds() if task.started_at else 0.0
+            return {**info, "queue_position": None, "eta_seconds": round(max(0.0, task.cost * unit - elapsed))}
+
+        position, ahead_cost = await job_store.queue_position(task)
+        # 执行中任务的剩余工作量
+        running = 0.0
+        for cost, started_at in await job_store.processing():
+            elapsed = (now - started_at).total_seconds() if started_at else 0.0
+            running += max(0.0, cost * unit - elapsed)
+        wait = (ahead_cost * unit + running) / self.capacity
+        return {**info, "queue_position": position, "eta_seconds": round(wait + task.cost * unit)}
+
+
+# 全局实例
+job_scheduler = JobScheduler()
@@ -0,0 +1,321 @@
+"""
+生成任务存储（SQLite）
+/generate-async 提交的任务持久化到本地数据库，后台 worker 从中领取任务执行，
+/task/{task_id} 直接读取本地状态，不再依赖上游查询
+
+- 一个任务一行，字段与 app.models.task.Task 对应；列表字段以 JSON 文本保存
+- 启动时按 COLUMNS 自动补齐缺少的列（旧数据库无需手工迁移）
+- 领取任务在 BEGIN IMMEDIATE 事务内选出并标记，多个 worker（含其他进程）并发领取时同一任务只会被领取一次
+- 领取顺序: 优先级 → 加权公平排队的虚拟完成时间 → 提交时间（策略见 job_scheduler）
+- 处理中的任务由执行者定期续约（heartbeat_at）；执行者失联后由其他 worker 接管（见 job_worker.JobWorker.recover）
+- sqlite3 是同步接口，所有操作在线程池中执行，单连接 + 锁串行化
+
+配置（环境变量）:
+    JOB_STORE_PATH    数据库文件，默认 <项目根目录>/data/jobs.db
+"""
+
+import os
+import json
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.models.task import Task, TaskStatus
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(PROJECT_ROOT, "data", "jobs.db"))
+
+# 列名 -> 类型；新增字段只需在此追加
+COLUMNS: Dict[str, str] = {
+    "task_id": "TEXT PRIMARY KEY",
+    "status": "TEXT NOT NULL",
+    "style": "TEXT NOT NULL",
+    "room_type": "TEXT",
+    "custom_prompt": "TEXT",
+    "aspect_ratio": "TEXT",
+    "image_size": "TEXT",
+    "model": "TEXT",
+    "upload_path": "TEXT",
+    "input_image": "TEXT",
+    "prompt": "TEXT",
+    "progress": "INTEGER DEFAULT 0",
+    "original_image_url": "TEXT",
+    "result_image_url": "TEXT",
+    "result_urls": "TEXT",
+    "error_message": "TEXT",
+    "attempts": "INTEGER DEFAULT 0",
+    "worker_id": "TEXT",
+    "stage": "TEXT",
+    "upstream_task_id": "TEXT",
+    "heartbeat_at": "TEXT",
+    "priority": "INTEGER DEFAULT 1",
+    "owner": "TEXT",
+    "cost": "REAL DEFAULT 1",
+    "vstart": "REAL DEFAULT 0",
+    "vfinish": "REAL DEFAULT 0",
+    "created_at": "TEXT NOT NULL",
+    "updated_at": "TEXT NOT NULL",
+    "started_at": "TEXT",
+    "finished_at": "TEXT",
+}
+
+# 以 JSON 文本保存的字段
+JSON_FIELDS = {"result_urls"}
+
+
+def _to_row(values: dict) -> dict:
+    row = {}
+    for key, value in values.items():
+        if key in JSON_FIELDS:
+            value = json.dumps(value, ensure_ascii=False)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, TaskStatus):
+            value = value.value
+        row[key] = value
+    return row
+
+
+def _to_task(row: sqlite3.Row) -> Task:
+    values = dict(row)
+    for key in JSON_FIELDS:
+        values[key] = json.loads(values[key]) if values.get(key) else []
+    return Task(**{k: v for k, v in values.items() if k in Task.model_fields and v is not None})
+
+
+class JobStore:
+    """任务表"""
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # WAL: 读写互不阻塞，允许其他进程同时读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS jobs ({columns})")
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind.replace('PRIMARY KEY', '')}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, vfinish, created_at)")
+            # 调度器状态（系统虚拟时间）
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    async def _run(self, sql: str, params=()) -> List[sqlite3.Row]:
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    def _transact(self, fn: Callable[[sqlite3.Connection], object]):
+        """在写事务中执行（BEGIN IMMEDIATE 对其他进程同样互斥）"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _virtual_time(conn: sqlite3.Connection) -> float:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'virtual_time'").fetchone()
+        return row["value"] if row else 0.0
+
+    async def create(self, task: Task, weight: float = 1.0) -> Task:
+        """
+        登记任务，按所属用户和权重计算公平排队的虚拟开始 / 完成时间
+
+        Args:
+            weight: 所属用户的权重（越大分得的处理能力越多）
+        """
+        def insert(conn: sqlite3.Connection) -> Task:
+            last = conn.execute(
+                "SELECT MAX(vfinish) AS v FROM jobs WHERE owner = ? AND status IN (?, ?)",
+                (task.owner, TaskStatus.PENDING.value, TaskStatus.PROCESSING.value)
+            ).fetchone()["v"]
+            vstart = max(self._virtual_time(conn), last or 0.0)
+            created = task.model_copy(update={"vstart": vstart, "vfinish": vstart + task.cost / max(weight, 0.01)})
+            row = {k: v for k, v in _to_row(created.model_dump()).items() if k in COLUMNS}
+            placeholders = ", ".join(f":{k}" for k in row)
+            conn.execute(f"INSERT INTO jobs ({', '.join(row)}) VALUES ({placeholders})", row)
+            return created
+
+        return await asyncio.to_thread(self._transact, insert)
+
+    async def get(self, task_id: str) -> Optional[Task]:
+        rows = await self._run("SELECT * FROM jobs WHERE task_id = ?", (task_id,))
+        return _to_task(rows[0]) if rows else None
+
+    async def update(self, task_id: str, **fields) -> Optional[Task]:
+        """更新字段（自动刷新 updated_at），返回更新后的任务"""
+        fields["updated_at"] = datetime.now()
+        row = _to_row(fields)
+        assignments = ", ".join(f"{k} = :{k}" for k in row)
+        rows = await self._run(
+            f"UPDATE jobs SET {assignments} WHERE task_id = :task_id RETURNING *",
+            {**row, "task_id": task_id}
+        )
+        return _to_task(rows[0]) if rows else None
+
+    async def claim(self, worker_id: Optional[str] = None) -> Optional[Task]:
+        """
+        按 优先级 → 虚拟完成时间 → 提交时间 领取下一个待处理任务并标记为处理中；
+        没有待处理任务时返回 None
+
+        Args:
+            worker_id: 领取者标识（见 JobWorker.worker_id），记录在任务上
+        """
+        def pick(conn: sqlite3.Connection) -> Optional[Task]:
+            row = conn.execute(
+                "SELECT task_id, vstart FROM jobs WHERE status = ? ORDER BY priority, vfinish, created_at LIMIT 1",
+                (TaskStatus.PENDING.value,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = datetime.now().isoformat()
+            claimed = conn.execute(
+                """
+                UPDATE jobs
+                SET status = ?, started_at = ?, updated_at = ?, heartbeat_at = ?,
+                    attempts = attempts + 1, worker_id = ?, stage = 'preprocess'
+                WHERE task_id = ?
+                RETURNING *
+                """,
+                (TaskStatus.PROCESSING.value, now, now, now, worker_id, row["task_id"])
+            ).fetchone()
+            # 系统虚拟时间推进到正在服务的任务的虚拟开始时间
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('virtual_time', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (row["vstart"],)
+            )
+            return _to_task(claimed)
+
+        return await asyncio.to_thread(self._transact, pick)
+
+    async def heartbeat(self, worker_id: str) -> int:
+        """为某 worker 执行中的任务续约，返回任务数"""
+        rows = await self._run(
+            "UPDATE jobs SET heartbeat_at = ? WHERE worker_id = ? AND status = ? RETURNING task_id",
+            (datetime.now().isoformat(), worker_id, TaskStatus.PROCESSING.value)
+        )
+        return len(rows)
+
+    async def processing_tasks(self) -> List[Task]:
+        """所有处理中的任务"""
+        rows = await self._run("SELECT * FROM jobs WHERE status = ?", (TaskStatus.PROCESSING.value,))
+        return [_to_task(row) for row in rows]
+
+    async def reassign(self, task_id: str, expected_worker: Optional[str], **fields) -> Optional[Task]:
+        """
+        仅当任务仍处理中且执行者仍为 expected_worker 时更新字段（接管失联 worker 的任务），
+        多个 worker 同时接管同一任务时只有一个成功
+
+        Returns:
+            更新后的任务；已被其他 worker 接管或已结束时返回 None
+        """
+        fields["updated_at"] = datetime.now()
+        row = _to_row(fields)
+        assignments = ", ".join(f"{k} = :{k}" for k in row)
+        rows = await self._run(
+            f"UPDATE jobs SET {assignments} "
+            "WHERE task_id = :task_id AND status = :processing AND worker_id IS :expected_worker RETURNING *",
+            {**row, "task_id": task_id, "processing": TaskStatus.PROCESSING.value, "expected_worker": expected_worker}
+        )
+        return _to_task(rows[0]) if rows else None
+
+    async def owner_active(self, owner: str) -> int:
+        """某用户待处理与处理中的任务数"""
+        rows = await self._run(
+            "SELECT COUNT(*) AS n FROM jobs WHERE owner = ? AND status IN (?, ?)",
+            (owner, TaskStatus.PENDING.value, TaskStatus.PROCESSING.value)
+        )
+        return rows[0]["n"]
+
+    async def queue_position(self, task: Task) -> Tuple[int, float]:
+        """
+        排在该任务之前的待处理任务
+
+        Returns:
+            (任务数, 成本之和)
+        """
+        rows = await self._run(
+            """
+            SELECT COUNT(*) AS n, COALESCE(SUM(cost), 0) AS cost FROM jobs
+            WHERE status = :pending AND task_id != :task_id AND (
+                priority < :priority
+                OR (priority = :priority AND vfinish < :vfinish)
+                OR (priority = :priority AND vfinish = :vfinish AND created_at < :created_at)
+            )
+            """,
+            {
+                "pending": TaskStatus.PENDING.value,
+                "task_id": task.task_id,
+                "priority": task.priority,
+                "vfinish": task.vfinish,
+                "created_at": task.created_at.isoformat()
+            }
+        )
+        return rows[0]["n"], rows[0]["cost"]
+
+    async def processing(self) -> List[Tuple[float, Optional[datetime]]]:
+        """处理中任务的 (成本, 开始时间)"""
+        rows = await self._run("SELECT cost, started_at FROM jobs WHERE status = ?", (TaskStatus.PROCESSING.value,))
+        return [
+            (row["cost"] or 1.0, datetime.fromisoformat(row["started_at"]) if row["started_at"] else None)
+            for row in rows
+        ]
+
+    async def seconds_per_cost(self, samples: int = 50) -> Optional[float]:
+        """最近完成的任务每单位成本的平均耗时（秒），没有数据时返回 None"""
+        rows = await self._run(
+            """
+            SELECT AVG((julianday(finished_at) - julianday(started_at)) * 86400.0 / cost) AS unit FROM (
+                SELECT finished_at, started_at, cost FROM jobs
+                WHERE status = ? AND started_at IS NOT NULL AND finished_at IS NOT NULL AND cost > 0
+                ORDER BY finished_at DESC LIMIT ?
+            )
+            """,
+            (TaskStatus.COMPLETED.value, samples)
+        )
+        return rows[0]["unit"]
+
+    async def counts(self) -> Dict[str, int]:
+        rows = await self._run("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    async def pending_by_owner(self) -> Dict[str, dict]:
+        """各用户待处理任务的数量与成本"""
+        rows = await self._run(
+            "SELECT owner, COUNT(*) AS n, SUM(cost) AS cost FROM jobs WHERE status = ? GROUP BY owner",
+            (TaskStatus.PENDING.value,)
+        )
+        return {row["owner"]: {"pending": row["n"], "cost": round(row["cost"], 2)} for row in rows}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局实例
+job_store = JobStore()
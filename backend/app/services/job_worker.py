@@ -0,0 +1,451 @@
+"""
+后台生成任务
+/generate-async 只保存上传文件并登记任务，worker 领取任务后在后台执行完整流水线，
+HTTP 请求的生命周期与 30-90 秒的出图过程解耦
+
+流水线: 预处理 → 提示词（LLM 分析）→ Grsai Nano Banana 生成 → 结果流式保存到 output 目录
+
+- 各阶段的进度写入任务表，同时在事件总线上以本地 task_id 发布（GET /task/{task_id}/events）
+- 新任务提交后立即唤醒本进程的 worker；另有 JOB_POLL_INTERVAL 秒的轮询兜底
+- 单个任务的总耗时不超过 JOB_TIMEOUT 秒
+- JOB_WORKER_MODE=external 时 API 进程只登记任务、提供状态查询，
+  任务由独立的 worker 进程执行（python -m app.worker，见 app/worker.py）；
+  此时进度事件由 job_events() 轮询任务表得到
+- 崩溃恢复: 每个阶段和 Grsai 返回的上游任务ID都写入任务表；执行者每 JOB_HEARTBEAT_INTERVAL 秒为
+  执行中的任务续约。worker 启动时及此后定期检查处理中的任务，执行者已失联（续约超过 JOB_LEASE_TIMEOUT 秒，
+  或同一主机上的进程已不存在 / 已重启）的任务由本 worker 接管:
+  已提交到 Grsai 的继续等待原任务的结果（不重新提交，已付费的出图不会丢弃），
+  尚未提交的重新排队（沿用已生成的提示词），中断超过 JOB_MAX_ATTEMPTS 次的不再重试
+
+配置（环境变量）:
+    JOB_WORKER_MODE           inline（默认，API 进程内执行）/ external（独立 worker 进程执行）
+    JOB_WORKER_CONCURRENCY    每个进程并发执行的任务数，默认 2
+    JOB_POLL_INTERVAL         空闲时检查新任务的间隔（秒），默认 1
+    JOB_TIMEOUT               单个任务的时间预算（秒），默认 600
+    JOB_HEARTBEAT_INTERVAL    续约与检查失联任务的间隔（秒），默认 15
+    JOB_LEASE_TIMEOUT         超过该时间未续约的任务视为执行者失联（秒），默认 60
+    JOB_MAX_ATTEMPTS          尚未提交到上游的任务最多执行次数，默认 3
+"""
+
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import aiofiles
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Set
+
+from app.models.task import Task, TaskStatus
+from app.services.job_store import job_store
+from app.services.job_scheduler import estimate_cost
+from app.services.event_bus import event_bus
+from app.services.nano_banana import nano_banana_client
+from app.services.lazy_result import lazy_results
+from app.services.generation_pipeline import (
+    INPUT_DIR, prepare_input, build_generation_prompt, output_urls
+)
+from app.utils.deadline import Deadline, deadline_scope
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "inline").lower()
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "600"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+
+class JobFailed(Exception):
+    """任务执行失败（错误信息写入任务）"""
+
+
+async def submit_job(
+    image_data: bytes,
+    style: str,
+    room_type: Optional[str] = None,
+    custom_prompt: Optional[str] = None,
+    aspect_ratio: str = "auto",
+    image_size: str = "1K",
+    model: str = "nano-banana",
+    owner: Optional[str] = None,
+    weight: float = 1.0,
+    priority: int = 1
+) -> Task:
+    """
+    保存上传文件并登记待处理任务，返回任务
+
+    Args:
+        owner: 所属用户，weight: 该用户的权重，priority: 优先级（见 job_scheduler）
+    """
+    now = datetime.now()
+    task_id = uuid.uuid4().hex[:16]
+    upload_path = os.path.join(INPUT_DIR, f"{now.strftime('%Y%m%d_%H%M%S')}_{task_id}_upload")
+    async with aiofiles.open(upload_path, "wb") as f:
+        await f.write(image_data)
+
+    task = await job_store.create(Task(
+        task_id=task_id,
+        status=TaskStatus.PENDING,
+        stage="queued",
+        style=style,
+        room_type=room_type,
+        custom_prompt=custom_prompt,
+        aspect_ratio=aspect_ratio,
+        image_size=image_size,
+        model=model,
+        upload_path=upload_path,
+        owner=owner,
+        priority=priority,
+        cost=estimate_cost(model, image_size),
+        created_at=now,
+        updated_at=now
+    ), weight=weight)
+    job_worker.notify()
+    return task
+
+
+async def _progress(task: Task, progress: int, stage: str, **fields) -> Task:
+    """记录进度与阶段（检查点）并发布事件"""
+    task = await job_store.update(task.task_id, progress=progress, stage=stage, **fields) or task
+    event_bus.publish(task.task_id, {
+        "event": "progress",
+        "task_id": task.task_id,
+        "status": task.status.value,
+        "stage": stage,
+        "progress": progress
+    })
+    return task
+
+
+async def run_job(task: Task) -> Task:
+    """
+    执行一个已领取的任务，结束时写入终态
+
+    Returns:
+        更新后的任务
+    """
+    try:
+        with deadline_scope(Deadline(JOB_TIMEOUT)):
+            paths = await _run_pipeline(task)
+    except asyncio.CancelledError:
+        await _release(task.task_id)
+        raise
+    except JobFailed as e:
+        return await _finish(task, error=str(e))
+    except Exception as e:
+        logger.exception(f"[Job] {task.task_id} 异常")
+        return await _finish(task, error=f"未知错误: {str(e)}")
+    return await _finish(task, paths=paths)
+
+
+async def _run_pipeline(task: Task) -> List[str]:
+    if task.upstream_task_id:
+        # 进程重启前已提交到 Grsai: 继续等待原任务，不重新提交
+        logger.info(f"[Job] {task.task_id} 继续等待上游任务 {task.upstream_task_id}")
+        task = await _progress(task, 40, "generate")
+        result = await nano_banana_client.wait_for_task(task.upstream_task_id, model=task.model)
+    else:
+        result = await _generate(task)
+    if result.get("code") != 0:
+        raise JobFailed(result.get("msg", "生成失败"))
+    urls = [item["url"] for item in result.get("data", {}).get("results", []) if item.get("url")]
+    if not urls:
+        raise JobFailed("未获取到生成结果")
+    task = await _progress(task, 90, "store")
+
+    # 4. 结果流式保存到 output 目录
+    try:
+        return [await lazy_results.create(url, tag=f"{task.task_id}_output").wait() for url in urls]
+    except Exception as e:
+        raise JobFailed(f"结果保存失败: {str(e)}")
+
+
+async def _generate(task: Task) -> dict:
+    # 1. 预处理
+    async with aiofiles.open(task.upload_path, "rb") as f:
+        image_data = await f.read()
+    prepared = await prepare_input(image_data)
+    task = await _progress(task, 10, "preprocess", input_image=prepared.input_filename)
+
+    # 2. 提示词（重新排队的任务沿用上次生成的提示词）
+    prompt = task.prompt
+    if not prompt:
+        prompt, _ = await build_generation_prompt(prepared, task.style, task.room_type, task.custom_prompt)
+    task = await _progress(task, 30, "prompt", prompt=prompt)
+
+    # 3. 生成；拿到上游任务ID后立即写入任务表
+    async def checkpoint(upstream_task_id: str):
+        nonlocal task
+        task = await _progress(task, 40, "generate", upstream_task_id=upstream_task_id)
+
+    return await nano_banana_client.generate_and_wait(
+        prompt=prompt,
+        **(await nano_banana_client.reference_inputs(prepared.image.data, prepared.image.mime_type)),
+        model=task.model,
+        aspect_ratio=task.aspect_ratio,
+        image_size=task.image_size,
+        event_key=task.task_id,
+        on_submitted=checkpoint
+    )
+
+
+async def _release(task_id: str):
+    """
+    执行被取消（进程终止）时交还任务: 已提交到上游的留待其他 worker 接管，未提交的重新排队
+    """
+    try:
+        task = await job_store.get(task_id)
+        if task is None or task.finished:
+            return
+        if task.upstream_task_id:
+            await job_store.update(task_id, worker_id=None)
+        else:
+            await job_store.update(
+                task_id, status=TaskStatus.PENDING, stage="queued", progress=0, worker_id=None, started_at=None
+            )
+        logger.info(f"[Job] {task_id} 执行被取消，已交还任务")
+    except Exception as e:
+        logger.warning(f"[Job] {task_id} 交还任务失败: {str(e)}")
+
+
+async def _finish(task: Task, paths: Optional[List[str]] = None, error: Optional[str] = None) -> Task:
+    now = datetime.now()
+    if error is None:
+        urls = output_urls([{"path": p} for p in paths])
+        task = await job_store.update(
+            task.task_id, status=TaskStatus.COMPLETED, stage="done", progress=100, result_urls=urls,
+            result_image_url=urls[0], error_message=None, finished_at=now
+        ) or task
+        logger.info(f"[Job] {task.task_id} 完成: {urls}")
+    else:
+        task = await job_store.update(
+            task.task_id, status=TaskStatus.FAILED, error_message=error, finished_at=now
+        ) or task
+        logger.warning(f"[Job] {task.task_id} 失败: {error}")
+    event_bus.publish(task.task_id, {
+        "event": "result",
+        "task_id": task.task_id,
+        "status": task.status.value,
+        "progress": task.progress,
+        "output_urls": task.result_urls,
+        "error": task.error_message
+    })
+    return task
+
+
+async def job_events(task_id: str, interval: float = JOB_POLL_INTERVAL) -> AsyncIterator[dict]:
+    """
+    轮询任务表得到的进度事件（任务在其他进程执行时使用），状态或进度变化时产出，终态后结束
+    """
+    last = None
+    while True:
+        task = await job_store.get(task_id)
+        if task is None:
+            return
+        current = (task.status, task.progress)
+        if current != last:
+            last = current
+            event = {
+                "event": "result" if task.finished else "progress",
+                "task_id": task.task_id,
+                "status": task.status.value,
+                "progress": task.progress
+            }
+            if task.finished:
+                event.update(output_urls=task.result_urls, error=task.error_message)
+            yield event
+        if task.finished:
+            return
+        await asyncio.sleep(interval)
+
+
+def _pid_alive(pid: int) -> bool:
+    """本机进程是否存在"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobWorker:
+    """本进程内的任务执行者"""
+
+    def __init__(
+        self,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+        lease_timeout: float = JOB_LEASE_TIMEOUT
+    ):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.host = socket.gethostname()
+        # 主机名:进程号:实例标记（容器重启后进程号相同，靠实例标记区分）
+        self.worker_id = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+        self._resumed: Set[asyncio.Task] = set()
+        self._maintainer: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.running = 0
+        self.completed = 0
+        self.recovered = {"resumed": 0, "requeued": 0, "failed": 0}
+
+    @property
+    def inline(self) -> bool:
+        """任务是否在 API 进程内执行"""
+        return JOB_WORKER_MODE != "external"
+
+    def notify(self):
+        """有新任务时唤醒空闲的 worker"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _idle(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _execute(self, task: Task):
+        self.running += 1
+        try:
+            await run_job(task)
+        finally:
+            self.running -= 1
+            self.completed += 1
+
+    async def _loop(self, index: int):
+        while not self._stopping:
+            try:
+                task = await job_store.claim(self.worker_id)
+            except Exception as e:
+                logger.warning(f"[JobWorker] 领取任务失败: {str(e)}")
+                task = None
+            if task is None:
+                await self._idle()
+                continue
+            logger.info(f"[JobWorker] #{index} 开始任务 {task.task_id}")
+            await self._execute(task)
+
+    def _orphaned(self, task: Task, now: datetime) -> bool:
+        """处理中的任务的执行者是否已失联"""
+        if task.worker_id == self.worker_id:
+            return False
+        if not task.worker_id:
+            return True
+        host, _, rest = task.worker_id.partition(":")
+        pid = rest.split(":")[0]
+        if host == self.host and pid.isdigit():
+            # 同一主机: 进程号与本进程相同说明是重启前的实例，否则看进程是否还在
+            if int(pid) == os.getpid() or not _pid_alive(int(pid)):
+                return True
+        last_seen = task.heartbeat_at or task.started_at or task.updated_at
+        return (now - last_seen).total_seconds() > self.lease_timeout
+
+    async def recover(self) -> dict:
+        """
+        接管执行者已失联的处理中任务:
+        已提交到上游的由本 worker 继续等待结果，尚未提交的重新排队
+
+        Returns:
+            本次接管的任务数 {"resumed", "requeued", "failed"}
+        """
+        counts = {"resumed": 0, "requeued": 0, "failed": 0}
+        now = datetime.now()
+        for task in await job_store.processing_tasks():
+            if self._stopping or not self._orphaned(task, now):
+                continue
+            previous = task.worker_id
+            if task.upstream_task_id:
+                adopted = await job_store.reassign(task.task_id, previous, worker_id=self.worker_id, heartbeat_at=now)
+                if adopted is None:
+                    continue
+                counts["resumed"] += 1
+                resumed = asyncio.create_task(self._execute(adopted))
+                self._resumed.add(resumed)
+                resumed.add_done_callback(self._resumed.discard)
+            elif task.attempts >= JOB_MAX_ATTEMPTS:
+                adopted = await job_store.reassign(task.task_id, previous, worker_id=self.worker_id)
+                if adopted is None:
+                    continue
+                counts["failed"] += 1
+                await _finish(adopted, error=f"任务执行中断 {task.attempts} 次，不再重试")
+            else:
+                requeued = await job_store.reassign(
+                    task.task_id, previous,
+                    status=TaskStatus.PENDING, stage="queued", progress=0,
+                    worker_id=None, started_at=None, heartbeat_at=None
+                )
+                if requeued is not None:
+                    counts["requeued"] += 1
+            logger.warning(f"[JobWorker] 接管任务 {task.task_id}（原执行者 {previous}，阶段 {task.stage}）")
+        for key, value in counts.items():
+            self.recovered[key] += value
+        if counts["requeued"]:
+            self.notify()
+        return counts
+
+    async def _maintain(self):
+        """定期续约执行中的任务并检查失联任务（启动时立即检查一次）"""
+        while not self._stopping:
+            try:
+                await job_store.heartbeat(self.worker_id)
+                await self.recover()
+            except Exception as e:
+                logger.warning(f"[JobWorker] 续约 / 恢复任务失败: {str(e)}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def start(self):
+        """启动 worker（concurrency 为 0 时不执行任务）"""
+        if self._tasks:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._loop(i)) for i in range(self.concurrency)]
+        if self.concurrency > 0:
+            self._maintainer = asyncio.create_task(self._maintain())
+        logger.info(f"[JobWorker] {self.worker_id} 启动，并发 {self.concurrency}")
+
+    async def stop(self, grace: float = 0.0):
+        """
+        停止领取新任务；等待执行中的任务最多 grace 秒，之后取消（取消的任务交还给其他 worker）
+        """
+        self._stopping = True
+        self.notify()
+        tasks = self._tasks + list(self._resumed)
+        if tasks and grace > 0:
+            _, pending = await asyncio.wait(tasks, timeout=grace)
+            if pending:
+                logger.warning(f"[JobWorker] {len(pending)} 个任务未在 {grace:g} 秒内结束，强制取消")
+        if self._maintainer is not None:
+            tasks.append(self._maintainer)
+            self._maintainer = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._resumed.clear()
+
+    def stats(self) -> dict:
+        return {
+            "mode": "inline" if self.inline else "external",
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency if self._tasks else 0,
+            "running": self.running,
+            "completed": self.completed,
+            "recovered": dict(self.recovered)
+        }
+
+
+# 全局实例
+job_worker = JobWorker()
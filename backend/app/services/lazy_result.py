@@ -0,0 +1,223 @@
+"""
+延迟物化的结果图片
+Grsai 等服务商返回的是托管在上游的图片 URL。结果对象只保存 URL，后台把原始字节流式写入 output 目录，
+不解码、不重新编码；客户端在下载完成前访问时直接代理上游的字节流
+
+- 访问地址: GET /api/v1/results/{id}（下载完成后等价于 /output/ 下的本地文件）
+- 只有调用 image()（需要做图像变换时）才会解码为 PIL Image
+- 结果索引保存在内存中，超过 LAZY_RESULT_TTL 秒或超过 LAZY_RESULT_MAX_ENTRIES 条时淘汰（本地文件保留）；
+  本地文件名包含结果 id，索引淘汰或服务重启后同一地址按 id 找到本地文件继续提供
+
+配置（环境变量）:
+    LAZY_RESULT_TTL            结果索引保留时间（秒），默认 3600
+    LAZY_RESULT_MAX_ENTRIES    结果索引条数上限，默认 1000
+"""
+
+import io
+import os
+import glob
+import time
+import uuid
+import asyncio
+import logging
+import aiofiles
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output")
+
+CHUNK_SIZE = 64 * 1024
+
+# Content-Type -> 扩展名（未知类型按 .png 保存）
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+
+
+class LazyResult:
+    """一张托管在上游的结果图片"""
+
+    def __init__(self, source_url: str, tag: str):
+        self.id = uuid.uuid4().hex
+        self.source_url = source_url
+        self.tag = tag
+        self.created_at = time.time()
+        self.mime_type: Optional[str] = None
+        self.path: Optional[str] = None
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        """本服务的访问地址"""
+        return f"/api/v1/results/{self.id}"
+
+    @property
+    def ready(self) -> bool:
+        """是否已完整写入本地"""
+        return self.path is not None
+
+    async def wait(self) -> str:
+        """
+        等待后台下载完成
+
+        Returns:
+            本地文件路径
+
+        Raises:
+            httpx.HTTPError: 下载失败
+        """
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        if self.path is None:
+            raise httpx.HTTPError(self.error or "结果图片下载失败")
+        return self.path
+
+    async def read(self) -> bytes:
+        """原始字节（不解码）"""
+        async with aiofiles.open(await self.wait(), "rb") as f:
+            return await f.read()
+
+    async def image(self) -> Image.Image:
+        """解码为 PIL Image，仅在需要图像变换时使用"""
+        return Image.open(io.BytesIO(await self.read()))
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "source_url": self.source_url,
+            "ready": self.ready,
+            "mime_type": self.mime_type,
+            "error": self.error
+        }
+
+
+class LazyResultStore:
+    """结果索引与后台下载"""
+
+    def __init__(self, directory: str = OUTPUT_DIR):
+        self.directory = directory
+        self.ttl = float(os.getenv("LAZY_RESULT_TTL", "3600"))
+        self.max_entries = int(os.getenv("LAZY_RESULT_MAX_ENTRIES", "1000"))
+        self._results: "OrderedDict[str, LazyResult]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.proxied = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0), follow_redirects=True)
+        return self._client
+
+    def create(self, source_url: str, tag: str = "result") -> LazyResult:
+        """
+        登记一个上游结果并开始后台下载
+
+        Args:
+            source_url: 上游返回的图片 URL
+            tag: 本地文件名标记
+        """
+        result = LazyResult(source_url, tag)
+        self._evict()
+        self._results[result.id] = result
+        result._task = asyncio.create_task(self._download(result))
+        return result
+
+    def get(self, result_id: str) -> Optional[LazyResult]:
+        result = self._results.get(result_id)
+        if result is not None and time.time() - result.created_at > self.ttl:
+            self._results.pop(result_id, None)
+            return None
+        return result
+
+    def find_file(self, result_id: str) -> Optional[str]:
+        """按结果 id 查找已保存的本地文件（索引已淘汰或服务重启后使用）"""
+        if len(result_id) != 32 or any(c not in "0123456789abcdef" for c in result_id):
+            return None
+        matches = glob.glob(os.path.join(self.directory, f"*_{result_id}_*"))
+        return matches[0] if matches else None
+
+    def _evict(self):
+        now = time.time()
+        while self._results:
+            oldest = next(iter(self._results.values()))
+            if len(self._results) < self.max_entries and now - oldest.created_at <= self.ttl:
+                break
+            self._results.popitem(last=False)
+
+    async def _download(self, result: LazyResult):
+        """流式写入临时文件，完成后原子替换为正式文件名"""
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        tmp_path = os.path.join(self.directory, f".{result.id}.tmp")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            async with self.client.stream("GET", result.source_url) as response:
+                response.raise_for_status()
+                result.mime_type = response.headers.get("content-type", "image/png").split(";")[0]
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        await f.write(chunk)
+            path = os.path.join(
+                self.directory,
+                f"{timestamp}_{result.id}_{result.tag}{EXTENSIONS.get(result.mime_type, '.png')}"
+            )
+            os.replace(tmp_path, path)
+            result.path = path
+        except (httpx.HTTPError, OSError) as e:
+            result.error = f"{type(e).__name__}: {str(e)[:200]}"
+            logger.warning(f"[LazyResult] 下载失败 {result.source_url}: {result.error}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def open(self, result: LazyResult) -> Tuple[AsyncIterator[bytes], str]:
+        """
+        读取结果：已下载的读本地文件，否则代理上游字节流（不等待后台下载）
+
+        Returns:
+            (字节流, Content-Type)
+
+        Raises:
+            httpx.HTTPError: 上游不可访问
+        """
+        if result.ready:
+            return self._iter_file(result.path), result.mime_type or "image/png"
+
+        self.proxied += 1
+        request = self.client.build_request("GET", result.source_url)
+        response = await self.client.send(request, stream=True)
+        if response.status_code != 200:
+            await response.aclose()
+            raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=request, response=response)
+
+        async def proxy() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    yield chunk
+            finally:
+                await response.aclose()
+
+        return proxy(), response.headers.get("content-type", "image/png").split(";")[0]
+
+    @staticmethod
+    async def _iter_file(path: str) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                yield chunk
+
+    def stats(self) -> dict:
+        results = list(self._results.values())
+        return {
+            "entries": len(results),
+            "ready": sum(1 for r in results if r.ready),
+            "failed": sum(1 for r in results if r.error),
+            "proxied": self.proxied
+        }
+
+
+# 全局实例
+lazy_results = LazyResultStore()
@@ -4,13 +4,18 @@ LLM 客户端 - 智能提示词生成器
 """
 
 import os
+import time
 import httpx
 import base64
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Union
 from enum import Enum
 import json
 
 from app.utils.prompt_builder import GLOBAL_STRUCTURE_CONSTRAINTS, STYLE_PROMPTS, build_prompt_v2
+from app.utils.request_body import EncodedImage, StreamingJSONBody, as_encoded_image
+from app.utils.deadline import deadline_guard, httpx_timeout
+from app.services.rate_limiter import rate_limiter, retry_after_seconds
+from app.services.timeout_manager import adaptive_timeouts
 
 
 class LLMModel(str, Enum):
@@ -23,7 +28,6 @@ class LLMClient:
     """LLM 客户端 - API易平台"""
     
     def __init__(self):
-        self.BASE_URL = "https://api.apiyi.com"
         self.client = httpx.AsyncClient(timeout=60.0)
         self._api_key = None
     
@@ -34,13 +38,19 @@ class LLMClient:
             self._api_key = os.getenv("LLM_APIYI_KEY")
         return self._api_key
     
+    @property
+    def BASE_URL(self) -> str:
+        """API 基础 URL，可用 LLM_APIYI_BASE_URL（或 APIYI_BASE_URL）覆盖"""
+        url = os.getenv("LLM_APIYI_BASE_URL") or os.getenv("APIYI_BASE_URL") or "https://api.apiyi.com"
+        return url.rstrip("/")
+    
     def image_to_base64(self, image_data: bytes) -> str:
         """将图片数据转换为 base64"""
         return base64.b64encode(image_data).decode("utf-8")
     
     async def analyze_room_and_generate_prompt(
         self,
-        image_data: bytes,
+        image_data: Union[bytes, EncodedImage],
         style: str,
         room_type: Optional[str] = None,
         custom_prompt: Optional[str] = None,
@@ -50,7 +60,7 @@ class LLMClient:
         分析毛坯房图片并生成定制化装修提示词
         
         Args:
-            image_data: 毛坯房图片数据
+            image_data: 毛坯房图片数据（原始字节或已编码的 EncodedImage）
             style: 装修风格
             room_type: 房间类型
             custom_prompt: 用户自定义需求
@@ -62,16 +72,75 @@ class LLMClient:
         # 构建分析提示词
         analysis_prompt = self._build_analysis_prompt(style, room_type, custom_prompt)
         
-        # 准备请求数据
-        image_base64 = self.image_to_base64(image_data)
+        result = await self._request_analysis(image_data, analysis_prompt, model)
+        if result.get("code") != 0:
+            return result
+        
+        # 提取结构化信息
+        return self._parse_llm_response(result["data"], style, room_type, custom_prompt)
+    
+    async def analyze_room_facts(
+        self,
+        image_data: Union[bytes, EncodedImage],
+        room_type: Optional[str] = None,
+        custom_prompt: Optional[str] = None,
+        model: LLMModel = LLMModel.GEMINI_3_FLASH_PREVIEW
+    ) -> Dict[str, Any]:
+        """
+        只分析与风格无关的空间物理事实（多风格生成时共用一次分析）
+        
+        Args:
+            image_data: 毛坯房图片数据（原始字节或已编码的 EncodedImage）
+            room_type: 房间类型
+            custom_prompt: 用户自定义需求
+            model: LLM 模型
+            
+        Returns:
+            {"code": 0, "data": {"analysis": {"room_analysis": {...}}}}
+        """
+        fact_prompt = self._build_fact_prompt(room_type, custom_prompt)
+        
+        result = await self._request_analysis(image_data, fact_prompt, model)
+        if result.get("code") != 0:
+            return result
+        
+        try:
+            analysis_data = json.loads(self._extract_json(result["data"]))
+        except json.JSONDecodeError:
+            return {
+                "code": -1,
+                "message": "空间分析 JSON 解析失败",
+                "data": None
+            }
+        
+        # 只保留物理事实部分，设计建议由各风格的静态库提供
+        return {
+            "code": 0,
+            "message": "空间分析成功",
+            "data": {
+                "analysis": {"room_analysis": analysis_data.get("room_analysis", {})},
+                "room_type": room_type,
+                "custom_prompt": custom_prompt
+            }
+        }
+    
+    async def _request_analysis(
+        self,
+        image_data: Union[bytes, EncodedImage],
+        analysis_prompt: str,
+        model: LLMModel
+    ) -> Dict[str, Any]:
+        """发送图片 + 分析提示词，返回 LLM 的原始文本（data 字段）"""
+        # 准备请求数据（图片在发送时分块编码）
+        encoded_image = as_encoded_image(image_data, "image/jpeg")
         
         payload = {
             "contents": [{
                 "parts": [
                     {
                         "inlineData": {
-                            "mimeType": "image/jpeg",
-                            "data": image_base64
+                            "mimeType": encoded_image.mime_type,
+                            "data": encoded_image
                         }
                     },
                     {
@@ -91,13 +160,29 @@ class LLMClient:
         model_name = model.value if hasattr(model, 'value') else str(model)
         api_url = f"{self.BASE_URL}/v1beta/models/{model_name}:generateContent"
         
+        body = StreamingJSONBody(payload)
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
+            "Authorization": f"Bearer {self.api_key}",
+            **body.headers
         }
         
+        limiter = rate_limiter.limiter("apiyi", model_name)
         try:
-            response = await self.client.post(api_url, headers=headers, json=payload)
+            async with deadline_guard("LLM 分析"), limiter.acquire():
+                read_timeout = adaptive_timeouts.read_timeout("apiyi", model_name, "text", 60.0)
+                started = time.monotonic()
+                try:
+                    response = await self.client.post(
+                        api_url, headers=headers, content=body, timeout=httpx_timeout(read=read_timeout, connect=60.0)
+                    )
+                except httpx.ReadTimeout:
+                    adaptive_timeouts.record_timeout("apiyi", model_name, "text", read_timeout)
+                    raise
+            if response.status_code == 200:
+                adaptive_timeouts.record("apiyi", model_name, "text", time.monotonic() - started)
+            if response.status_code == 429:
+                limiter.pause(retry_after_seconds(response))
             response.raise_for_status()
             
             result = response.json()
@@ -105,9 +190,11 @@ class LLMClient:
             # 解析响应
             if "candidates" in result and len(result["candidates"]) > 0:
                 content = result["candidates"][0]["content"]["parts"][0]["text"]
-                
-                # 提取结构化信息
-                return self._parse_llm_response(content, style, room_type, custom_prompt)
+                return {
+                    "code": 0,
+                    "message": "success",
+                    "data": content
+                }
             else:
                 return {
                     "code": -1,
@@ -171,6 +258,50 @@ Output a single valid JSON object."""
         
         return prompt
     
+    def _build_fact_prompt(
+        self,
+        room_type: Optional[str],
+        custom_prompt: Optional[str]
+    ) -> str:
+        """构建与风格无关的空间事实分析提示词"""
+        
+        prompt = f"""You are a professional interior designer. Analyze this raw room image.
+
+Your task is to identify PHYSICAL FACTS about the space only. Do NOT suggest any style, colors or furniture.
+
+## Analysis Requirements:
+1. Identify the room type (is it a {room_type or 'unknown room'}?)
+2. Describe window positions, ceiling height, and floor material
+3. Note constraints relevant to user requirements: "{custom_prompt or 'none'}"
+
+## Output Format (Strict JSON):
+{{
+    "room_analysis": {{
+        "room_type": "identified room type",
+        "space_description": "physical space characteristics",
+        "physical_features": "window positions, ceiling height, floor material",
+        "lighting_analysis": "natural light direction and quality"
+    }}
+}}
+
+Output a single valid JSON object."""
+        
+        return prompt
+    
+    @staticmethod
+    def _extract_json(content: str) -> str:
+        """从 LLM 输出中提取 JSON 文本"""
+        if "```json" in content:
+            json_start = content.find("```json") + 7
+            json_end = content.find("```", json_start)
+            return content[json_start:json_end].strip()
+        elif content.strip().startswith("{"):
+            return content.strip()
+        else:
+            json_start = content.find("{")
+            json_end = content.rfind("}") + 1
+            return content[json_start:json_end]
+    
     def _parse_llm_response(
         self,
         content: str,
@@ -182,16 +313,7 @@ Output a single valid JSON object."""
         
         try:
             # 尝试解析 JSON（开启 JSON Mode 后应该直接是 JSON）
-            if "```json" in content:
-                json_start = content.find("```json") + 7
-                json_end = content.find("```", json_start)
-                json_str = content[json_start:json_end].strip()
-            elif content.strip().startswith("{"):
-                json_str = content.strip()
-            else:
-                json_start = content.find("{")
-                json_end = content.rfind("}") + 1
-                json_str = content[json_start:json_end]
+            json_str = self._extract_json(content)
             
             analysis_data = json.loads(json_str)
             
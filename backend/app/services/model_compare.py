@@ -0,0 +1,213 @@
+"""
+多模型对比
+同一张图、同一提示词并发交给多个模型生成，记录每个模型的耗时、输出大小，供按风格选型
+
+- API易（gemini-*）模型图片流式写入 output 目录；Grsai Nano Banana 模型等待任务完成后流式保存结果图
+- 各模型调用仍经过上游限流器，另有 COMPARE_MAX_CONCURRENCY 限制单次对比的并发数
+- 每个模型的结果、人工评分都以一行 JSON 追加到 COMPARE_LOG_PATH，summary() 按 (风格, 模型) 汇总
+
+配置（环境变量）:
+    COMPARE_LOG_PATH           对比记录文件，默认 <项目根目录>/compare_results/compare.jsonl
+    COMPARE_MAX_CONCURRENCY    单次对比的并发模型数，默认 4
+    COMPARE_MAX_MODELS         单次对比的模型数上限，默认 10
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import aiofiles
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.services.getgoapi_client import getgoapi_client, GetGoModel
+from app.services.nano_banana import nano_banana_client, NanoBananaModel
+from app.services.lazy_result import lazy_results
+from app.services.generation_pipeline import PROJECT_ROOT, PreparedInput, output_urls
+
+logger = logging.getLogger(__name__)
+
+COMPARE_LOG_PATH = os.getenv("COMPARE_LOG_PATH", os.path.join(PROJECT_ROOT, "compare_results", "compare.jsonl"))
+COMPARE_MAX_CONCURRENCY = int(os.getenv("COMPARE_MAX_CONCURRENCY", "4"))
+COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", "10"))
+
+# 可对比的模型 -> 服务商
+COMPARE_MODELS: Dict[str, str] = {
+    **{m.value: "apiyi" for m in GetGoModel},
+    **{m.value: "grsai" for m in NanoBananaModel},
+}
+
+
+def parse_models(text: str) -> List[str]:
+    """
+    解析逗号分隔的模型列表（去重，保持顺序）
+
+    Raises:
+        ValueError: 模型不支持、为空或超过上限
+    """
+    models = list(dict.fromkeys(m.strip() for m in text.split(",") if m.strip()))
+    if not models:
+        raise ValueError("请至少选择一个模型")
+    unknown = [m for m in models if m not in COMPARE_MODELS]
+    if unknown:
+        raise ValueError(f"不支持的模型: {', '.join(unknown)}，可选: {', '.join(COMPARE_MODELS)}")
+    if len(models) > COMPARE_MAX_MODELS:
+        raise ValueError(f"单次最多对比 {COMPARE_MAX_MODELS} 个模型")
+    return models
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class ModelComparer:
+    """多模型对比的执行与记录"""
+
+    def __init__(self, log_path: str = COMPARE_LOG_PATH, max_concurrency: int = COMPARE_MAX_CONCURRENCY):
+        self.log_path = log_path
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._write_lock = asyncio.Lock()
+
+    async def _generate_apiyi(self, prepared: PreparedInput, prompt: str, model: str,
+                              aspect_ratio: str, image_size: str) -> dict:
+        result = await getgoapi_client.generate_image(
+            prompt=prompt,
+            reference_image=prepared.image,
+            model=model,
+            aspect_ratio=aspect_ratio,
+            image_size=image_size,
+            output_path=prepared.output_path(f"compare_{model}")
+        )
+        if result.get("code") != 0:
+            return result
+        return {"code": 0, "images": [img["path"] for img in result["data"]["images"]]}
+
+    async def _generate_grsai(self, prepared: PreparedInput, prompt: str, model: str,
+                              aspect_ratio: str, image_size: str) -> dict:
+        result = await nano_banana_client.generate_and_wait(
+            prompt=prompt,
+            **(await nano_banana_client.reference_inputs(prepared.image.data, prepared.image.mime_type)),
+            model=model,
+            aspect_ratio=aspect_ratio,
+            image_size=image_size
+        )
+        if result.get("code") != 0:
+            return result
+        # 结果图流式保存到 output 目录，统一按本地文件统计大小
+        lazy = [lazy_results.create(item["url"], tag=f"compare_{model}")
+                for item in result.get("data", {}).get("results", [])]
+        paths = [await item.wait() for item in lazy]
+        if not paths:
+            return {"code": -1, "msg": "未获取到生成的图片"}
+        return {"code": 0, "images": paths}
+
+    async def run_model(self, prepared: PreparedInput, prompt: str, model: str,
+                        aspect_ratio: str, image_size: str) -> dict:
+        """
+        用一个模型生成并计时
+
+        Returns:
+            对比记录：model / provider / code / latency / bytes / output_urls / error
+        """
+        provider = COMPARE_MODELS[model]
+        generate = self._generate_apiyi if provider == "apiyi" else self._generate_grsai
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                result = await generate(prepared, prompt, model, aspect_ratio, image_size)
+            except Exception as e:
+                logger.warning(f"[Compare] {model} 异常: {str(e)}")
+                result = {"code": -1, "msg": f"未知错误: {str(e)}"}
+            latency = time.monotonic() - started
+
+        paths = result.get("images", []) if result.get("code") == 0 else []
+        return {
+            "model": model,
+            "provider": provider,
+            "code": 0 if paths else -1,
+            "latency": round(latency, 2),
+            "bytes": sum(os.path.getsize(p) for p in paths),
+            "output_urls": output_urls([{"path": p} for p in paths]),
+            "error": None if paths else result.get("msg", "生成失败")
+        }
+
+    async def record(self, entry: dict):
+        """追加一行对比记录"""
+        line = json.dumps({"time": datetime.now().isoformat(timespec="seconds"), **entry}, ensure_ascii=False)
+        async with self._write_lock:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            async with aiofiles.open(self.log_path, "a", encoding="utf-8") as f:
+                await f.write(line + "\n")
+
+    def _load(self) -> List[dict]:
+        if not os.path.exists(self.log_path):
+            return []
+        entries = []
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+    def has_result(self, run_id: str, model: str) -> bool:
+        """该次对比中是否记录过该模型的结果（评分只能针对已有结果）"""
+        return any(
+            e.get("type") == "result" and e.get("run_id") == run_id and e.get("model") == model
+            for e in self._load()
+        )
+
+    def summary(self, style: Optional[str] = None) -> List[dict]:
+        """
+        按 (风格, 模型) 汇总成功率、耗时分位数、平均大小和人工评分
+
+        Args:
+            style: 只汇总该风格，默认全部
+        """
+        entries = self._load()
+        # 评分按 (run_id, model) 关联到结果记录
+        run_styles = {e["run_id"]: e.get("style") for e in entries if e.get("type") == "result"}
+        groups: Dict[tuple, dict] = {}
+
+        def group(entry_style: Optional[str], model: str) -> dict:
+            return groups.setdefault((entry_style, model), {
+                "runs": 0, "succeeded": 0, "latencies": [], "bytes": [], "ratings": []
+            })
+
+        for entry in entries:
+            if entry.get("type") == "result":
+                item = group(entry.get("style"), entry["model"])
+                item["runs"] += 1
+                if entry.get("code") == 0:
+                    item["succeeded"] += 1
+                    item["latencies"].append(entry["latency"])
+                    item["bytes"].append(entry["bytes"])
+            elif entry.get("type") == "rating" and entry.get("run_id") in run_styles:
+                group(run_styles[entry["run_id"]], entry["model"])["ratings"].append(entry["score"])
+
+        rows = []
+        for (entry_style, model), item in sorted(groups.items(), key=lambda kv: (str(kv[0][0]), kv[0][1])):
+            if style and entry_style != style:
+                continue
+            rows.append({
+                "style": entry_style,
+                "model": model,
+                "provider": COMPARE_MODELS.get(model),
+                "runs": item["runs"],
+                "success_rate": round(item["succeeded"] / item["runs"], 3) if item["runs"] else None,
+                "latency_p50": _percentile(item["latencies"], 0.5),
+                "latency_p95": _percentile(item["latencies"], 0.95),
+                "avg_bytes": int(sum(item["bytes"]) / len(item["bytes"])) if item["bytes"] else None,
+                "ratings": len(item["ratings"]),
+                "avg_rating": round(sum(item["ratings"]) / len(item["ratings"]), 2) if item["ratings"] else None
+            })
+        return rows
+
+
+# 全局实例
+model_comparer = ModelComparer()
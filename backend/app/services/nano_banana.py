@@ -5,13 +5,22 @@ API文档: https://grsai.dakka.com.cn
 """
 
 import os
+import json
 import base64
 import httpx
 import asyncio
 import logging
-from typing import Optional, List, Union
+from contextlib import AsyncExitStack
+from typing import Awaitable, Callable, Optional, List, Union
 from enum import Enum
 
+from app.services.task_poller import TaskPoller
+from app.services.event_bus import event_bus
+from app.services.rate_limiter import rate_limiter, RateLimitTimeout, retry_after_seconds
+from app.services.endpoint_pool import grsai_endpoints
+from app.services.reference_store import reference_store
+from app.utils.deadline import DeadlineExceeded, deadline_guard, httpx_timeout, time_left
+
 # 配置日志
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -64,14 +73,18 @@ class NanoBananaClient:
     MAX_RETRIES = 3
     RETRY_DELAY = 2.0  # 秒
     
+    # 启用 webhook 时，轮询只作为安全网的最小间隔（秒）
+    WEBHOOK_SAFETY_INTERVAL = float(os.getenv("NANO_BANANA_WEBHOOK_SAFETY_INTERVAL", "30"))
+    
     def __init__(self):
         # 延迟获取环境变量，确保main.py已加载
         self._api_key = None
-        self._api_url = None
         # 增加超时时间，连接超时30秒，读取超时300秒
         self.client = httpx.AsyncClient(
             timeout=httpx.Timeout(connect=30.0, read=300.0, write=30.0, pool=30.0)
         )
+        # 所有在途任务共用一个轮询器
+        self.poller = TaskPoller(self.get_result)
     
     @property
     def api_key(self) -> str:
@@ -82,10 +95,24 @@ class NanoBananaClient:
     
     @property
     def api_url(self) -> str:
-        """动态获取API URL"""
-        if self._api_url is None:
-            self._api_url = os.getenv("GRSAI_API_URL", "https://grsai.dakka.com.cn")
-        return self._api_url
+        """当前使用的 Grsai 镜像地址（按探测延迟和健康状态选择，见 endpoint_pool）"""
+        return grsai_endpoints.url
+    
+    @property
+    def webhook_url(self) -> Optional[str]:
+        """
+        完成回调地址（NANO_BANANA_WEBHOOK_URL），未配置时返回 None 使用轮询
+        
+        Grsai 回调不带签名头，密钥以 token 查询参数附在 URL 上用于校验。
+        """
+        url = os.getenv("NANO_BANANA_WEBHOOK_URL")
+        if not url:
+            return None
+        secret = os.getenv("NANO_BANANA_WEBHOOK_SECRET")
+        if secret:
+            separator = "&" if "?" in url else "?"
+            url = f"{url}{separator}token={secret}"
+        return url
     
     def _get_headers(self) -> dict:
         """获取请求头"""
@@ -101,6 +128,52 @@ class NanoBananaClient:
         """将图片数据转换为Base64字符串"""
         return base64.b64encode(image_data).decode("utf-8")
     
+    async def reference_inputs(self, image_data: bytes, mime_type: str = "image/jpeg") -> dict:
+        """
+        参考图参数：配置了 PUBLIC_BASE_URL 时传本服务的签名 URL（有效期内复用同一 URL），
+        否则回退到 Base64
+        
+        Returns:
+            {"image_urls": [...]} 或 {"image_base64_list": [...]}，可直接展开传给生成方法
+        """
+        if reference_store.enabled:
+            url = await asyncio.to_thread(reference_store.signed_url, image_data, mime_type)
+            if url:
+                return {"image_urls": [url]}
+        return {"image_base64_list": [self.image_to_base64(image_data)]}
+    
+    @staticmethod
+    def _build_payload(
+        prompt: str,
+        image_urls: Optional[List[str]],
+        image_base64_list: Optional[List[str]],
+        model: str,
+        aspect_ratio: str,
+        image_size: str,
+        shut_progress: bool,
+        web_hook: str
+    ) -> dict:
+        """构建绘画接口请求体"""
+        # 构建urls参数（支持URL或Base64）
+        urls = []
+        if image_urls:
+            urls.extend(image_urls)
+        if image_base64_list:
+            urls.extend(image_base64_list)
+        
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "aspectRatio": aspect_ratio,
+            "imageSize": image_size,
+            "shutProgress": shut_progress,
+            "webHook": web_hook
+        }
+        
+        if urls:
+            payload["urls"] = urls
+        return payload
+    
     async def generate_image(
         self,
         prompt: str,
@@ -126,46 +199,49 @@ class NanoBananaClient:
         Returns:
             API响应结果
         """
-        # 构建urls参数（支持URL或Base64）
-        urls = []
-        if image_urls:
-            urls.extend(image_urls)
-        if image_base64_list:
-            urls.extend(image_base64_list)
-        
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "aspectRatio": aspect_ratio,
-            "imageSize": image_size,
-            "shutProgress": shut_progress,
-            "webHook": "-1"  # 使用轮询方式获取结果
-        }
-        
-        if urls:
-            payload["urls"] = urls
+        # 配置了回调地址时由 Grsai 主动通知完成，否则使用轮询方式获取结果
+        payload = self._build_payload(
+            prompt, image_urls, image_base64_list, model, aspect_ratio, image_size,
+            shut_progress=shut_progress,
+            web_hook=self.webhook_url or "-1"
+        )
+        limiter = rate_limiter.limiter("grsai", model)
         
         last_error = None
         for attempt in range(self.MAX_RETRIES):
+            # 每次尝试重新取地址：前一次失败触发镜像切换后，重试发往新的镜像
+            base_url = self.api_url
             try:
                 logger.info(f"[generate_image] 尝试 {attempt + 1}/{self.MAX_RETRIES}，模型: {model}")
-                response = await self.client.post(
-                    f"{self.api_url}/v1/draw/nano-banana",
-                    headers=self._get_headers(),
-                    json=payload
-                )
+                async with deadline_guard(f"{model} 提交"), limiter.acquire():
+                    response = await self.client.post(
+                        f"{base_url}/v1/draw/nano-banana",
+                        headers=self._get_headers(),
+                        json=payload,
+                        timeout=httpx_timeout(read=300.0)
+                    )
+                if response.status_code == 429:
+                    limiter.pause(retry_after_seconds(response))
                 response.raise_for_status()
+                grsai_endpoints.report_success(base_url)
                 result = response.json()
                 logger.info(f"[generate_image] 成功，task_id: {result.get('data', {}).get('id')}")
                 return result
+            except (RateLimitTimeout, DeadlineExceeded) as e:
+                logger.warning(f"[generate_image] {str(e)}")
+                return {"code": -1, "msg": str(e), "data": None}
             except httpx.TimeoutException as e:
                 last_error = f"请求超时: {str(e)}"
+                grsai_endpoints.report_failure(base_url, last_error)
                 logger.warning(f"[generate_image] 超时 (尝试 {attempt + 1}): {last_error}")
             except httpx.HTTPStatusError as e:
                 last_error = f"HTTP错误 {e.response.status_code}: {e.response.text[:200]}"
+                if e.response.status_code >= 500:
+                    grsai_endpoints.report_failure(base_url, last_error)
                 logger.warning(f"[generate_image] HTTP错误 (尝试 {attempt + 1}): {last_error}")
             except httpx.HTTPError as e:
                 last_error = f"网络错误: {str(e)}"
+                grsai_endpoints.report_failure(base_url, last_error)
                 logger.warning(f"[generate_image] 网络错误 (尝试 {attempt + 1}): {last_error}")
             except Exception as e:
                 last_error = f"未知错误: {str(e)}"
@@ -194,18 +270,32 @@ class NanoBananaClient:
         """
         payload = {"id": task_id}
         
+        limiter = rate_limiter.limiter("grsai", "result")
+        base_url = self.api_url
         try:
-            response = await self.client.post(
-                f"{self.api_url}/v1/draw/result",
-                headers=self._get_headers(),
-                json=payload
-            )
+            async with limiter.acquire():
+                response = await self.client.post(
+                    f"{base_url}/v1/draw/result",
+                    headers=self._get_headers(),
+                    json=payload
+                )
+            if response.status_code == 429:
+                limiter.pause(retry_after_seconds(response))
             response.raise_for_status()
+            grsai_endpoints.report_success(base_url)
             result = response.json()
             status = result.get('data', {}).get('status', 'unknown')
             logger.debug(f"[get_result] task_id={task_id}, status={status}")
             return result
+        except RateLimitTimeout as e:
+            logger.warning(f"[get_result] {str(e)}")
+            return {
+                "code": -1,
+                "msg": str(e),
+                "data": None
+            }
         except httpx.TimeoutException as e:
+            grsai_endpoints.report_failure(base_url, f"查询超时: {str(e)}")
             logger.warning(f"[get_result] 超时: {str(e)}")
             return {
                 "code": -1,
@@ -213,6 +303,8 @@ class NanoBananaClient:
                 "data": None
             }
         except httpx.HTTPError as e:
+            if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500:
+                grsai_endpoints.report_failure(base_url, f"获取结果失败: {str(e)}")
             logger.warning(f"[get_result] 网络错误: {str(e)}")
             return {
                 "code": -1,
@@ -220,6 +312,147 @@ class NanoBananaClient:
                 "data": None
             }
     
+    async def generate_stream(
+        self,
+        prompt: str,
+        image_urls: Optional[List[str]] = None,
+        image_base64_list: Optional[List[str]] = None,
+        model: str = NanoBananaModel.NANO_BANANA,
+        aspect_ratio: str = AspectRatio.AUTO,
+        image_size: str = ImageSize.SIZE_1K,
+        max_wait_seconds: int = 300,
+        event_key: Optional[str] = None,
+        on_submitted: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> dict:
+        """
+        流式生成：shutProgress=false，在一条长连接上接收进度，最终结果随流返回
+        
+        每条进度事件发布到事件总线（按上游任务ID，另可指定 event_key 作为别名，
+        如本地任务ID），无需再调用 /v1/draw/result。
+        连接在拿到终态前断开时，回退到共享轮询器等待结果。
+        
+        Args:
+            prompt: 提示词
+            image_urls: 参考图URL列表
+            image_base64_list: 参考图Base64列表
+            model: 使用的模型
+            aspect_ratio: 输出图像比例
+            image_size: 输出图像大小
+            max_wait_seconds: 最大等待时间（秒）
+            event_key: 额外发布进度事件的键
+            on_submitted: 拿到上游任务ID时调用（见 generate_and_wait）
+        
+        Returns:
+            与 generate_and_wait 相同结构的结果
+        """
+        # webHook 为空时接口以流的形式返回进度和结果
+        payload = self._build_payload(
+            prompt, image_urls, image_base64_list, model, aspect_ratio, image_size,
+            shut_progress=False,
+            web_hook=""
+        )
+        limiter = rate_limiter.limiter("grsai", model)
+        
+        task_id = None
+        last_error = None
+        for attempt in range(self.MAX_RETRIES):
+            base_url = self.api_url
+            try:
+                logger.info(f"[generate_stream] 尝试 {attempt + 1}/{self.MAX_RETRIES}，模型: {model}")
+                # 并发槽位只在提交期间占用（上游返回任务ID后释放，与非流式提交一致），进度流不超过请求截止时间
+                async with deadline_guard(f"{model} 进度流"), AsyncExitStack() as submit_slot:
+                    await submit_slot.enter_async_context(limiter.acquire())
+                    async with self.client.stream(
+                        "POST",
+                        f"{base_url}/v1/draw/nano-banana",
+                        headers=self._get_headers(),
+                        json=payload,
+                        timeout=httpx_timeout(read=max_wait_seconds)
+                    ) as response:
+                        if response.status_code != 200:
+                            await response.aread()
+                            if response.status_code == 429:
+                                limiter.pause(retry_after_seconds(response))
+                            response.raise_for_status()
+                        grsai_endpoints.report_success(base_url)
+                        
+                        async for line in response.aiter_lines():
+                            data = self._parse_progress_line(line)
+                            if data is None:
+                                continue
+                            if task_id is None and data.get("id"):
+                                task_id = data["id"]
+                                await submit_slot.aclose()
+                                await self._notify_submitted(on_submitted, task_id)
+                            event = {"event": "progress", "task_id": task_id, **data}
+                            if task_id:
+                                event_bus.publish(task_id, event)
+                            if event_key:
+                                event_bus.publish(event_key, event)
+                        
+                            status = data.get("status")
+                            if status == TaskStatus.SUCCEEDED:
+                                logger.info(f"[generate_stream] 生成成功！task_id={task_id}")
+                                return {"code": 0, "msg": "success", "data": data}
+                            if status == TaskStatus.FAILED:
+                                failure_reason = data.get('failure_reason', '')
+                                error_msg = data.get('error', '')
+                                logger.error(f"[generate_stream] 生成失败: {failure_reason} - {error_msg}")
+                                return {
+                                    "code": -1,
+                                    "msg": f"生成失败: {failure_reason} - {error_msg}",
+                                    "data": data
+                                }
+                last_error = "进度流在结束前关闭"
+            except (RateLimitTimeout, DeadlineExceeded) as e:
+                logger.warning(f"[generate_stream] {str(e)}")
+                return {"code": -1, "msg": str(e), "data": None}
+            except httpx.TimeoutException as e:
+                last_error = f"请求超时: {str(e)}"
+                if not task_id:
+                    grsai_endpoints.report_failure(base_url, last_error)
+            except httpx.HTTPStatusError as e:
+                last_error = f"HTTP错误 {e.response.status_code}: {e.response.text[:200]}"
+                if e.response.status_code >= 500:
+                    grsai_endpoints.report_failure(base_url, last_error)
+            except httpx.HTTPError as e:
+                last_error = f"网络错误: {str(e)}"
+                grsai_endpoints.report_failure(base_url, last_error)
+            except Exception as e:
+                last_error = f"未知错误: {str(e)}"
+            
+            # 任务已提交（拿到了ID），不再重复提交，改为轮询等待
+            if task_id:
+                logger.warning(f"[generate_stream] 进度流中断（{last_error}），改为轮询 task_id={task_id}")
+                return await self._wait_submitted(task_id, model, max_wait_seconds, 2.0, use_webhook=False)
+            
+            logger.warning(f"[generate_stream] 提交失败 (尝试 {attempt + 1}): {last_error}")
+            if attempt < self.MAX_RETRIES - 1:
+                await asyncio.sleep(self.RETRY_DELAY * (attempt + 1))
+        
+        return {
+            "code": -1,
+            "msg": f"API请求失败（已重试{self.MAX_RETRIES}次）: {last_error}",
+            "data": None
+        }
+    
+    @staticmethod
+    def _parse_progress_line(line: str) -> Optional[dict]:
+        """解析进度流中的一行（兼容 SSE 的 "data: " 前缀），非数据行返回 None"""
+        line = line.strip()
+        if line.startswith("data:"):
+            line = line[5:].strip()
+        if not line or line == "[DONE]" or not line.startswith("{"):
+            return None
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        # 兼容 {"code":0,"data":{...}} 包装
+        if isinstance(data.get("data"), dict):
+            return data["data"]
+        return data
+    
     async def generate_and_wait(
         self,
         prompt: str,
@@ -229,10 +462,13 @@ class NanoBananaClient:
         aspect_ratio: str = AspectRatio.AUTO,
         image_size: str = ImageSize.SIZE_1K,
         max_wait_seconds: int = 300,
-        poll_interval: float = 2.0
+        poll_interval: float = 2.0,
+        stream_progress: Optional[bool] = None,
+        event_key: Optional[str] = None,
+        on_submitted: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> dict:
         """
-        生成图片并等待结果（轮询模式）
+        生成图片并等待结果（轮询模式，或进度流模式）
         
         Args:
             prompt: 提示词
@@ -242,11 +478,36 @@ class NanoBananaClient:
             aspect_ratio: 输出图像比例
             image_size: 输出图像大小
             max_wait_seconds: 最大等待时间（秒）
-            poll_interval: 轮询间隔（秒）
+            poll_interval: 该模型尚无历史耗时数据时的轮询间隔（秒）
+            stream_progress: 是否使用进度流模式，默认读取 NANO_BANANA_STREAM_PROGRESS
+            event_key: 进度流模式下额外发布进度事件的键
+            on_submitted: 拿到上游任务ID时调用（调用方据此记录检查点，进程重启后用 wait_for_task 继续等待）
         
         Returns:
             生成结果
         """
+        if stream_progress is None:
+            stream_progress = os.getenv("NANO_BANANA_STREAM_PROGRESS", "false").lower() == "true"
+        
+        # 等待时间不超过请求剩余的截止时间
+        try:
+            max_wait_seconds = time_left(max_wait_seconds, "等待 Nano Banana 结果")
+        except DeadlineExceeded as e:
+            return {"code": -1, "msg": str(e), "data": None}
+        
+        if stream_progress:
+            return await self.generate_stream(
+                prompt=prompt,
+                image_urls=image_urls,
+                image_base64_list=image_base64_list,
+                model=model,
+                aspect_ratio=aspect_ratio,
+                image_size=image_size,
+                max_wait_seconds=max_wait_seconds,
+                event_key=event_key,
+                on_submitted=on_submitted
+            )
+        
         # 1. 提交生成任务
         submit_result = await self.generate_image(
             prompt=prompt,
@@ -264,54 +525,78 @@ class NanoBananaClient:
         task_id = submit_result.get("data", {}).get("id")
         if not task_id:
             return {"code": -1, "msg": "未获取到任务ID", "data": None}
+        await self._notify_submitted(on_submitted, task_id)
         
-        # 2. 轮询获取结果
-        elapsed = 0
-        consecutive_errors = 0
-        max_consecutive_errors = 5
+        # 2. 交给共享轮询器等待结果
+        return await self._wait_submitted(task_id, model, max_wait_seconds, poll_interval)
+    
+    async def wait_for_task(
+        self,
+        task_id: str,
+        model: str = NanoBananaModel.NANO_BANANA,
+        max_wait_seconds: int = 300,
+        poll_interval: float = 2.0
+    ) -> dict:
+        """
+        等待一个此前已提交的任务（如进程重启前提交的任务），不重新提交
         
-        logger.info(f"[generate_and_wait] 开始轮询，task_id={task_id}，最大等待{max_wait_seconds}秒")
+        Returns:
+            与 generate_and_wait 相同结构的结果
+        """
+        return await self._wait_submitted(task_id, model, max_wait_seconds, poll_interval)
+    
+    @staticmethod
+    async def _notify_submitted(callback: Optional[Callable[[str], Awaitable[None]]], task_id: str):
+        """通知调用方上游任务ID；回调失败不影响等待结果"""
+        if callback is None:
+            return
+        try:
+            await callback(task_id)
+        except Exception as e:
+            logger.warning(f"[generate_and_wait] 记录任务ID失败 task_id={task_id}: {str(e)}")
+    
+    async def _wait_submitted(
+        self,
+        task_id: str,
+        model: str,
+        max_wait_seconds: float,
+        poll_interval: float,
+        use_webhook: bool = True
+    ) -> dict:
+        """等待已提交任务结束（按模型历史耗时调度查询）"""
+        # 启用 webhook 时结果由回调直接送达，轮询仅作低频安全网
+        webhook_enabled = use_webhook and self.webhook_url is not None
+        try:
+            # 提交本身也消耗了预算，按剩余时间重新限制
+            max_wait_seconds = time_left(max_wait_seconds, "等待 Nano Banana 结果")
+        except DeadlineExceeded as e:
+            return {"code": -1, "msg": str(e), "data": {"id": task_id}}
+        logger.info(f"[generate_and_wait] 开始等待，task_id={task_id}，最大等待{max_wait_seconds}秒")
+        result = await self.poller.wait(
+            task_id,
+            model=str(model.value if hasattr(model, 'value') else model),
+            max_wait_seconds=max_wait_seconds,
+            default_interval=poll_interval,
+            min_interval=self.WEBHOOK_SAFETY_INTERVAL if webhook_enabled else 0.0
+        )
         
-        while elapsed < max_wait_seconds:
-            await asyncio.sleep(poll_interval)
-            elapsed += poll_interval
-            
-            result = await self.get_result(task_id)
-            
-            if result.get("code") != 0:
-                consecutive_errors += 1
-                if consecutive_errors >= max_consecutive_errors:
-                    logger.error(f"[generate_and_wait] 连续{max_consecutive_errors}次查询失败，放弃")
-                    return {
-                        "code": -1,
-                        "msg": f"查询结果连续失败{max_consecutive_errors}次: {result.get('msg')}",
-                        "data": {"task_id": task_id}
-                    }
-                continue
-            
-            consecutive_errors = 0  # 重置错误计数
-            data = result.get("data", {})
-            status = data.get("status")
-            progress = data.get("progress", 0)
-            
-            if elapsed % 10 < poll_interval:  # 每10秒打印一次进度
-                logger.info(f"[generate_and_wait] task_id={task_id}, status={status}, progress={progress}, elapsed={elapsed:.0f}s")
-            
-            if status == TaskStatus.SUCCEEDED:
-                logger.info(f"[generate_and_wait] 生成成功！task_id={task_id}，耗时{elapsed:.0f}秒")
-                return result
-            elif status == TaskStatus.FAILED:
-                failure_reason = data.get('failure_reason', '')
-                error_msg = data.get('error', '')
-                logger.error(f"[generate_and_wait] 生成失败: {failure_reason} - {error_msg}")
-                return {
-                    "code": -1,
-                    "msg": f"生成失败: {failure_reason} - {error_msg}",
-                    "data": data
-                }
-        
-        logger.error(f"[generate_and_wait] 超时！task_id={task_id}，已等待{max_wait_seconds}秒")
-        return {"code": -1, "msg": f"生成超时（已等待{max_wait_seconds}秒）", "data": {"task_id": task_id}}
+        if result.get("code") != 0:
+            logger.error(f"[generate_and_wait] task_id={task_id} 等待失败: {result.get('msg')}")
+            return result
+        
+        data = result.get("data", {})
+        if data.get("status") == TaskStatus.SUCCEEDED:
+            logger.info(f"[generate_and_wait] 生成成功！task_id={task_id}")
+            return result
+        
+        failure_reason = data.get('failure_reason', '')
+        error_msg = data.get('error', '')
+        logger.error(f"[generate_and_wait] 生成失败: {failure_reason} - {error_msg}")
+        return {
+            "code": -1,
+            "msg": f"生成失败: {failure_reason} - {error_msg}",
+            "data": data
+        }
     
     async def generate_with_fallback(
         self,
@@ -0,0 +1,211 @@
+"""
+负载自适应的质量阶梯
+上游排队积压时按配置的阶梯降低输出尺寸或切换快速模型，负载回落后逐级恢复
+
+- 负载压力 = max(在途生成数 / 在途上限, 最近耗时 EWMA / 目标耗时)
+- 压力 ≥ 1 时降一级，压力 ≤ 低水位时升一级；两次调整之间至少间隔冷却时间（滞回，避免来回抖动）
+- 超过 LATENCY_TTL 秒没有新样本时耗时信号失效，空闲后能恢复到原始质量
+- 每一级是对请求的上限：尺寸取较小者，模型限定在该级的模型列表内；不会提升请求的质量
+
+配置（环境变量）:
+    QUALITY_LADDER_ENABLED          是否启用，默认 true
+    QUALITY_LADDER_STEPS            阶梯，分号分隔，每级为 "最大尺寸[:模型1,模型2]"，
+                                    默认 "2K;1K;1K:gemini-2.5-flash-image"
+    QUALITY_LADDER_MAX_IN_FLIGHT    在途生成数上限，默认 16
+    QUALITY_LADDER_TARGET_LATENCY   目标耗时（秒），默认 120
+    QUALITY_LADDER_LOW_WATERMARK    恢复的压力阈值，默认 0.5
+    QUALITY_LADDER_COOLDOWN         两次调整的最小间隔（秒），默认 30
+    QUALITY_LADDER_EWMA_ALPHA       耗时 EWMA 系数，默认 0.2
+    QUALITY_LADDER_LATENCY_TTL      耗时信号有效期（秒），默认 120
+"""
+
+import os
+import time
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 尺寸从低到高
+SIZE_ORDER = ["1K", "2K", "4K"]
+
+DEFAULT_STEPS = "2K;1K;1K:gemini-2.5-flash-image"
+
+
+@dataclass
+class LadderStep:
+    """阶梯中的一级"""
+    max_size: str
+    models: Optional[List[str]] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "LadderStep":
+        """解析 "2K" 或 "1K:model-a,model-b" """
+        size, _, models = text.strip().partition(":")
+        size = size.strip().upper()
+        if size not in SIZE_ORDER:
+            raise ValueError(f"未知的尺寸: {size}")
+        model_list = [m.strip() for m in models.split(",") if m.strip()]
+        return cls(size, model_list or None)
+
+
+@dataclass
+class QualityPlan:
+    """一次请求实际使用的尺寸与模型"""
+    image_size: str
+    model_priority: List[str]
+    level: int = 0
+    requested_size: Optional[str] = None
+    requested_models: Optional[List[str]] = None
+    reason: Optional[str] = None
+
+    @property
+    def degraded(self) -> bool:
+        return self.reason is not None
+
+    def describe(self) -> Optional[dict]:
+        """响应中的降级说明，未降级时为 None"""
+        if not self.degraded:
+            return None
+        return {
+            "level": self.level,
+            "reason": self.reason,
+            "requested_size": self.requested_size,
+            "image_size": self.image_size,
+            "requested_models": self.requested_models,
+            "models": self.model_priority
+        }
+
+
+def _model_name(model) -> str:
+    return str(getattr(model, "value", model))
+
+
+class QualityLadder:
+    """按负载在阶梯上升降"""
+
+    def __init__(self):
+        self.enabled = os.getenv("QUALITY_LADDER_ENABLED", "true").lower() == "true"
+        self.steps = [LadderStep.parse(s) for s in os.getenv("QUALITY_LADDER_STEPS", DEFAULT_STEPS).split(";") if s.strip()]
+        self.max_in_flight = int(os.getenv("QUALITY_LADDER_MAX_IN_FLIGHT", "16"))
+        self.target_latency = float(os.getenv("QUALITY_LADDER_TARGET_LATENCY", "120"))
+        self.low_watermark = float(os.getenv("QUALITY_LADDER_LOW_WATERMARK", "0.5"))
+        self.cooldown = float(os.getenv("QUALITY_LADDER_COOLDOWN", "30"))
+        self.alpha = float(os.getenv("QUALITY_LADDER_EWMA_ALPHA", "0.2"))
+        self.latency_ttl = float(os.getenv("QUALITY_LADDER_LATENCY_TTL", "120"))
+
+        self.level = 0
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self._last_sample_at = 0.0
+        self._changed_at = 0.0
+        self.degraded_requests = 0
+
+    def _latency_signal(self) -> float:
+        if self.latency_ewma is None or time.monotonic() - self._last_sample_at > self.latency_ttl:
+            return 0.0
+        return self.latency_ewma
+
+    def pressure(self) -> float:
+        """当前负载压力，≥ 1 表示饱和"""
+        return max(self.in_flight / max(1, self.max_in_flight), self._latency_signal() / self.target_latency)
+
+    def _update(self):
+        """按压力调整等级（带冷却时间）"""
+        now = time.monotonic()
+        if now - self._changed_at < self.cooldown:
+            return
+        pressure = self.pressure()
+        if pressure >= 1.0 and self.level < len(self.steps):
+            self.level += 1
+        elif pressure <= self.low_watermark and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self._changed_at = now
+        logger.warning(f"[QualityLadder] 负载压力 {pressure:.2f}，切换到第 {self.level} 级")
+
+    def plan(self, image_size: str, model_priority: List[str]) -> QualityPlan:
+        """
+        按当前负载确定本次请求的尺寸与模型
+
+        Args:
+            image_size: 请求的尺寸
+            model_priority: 请求的模型优先级
+
+        Returns:
+            QualityPlan；未降级时与请求一致
+        """
+        model_priority = list(model_priority)
+        if not self.enabled or not self.steps:
+            return QualityPlan(image_size, model_priority)
+        self._update()
+        if self.level == 0:
+            return QualityPlan(image_size, model_priority)
+
+        step = self.steps[self.level - 1]
+        size = image_size
+        if image_size in SIZE_ORDER and SIZE_ORDER.index(image_size) > SIZE_ORDER.index(step.max_size):
+            size = step.max_size
+        models = model_priority
+        if step.models:
+            allowed = [m for m in model_priority if _model_name(m) in step.models]
+            models = allowed or list(step.models)
+
+        if size == image_size and [_model_name(m) for m in models] == [_model_name(m) for m in model_priority]:
+            return QualityPlan(image_size, model_priority, level=self.level)
+
+        self.degraded_requests += 1
+        return QualityPlan(
+            image_size=size,
+            model_priority=models,
+            level=self.level,
+            requested_size=image_size,
+            requested_models=[_model_name(m) for m in model_priority],
+            reason=f"上游负载较高（压力 {self.pressure():.2f}），已降级到第 {self.level} 级"
+        )
+
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        """统计一次上游生成的在途数与耗时"""
+        self.in_flight += 1
+        start = time.monotonic()
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            self.in_flight -= 1
+            # 被取消的调用不计入耗时（耗时不代表上游的响应速度）
+            if completed:
+                self._record(time.monotonic() - start)
+            self._update()
+
+    def _record(self, elapsed: float):
+        if self._latency_signal() == 0.0:
+            self.latency_ewma = elapsed
+        else:
+            self.latency_ewma = self.alpha * elapsed + (1 - self.alpha) * self.latency_ewma
+        self._last_sample_at = time.monotonic()
+
+    def stats(self) -> dict:
+        """当前等级、压力与配置"""
+        return {
+            "enabled": self.enabled,
+            "level": self.level,
+            "max_level": len(self.steps),
+            "current_step": (
+                {"max_size": self.steps[self.level - 1].max_size, "models": self.steps[self.level - 1].models}
+                if self.level else None
+            ),
+            "pressure": round(self.pressure(), 3),
+            "in_flight": self.in_flight,
+            "latency_ewma": round(self.latency_ewma, 2) if self.latency_ewma is not None else None,
+            "degraded_requests": self.degraded_requests
+        }
+
+
+# 全局实例
+quality_ladder = QualityLadder()
@@ -0,0 +1,293 @@
+"""
+上游服务限流器
+按 (服务商, 模型) 维度的令牌桶 + 并发上限，超出部分在公平的 FIFO 队列中排队
+
+- 令牌桶控制每秒请求数（允许 burst 个请求的突发）
+- 并发上限控制同时在途的请求数
+- 排队按优先级（数值越小越优先，默认 DEFAULT_PRIORITY）放行，同优先级 FIFO；
+  优先级由 priority_scope() 在请求入口设置，随上下文传递到各服务客户端
+- 排队超过 queue_timeout 秒抛出 RateLimitTimeout
+- 收到 429 时可调用 pause() 让该桶暂停发放令牌
+- 排队耗时等统计可通过 stats() 查看
+
+配置（环境变量，模型级覆盖服务商级）:
+    RATE_LIMIT_<PROVIDER>_RPS / _BURST / _CONCURRENCY
+    RATE_LIMIT_<PROVIDER>_<MODEL>_RPS / _BURST / _CONCURRENCY
+    RATE_LIMIT_QUEUE_TIMEOUT
+其中 PROVIDER / MODEL 为大写，非字母数字字符替换为下划线。
+"""
+
+import os
+import re
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from app.utils.deadline import time_left
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTimeout(Exception):
+    """排队等待超时"""
+
+
+# 未设置优先级的请求使用的默认值（数值越小越优先）
+DEFAULT_PRIORITY = 5
+
+_priority: ContextVar[int] = ContextVar("request_priority", default=DEFAULT_PRIORITY)
+
+
+def current_priority() -> int:
+    """当前请求的排队优先级"""
+    return _priority.get()
+
+
+@contextmanager
+def priority_scope(priority: int) -> Iterator[int]:
+    """在当前上下文中设置排队优先级（数值越小越优先）"""
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+
+class _PriorityLock:
+    """按 (优先级, 到达顺序) 交接的锁：释放时交给优先级最高、最早到达的等待者"""
+
+    def __init__(self):
+        self._locked = False
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int):
+        if not self._locked and not self._waiters:
+            self._locked = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已被交接但调用方同时被取消：把锁继续交出去
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 锁直接交给下一个等待者，保持 locked
+                future.set_result(None)
+                return
+        self._locked = False
+
+
+class TokenBucketLimiter:
+    """单个 (服务商, 模型) 的限流器"""
+
+    # 保留最近的排队耗时样本数（用于统计分位数）
+    RECENT_WAITS = 500
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        queue_timeout: float
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue_lock = _PriorityLock()  # 按优先级交接，同优先级 FIFO
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+        self._recent_waits: deque = deque(maxlen=self.RECENT_WAITS)
+
+    def pause(self, seconds: float):
+        """暂停发放令牌（如收到 429 + Retry-After）"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # 暂停期间不累积令牌，从暂停结束时刻重新开始补充
+        self._tokens = 0.0
+        self._updated = self._paused_until
+        logger.warning(f"[RateLimiter] {self.name} 暂停 {seconds:.1f} 秒")
+
+    async def _take_token(self):
+        """取一个令牌，不足时等待补充"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _admit(self, priority: int):
+        # 只有队首持有锁，依次等待并发槽位和令牌
+        await self._queue_lock.acquire(priority)
+        try:
+            await self._slots.acquire()
+            try:
+                await self._take_token()
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            self._queue_lock.release()
+
+    @asynccontextmanager
+    async def acquire(self, timeout: Optional[float] = None, priority: Optional[int] = None) -> AsyncIterator[float]:
+        """
+        获取一次调用许可
+
+        用法:
+            async with limiter.acquire() as waited:
+                ...
+
+        Args:
+            timeout: 最长排队时间（秒），默认 queue_timeout，且不超过请求剩余的截止时间
+            priority: 排队优先级，默认取 priority_scope() 设置的值
+
+        Yields:
+            本次排队耗时（秒）
+
+        Raises:
+            RateLimitTimeout: 排队超时
+            DeadlineExceeded: 请求已超出截止时间
+        """
+        timeout = time_left(self.queue_timeout if timeout is None else timeout, f"{self.name} 限流排队")
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(
+                self._admit(current_priority() if priority is None else priority),
+                timeout=max(0.0, timeout)
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RateLimitTimeout(f"{self.name} 限流排队超时（已等待 {time.monotonic() - start:.1f} 秒）")
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._recent_waits.append(waited)
+        if waited >= 1.0:
+            logger.info(f"[RateLimiter] {self.name} 排队 {waited:.1f} 秒")
+
+        self.in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """统计信息"""
+        recent = sorted(self._recent_waits)
+        p95 = recent[min(len(recent) - 1, int(0.95 * len(recent)))] if recent else 0.0
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "avg_wait": round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+            "p95_wait": round(p95, 3),
+            "max_wait": round(self.max_wait, 3)
+        }
+
+
+class RateLimiterRegistry:
+    """全部服务客户端共享的限流器集合"""
+
+    # 服务商默认配置: (每秒请求数, 突发容量, 最大并发)
+    PROVIDER_DEFAULTS: Dict[str, Tuple[float, int, int]] = {
+        "apiyi": (5.0, 10, 20),
+        "grsai": (10.0, 20, 50),
+        "huggingface": (2.0, 5, 4),
+    }
+    FALLBACK_DEFAULT = (5.0, 10, 10)
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], TokenBucketLimiter] = {}
+
+    @staticmethod
+    def _env_key(*parts: str) -> str:
+        return "_".join(re.sub(r"[^A-Za-z0-9]", "_", p).upper() for p in parts)
+
+    def _config(self, provider: str, model: str) -> Tuple[float, int, int]:
+        rate, burst, concurrency = self.PROVIDER_DEFAULTS.get(provider, self.FALLBACK_DEFAULT)
+        values = {"RPS": rate, "BURST": burst, "CONCURRENCY": concurrency}
+        for scope in (self._env_key(provider), self._env_key(provider, model)):
+            for field in values:
+                raw = os.getenv(f"RATE_LIMIT_{scope}_{field}")
+                if raw:
+                    values[field] = float(raw)
+        return values["RPS"], int(values["BURST"]), int(values["CONCURRENCY"])
+
+    def limiter(self, provider: str, model: str = "default") -> TokenBucketLimiter:
+        """获取 (服务商, 模型) 对应的限流器，首次使用时按配置创建"""
+        model = str(getattr(model, "value", model))
+        key = (provider, model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            rate, burst, concurrency = self._config(provider, model)
+            limiter = TokenBucketLimiter(
+                name=f"{provider}/{model}",
+                rate=rate,
+                burst=burst,
+                max_concurrency=concurrency,
+                queue_timeout=float(os.getenv("RATE_LIMIT_QUEUE_TIMEOUT", "120"))
+            )
+            self._limiters[key] = limiter
+        return limiter
+
+    def acquire(self, provider: str, model: str = "default", timeout: Optional[float] = None, priority: Optional[int] = None):
+        """获取调用许可（async with）"""
+        return self.limiter(provider, model).acquire(timeout=timeout, priority=priority)
+
+    def stats(self) -> dict:
+        """所有限流器的统计信息"""
+        return {limiter.name: limiter.stats() for limiter in self._limiters.values()}
+
+
+def retry_after_seconds(response, default: float = 5.0) -> float:
+    """解析 429 响应的 Retry-After 头（秒）"""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# 全局限流器实例
+rate_limiter = RateLimiterRegistry()
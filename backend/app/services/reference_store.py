@@ -0,0 +1,167 @@
+"""
+参考图句柄
+参考图只上传一次，之后的重试、降级、多变体、多模型请求都只传句柄，不再重复发送数 MB 的 Base64
+
+两种句柄:
+    - 签名 URL: 参考图保存在本服务，通过 GET /api/v1/refs/{name}?expires=&sig= 对外提供，
+      用于 Grsai Nano Banana 的 urls 字段；需要配置上游可访问的 PUBLIC_BASE_URL
+    - 文件 URI: Gemini 风格的 Files API 上传后得到的 fileUri（见 GetGoAPIClient.upload_reference）
+
+句柄按 (用途, 内容哈希) 缓存，在有效期内（提前 HANDLE_REFRESH_MARGIN 秒失效）直接复用。
+
+配置（环境变量）:
+    PUBLIC_BASE_URL            上游可访问的本服务地址，如 https://api.example.com；未配置时不生成签名 URL
+    REFERENCE_URL_SECRET       签名密钥；配置了 PUBLIC_BASE_URL 时必须配置（API 进程与 worker 进程、
+                               多个实例需相同），未配置时不生成签名 URL，参考图回退到 Base64
+    REFERENCE_URL_TTL          签名 URL 有效期（秒），默认 3600
+    REFERENCE_DIR              参考图保存目录，默认 <项目根目录>/cache/refs
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+# 句柄在到期前多少秒视为失效（留出请求在途的时间）
+HANDLE_REFRESH_MARGIN = 300.0
+
+MIME_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+
+
+@dataclass(frozen=True)
+class ReferenceHandle:
+    """已上传参考图的句柄"""
+    uri: str
+    mime_type: str
+    expires_at: float  # Unix 时间戳
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class HandleCache:
+    """按 (用途, 内容哈希) 缓存句柄，过期自动失效"""
+
+    def __init__(self, margin: float = HANDLE_REFRESH_MARGIN):
+        self.margin = margin
+        self._handles: Dict[Tuple[str, str], ReferenceHandle] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: str, key: str) -> Optional[ReferenceHandle]:
+        with self._lock:
+            handle = self._handles.get((scope, key))
+            if handle is not None and handle.expires_at - self.margin > time.time():
+                self.hits += 1
+                return handle
+            self._handles.pop((scope, key), None)
+            self.misses += 1
+            return None
+
+    def put(self, scope: str, key: str, handle: ReferenceHandle):
+        with self._lock:
+            # 顺带清理已过期的句柄
+            now = time.time()
+            for k in [k for k, h in self._handles.items() if h.expires_at <= now]:
+                del self._handles[k]
+            self._handles[(scope, key)] = handle
+
+    def stats(self) -> dict:
+        return {"handles": len(self._handles), "hits": self.hits, "misses": self.misses}
+
+
+class ReferenceStore:
+    """本服务托管的参考图（签名 URL）"""
+
+    def __init__(self):
+        self.public_base_url = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+        secret = os.getenv("REFERENCE_URL_SECRET", "")
+        if self.public_base_url and not secret:
+            # 随机密钥只在本进程内有效: worker 进程签发的 URL 会被 API 进程拒绝（403）
+            logger.error("[ReferenceStore] 已配置 PUBLIC_BASE_URL 但未配置 REFERENCE_URL_SECRET，不使用签名 URL，参考图回退到 Base64")
+            self.public_base_url = ""
+        self.secret = (secret or secrets.token_hex(32)).encode("utf-8")
+        self.ttl = float(os.getenv("REFERENCE_URL_TTL", "3600"))
+        self.directory = os.getenv("REFERENCE_DIR", os.path.join(PROJECT_ROOT, "cache", "refs"))
+        self.handles = HandleCache(margin=min(HANDLE_REFRESH_MARGIN, self.ttl / 4))
+        self._pruned_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """配置了上游可访问的地址和签名密钥时才能使用签名 URL"""
+        return bool(self.public_base_url)
+
+    def _sign(self, name: str, expires: int) -> str:
+        return hmac.new(self.secret, f"{name}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def signed_url(self, data: bytes, mime_type: str = "image/jpeg") -> Optional[str]:
+        """
+        保存参考图并返回签名 URL（有效期内重复调用返回同一 URL）
+
+        Returns:
+            URL；未配置 PUBLIC_BASE_URL / REFERENCE_URL_SECRET 时返回 None，调用方应回退到 Base64
+        """
+        if not self.enabled:
+            return None
+        key = content_key(data)
+        handle = self.handles.get("signed-url", key)
+        if handle is not None:
+            return handle.uri
+
+        name = key + MIME_EXTENSIONS.get(mime_type, ".jpg")
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            # 续期：刷新修改时间，避免被清理
+            os.utime(path)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._prune()
+
+        expires = int(time.time() + self.ttl)
+        uri = f"{self.public_base_url}/api/v1/refs/{name}?expires={expires}&sig={self._sign(name, expires)}"
+        self.handles.put("signed-url", key, ReferenceHandle(uri, mime_type, expires))
+        return uri
+
+    def _prune(self):
+        """删除所有签名 URL 都已过期的参考图（最多每 ttl/4 秒执行一次）"""
+        now = time.time()
+        if now - self._pruned_at < self.ttl / 4:
+            return
+        self._pruned_at = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and entry.stat().st_mtime + self.ttl < now:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+    def resolve(self, name: str, expires: int, sig: str) -> Optional[str]:
+        """校验签名和有效期，返回本地文件路径；无效时返回 None"""
+        if "/" in name or "\\" in name or name.startswith("."):
+            return None
+        if expires < time.time() or not hmac.compare_digest(self._sign(name, expires), sig):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+
+# 全局实例
+reference_store = ReferenceStore()
+
+# Files API 等上游句柄的缓存（按服务商区分 scope）
+handle_cache = HandleCache()
@@ -0,0 +1,206 @@
+"""
+生成结果缓存
+按内容寻址（输入图片哈希 + 提示词 + 模型 + 比例 + 尺寸）保存生成图片和元数据，
+总大小超过上限时按最近最少使用（LRU）淘汰
+
+目录结构:
+    <RESULT_CACHE_DIR>/<key>/meta.json   元数据（最近访问时间即 meta.json 的 mtime）
+    <RESULT_CACHE_DIR>/<key>/<i>.png     生成图片
+
+配置（环境变量）:
+    RESULT_CACHE_ENABLED     是否启用，默认 true
+    RESULT_CACHE_DIR         缓存目录，默认项目根目录下的 cache/results
+    RESULT_CACHE_MAX_BYTES   总大小上限，默认 1 GiB
+"""
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+META_FILE = "meta.json"
+
+
+def link_or_copy(src: str, dst: str):
+    """优先硬链接（同一文件系统下零拷贝），失败时复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """磁盘结果缓存（LRU，按字节数限额）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+
+        # key -> 条目字节数，按访问顺序排列（最旧在前）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- 索引 ----------
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(path, name))
+            for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name))
+        )
+
+    def _load_index(self):
+        """首次使用时扫描缓存目录，按 meta.json 的 mtime 恢复 LRU 顺序"""
+        if self._loaded:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            meta_path = os.path.join(entry_dir, META_FILE)
+            if not os.path.isfile(meta_path):
+                # 写入中途失败的残留目录
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((os.path.getmtime(meta_path), key, self._dir_size(entry_dir)))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            logger.info(f"[ResultCache] 淘汰 {key[:12]} ({size} 字节)")
+
+    # ---------- 同步实现（在线程池中执行） ----------
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            meta_path = os.path.join(self._entry_dir(key), META_FILE)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                os.utime(meta_path)
+            except (OSError, ValueError):
+                self._total_bytes -= self._index.pop(key)
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        meta["files"] = [os.path.join(self._entry_dir(key), name) for name in meta.get("files", [])]
+        return meta
+
+    def _put(self, key: str, meta: dict, files: List[str]):
+        with self._lock:
+            self._load_index()
+            entry_dir = self._entry_dir(key)
+            tmp_dir = f"{entry_dir}.tmp{threading.get_ident()}"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            try:
+                names = []
+                for i, src in enumerate(files):
+                    name = f"{i}{os.path.splitext(src)[1] or '.png'}"
+                    link_or_copy(src, os.path.join(tmp_dir, name))
+                    names.append(name)
+                with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({**meta, "files": names, "created_at": time.time()}, f, ensure_ascii=False)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            size = self._dir_size(entry_dir)
+            self._index[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    # ---------- 对外接口 ----------
+
+    async def get(self, key: str) -> Optional[dict]:
+        """
+        查询缓存
+
+        Returns:
+            元数据（files 为缓存内图片的绝对路径），未命中返回 None
+        """
+        if not self.enabled:
+            return None
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except OSError as e:
+            logger.warning(f"[ResultCache] 读取失败: {e}")
+            return None
+
+    async def put(self, key: str, meta: dict, files: Optional[List[str]] = None):
+        """写入缓存（图片优先硬链接进缓存目录），失败只记录日志"""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._put, key, meta, files or [])
+        except OSError as e:
+            logger.warning(f"[ResultCache] 写入失败: {e}")
+
+    async def materialize(self, files: List[str], output_path: Callable[[int], str]) -> List[str]:
+        """把缓存图片放到 output 目录（硬链接或复制），返回输出路径"""
+        def _run() -> List[str]:
+            paths = []
+            for i, src in enumerate(files):
+                dst = output_path(i)
+                link_or_copy(src, dst)
+                paths.append(dst)
+            return paths
+        return await asyncio.to_thread(_run)
+
+    def stats(self) -> Dict[str, object]:
+        """统计信息"""
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._index),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+# 全局缓存实例
+result_cache = ResultCache(
+    cache_dir=os.getenv("RESULT_CACHE_DIR", os.path.join(PROJECT_ROOT, "cache", "results")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))),
+    enabled=os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+)
@@ -6,12 +6,16 @@ SAM3 分割服务
 
 import os
 import io
+import time
 import base64
 import httpx
 from typing import List, Dict, Optional, Tuple
 from PIL import Image
 import numpy as np
 
+from app.services.rate_limiter import rate_limiter, retry_after_seconds
+from app.services.timeout_manager import adaptive_timeouts
+
 
 class SAM3Service:
     """
@@ -22,7 +26,8 @@ class SAM3Service:
     def __init__(self):
         self.hf_token = os.getenv("HF_TOKEN")
         self.model_id = "facebook/sam3"
-        self.api_url = f"https://router.huggingface.co/hf-inference/models/{self.model_id}"
+        base_url = os.getenv("HF_INFERENCE_BASE_URL", "https://router.huggingface.co/hf-inference")
+        self.api_url = f"{base_url.rstrip('/')}/models/{self.model_id}"
         
     def _image_to_base64(self, image: Image.Image) -> str:
         """将PIL Image转换为base64字符串"""
@@ -35,6 +40,28 @@ class SAM3Service:
         image_data = base64.b64decode(b64_string)
         return Image.open(io.BytesIO(image_data))
     
+    async def _post(self, client: httpx.AsyncClient, headers: dict, payload: dict) -> httpx.Response:
+        """经共享限流器调用 Hugging Face 推理接口"""
+        limiter = rate_limiter.limiter("huggingface", self.model_id)
+        async with limiter.acquire():
+            read_timeout = adaptive_timeouts.read_timeout("huggingface", self.model_id, "-", 120.0)
+            started = time.monotonic()
+            try:
+                response = await client.post(
+                    self.api_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=httpx.Timeout(120.0, read=read_timeout)
+                )
+            except httpx.ReadTimeout:
+                adaptive_timeouts.record_timeout("huggingface", self.model_id, "-", read_timeout)
+                raise
+        if response.status_code == 200:
+            adaptive_timeouts.record("huggingface", self.model_id, "-", time.monotonic() - started)
+        if response.status_code == 429:
+            limiter.pause(retry_after_seconds(response))
+        return response
+    
     async def segment_by_point(
         self, 
         image: Image.Image, 
@@ -67,11 +94,7 @@ class SAM3Service:
                 }
             }
             
-            response = await client.post(
-                self.api_url,
-                headers=headers,
-                json=payload
-            )
+            response = await self._post(client, headers, payload)
             
             if response.status_code == 200:
                 return response.json()
@@ -112,11 +135,7 @@ class SAM3Service:
                 }
             }
             
-            response = await client.post(
-                self.api_url,
-                headers=headers,
-                json=payload
-            )
+            response = await self._post(client, headers, payload)
             
             if response.status_code == 200:
                 return response.json()
@@ -155,11 +174,7 @@ class SAM3Service:
                 }
             }
             
-            response = await client.post(
-                self.api_url,
-                headers=headers,
-                json=payload
-            )
+            response = await self._post(client, headers, payload)
             
             if response.status_code == 200:
                 return response.json()
@@ -0,0 +1,169 @@
+"""
+服务等级
+每个等级绑定 模型优先级、尺寸上限、时间预算、对冲策略和排队优先级，按 API Key 选择；
+请求参数 tier 只能选择不高于 API Key 对应等级（无 Key 时为默认等级）的等级，fast < standard < premium；
+降级时排队优先级不高于原等级，原等级不对冲时也不对冲
+
+内置等级:
+    fast      只用快速模型、最大 1K、20 秒预算、8 秒未返回即对冲、最高排队优先级、
+              跳过 LLM 分析（静态提示词），用于 20 秒内出图的预览
+    standard  默认模型链、最大 4K、默认预算、不对冲、默认优先级（即原有行为）
+    premium   Pro 模型优先、最大 4K、600 秒预算、120 秒对冲、较高优先级、不参与负载降级
+
+配置（环境变量）:
+    SERVICE_TIER_DEFAULT              未指定时使用的等级，默认 standard
+    SERVICE_TIER_API_KEYS             API Key 与等级的映射，如 "key-a:premium,key-b:fast"
+    SERVICE_TIER_<NAME>_MODELS        模型列表（逗号分隔）
+    SERVICE_TIER_<NAME>_MAX_SIZE      尺寸上限（1K/2K/4K）
+    SERVICE_TIER_<NAME>_DEADLINE      时间预算（秒）
+    SERVICE_TIER_<NAME>_HEDGE_AFTER   对冲等待时间（秒），0 表示不对冲
+    SERVICE_TIER_<NAME>_PRIORITY      排队优先级（数值越小越优先）
+"""
+
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+from app.services.getgoapi_client import GetGoModel, DEFAULT_MODEL_PRIORITY
+from app.services.quality_ladder import SIZE_ORDER
+from app.services.rate_limiter import DEFAULT_PRIORITY
+from app.utils.deadline import DEFAULT_DEADLINE_SECONDS, Deadline, parse_deadline
+
+
+@dataclass(frozen=True)
+class ServiceTier:
+    """一个服务等级"""
+    name: str
+    models: List[str]
+    max_image_size: str
+    deadline_seconds: float
+    hedge_after: Optional[float]
+    priority: int
+    level: int = 1  # 等级高低（请求参数只能降级，不能升级）
+    use_llm: bool = True
+    allow_degrade: bool = True
+
+    def cap_size(self, image_size: str) -> str:
+        """把请求的尺寸限制在等级上限内"""
+        if image_size in SIZE_ORDER and SIZE_ORDER.index(image_size) > SIZE_ORDER.index(self.max_image_size):
+            return self.max_image_size
+        return image_size
+
+    def deadline(self, header_value: Optional[str] = None, seconds: Optional[float] = None) -> Deadline:
+        """请求的截止时间：未指定时使用等级预算，指定时不超过等级预算"""
+        deadline = parse_deadline(header_value, seconds, default=self.deadline_seconds)
+        if deadline.budget > self.deadline_seconds:
+            return Deadline(self.deadline_seconds)
+        return deadline
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "models": [str(getattr(m, "value", m)) for m in self.models],
+            "max_image_size": self.max_image_size,
+            "deadline_seconds": self.deadline_seconds,
+            "hedge_after": self.hedge_after,
+            "priority": self.priority,
+            "level": self.level,
+            "use_llm": self.use_llm,
+            "allow_degrade": self.allow_degrade
+        }
+
+
+BUILTIN_TIERS: Dict[str, ServiceTier] = {
+    "fast": ServiceTier(
+        name="fast",
+        models=[GetGoModel.GEMINI_25_FLASH_IMAGE],
+        max_image_size="1K",
+        deadline_seconds=20.0,
+        hedge_after=8.0,
+        priority=0,
+        level=0,
+        use_llm=False
+    ),
+    "standard": ServiceTier(
+        name="standard",
+        models=list(DEFAULT_MODEL_PRIORITY),
+        max_image_size="4K",
+        deadline_seconds=DEFAULT_DEADLINE_SECONDS,
+        hedge_after=None,
+        priority=DEFAULT_PRIORITY
+    ),
+    "premium": ServiceTier(
+        name="premium",
+        models=[GetGoModel.GEMINI_3_PRO_IMAGE, GetGoModel.GEMINI_25_FLASH_IMAGE],
+        max_image_size="4K",
+        deadline_seconds=600.0,
+        hedge_after=120.0,
+        priority=2,
+        level=2,
+        allow_degrade=False
+    ),
+}
+
+
+class ServiceTierRegistry:
+    """服务等级配置与解析"""
+
+    def __init__(self):
+        self.tiers = {name: self._with_env(tier) for name, tier in BUILTIN_TIERS.items()}
+        self.default = os.getenv("SERVICE_TIER_DEFAULT", "standard")
+        self.api_keys: Dict[str, str] = {}
+        for item in os.getenv("SERVICE_TIER_API_KEYS", "").split(","):
+            key, _, tier = item.strip().rpartition(":")
+            if key and tier:
+                self.api_keys[key] = tier
+
+    @staticmethod
+    def _with_env(tier: ServiceTier) -> ServiceTier:
+        """用 SERVICE_TIER_<NAME>_* 覆盖内置配置"""
+        prefix = f"SERVICE_TIER_{tier.name.upper()}_"
+        changes = {}
+        if os.getenv(prefix + "MODELS"):
+            changes["models"] = [m.strip() for m in os.getenv(prefix + "MODELS").split(",") if m.strip()]
+        if os.getenv(prefix + "MAX_SIZE"):
+            changes["max_image_size"] = os.getenv(prefix + "MAX_SIZE").upper()
+        if os.getenv(prefix + "DEADLINE"):
+            changes["deadline_seconds"] = float(os.getenv(prefix + "DEADLINE"))
+        if os.getenv(prefix + "HEDGE_AFTER"):
+            changes["hedge_after"] = float(os.getenv(prefix + "HEDGE_AFTER")) or None
+        if os.getenv(prefix + "PRIORITY"):
+            changes["priority"] = int(os.getenv(prefix + "PRIORITY"))
+        return replace(tier, **changes) if changes else tier
+
+    def _get(self, name: str) -> ServiceTier:
+        name = name.strip().lower()
+        if name not in self.tiers:
+            raise ValueError(f"不支持的服务等级: {name}，可选: {', '.join(self.tiers)}")
+        return self.tiers[name]
+
+    def resolve(self, tier: Optional[str] = None, api_key: Optional[str] = None) -> ServiceTier:
+        """
+        确定请求的服务等级：API Key 映射的等级（无映射时为默认等级），
+        请求参数 tier 只能在此基础上降级；降级得到的等级沿用原等级的排队优先级
+        （取两者中较低的优先级），原等级不对冲时也不对冲
+
+        Raises:
+            ValueError: 等级不存在
+            PermissionError: 请求的等级高于 API Key 对应的等级
+        """
+        entitled = self._get(self.api_keys.get(api_key or "") or self.default)
+        if not tier:
+            return entitled
+        requested = self._get(tier)
+        if requested.level > entitled.level:
+            raise PermissionError(f"无权使用服务等级 {requested.name}（当前最高为 {entitled.name}）")
+        if requested is entitled:
+            return entitled
+        return replace(
+            requested,
+            priority=max(requested.priority, entitled.priority),
+            hedge_after=requested.hedge_after if entitled.hedge_after else None
+        )
+
+    def describe(self) -> List[dict]:
+        return [tier.to_dict() for tier in self.tiers.values()]
+
+
+# 全局实例
+service_tiers = ServiceTierRegistry()
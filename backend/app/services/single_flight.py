@@ -0,0 +1,86 @@
+"""
+单飞（single-flight）请求合并
+相同 key 的并发调用只执行一次上游请求，其余调用等待并共享同一结果
+
+用于合并双击、前端超时重试等产生的重复生成请求。
+"""
+
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts: Any) -> str:
+    """由若干部分（字符串、枚举、列表等）生成稳定的 key"""
+    def _normalize(value: Any) -> Any:
+        if isinstance(value, (list, tuple)):
+            return [_normalize(v) for v in value]
+        return str(getattr(value, "value", value))
+
+    text = json.dumps([_normalize(p) for p in parts], ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    请求合并器
+
+    首个调用者启动上游任务；在其完成前到达的相同 key 调用直接等待该任务。
+    上游任务独立于调用者运行，任何一个调用者断开都不会取消共享的请求；
+    所有调用者都已取消（无人等待结果）时才取消上游任务。
+    """
+
+    def __init__(self, name: str = "single-flight"):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 合并键
+            fn: 无参协程函数，只有首个调用者会执行
+
+        Returns:
+            (结果, 是否为共享结果)
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            logger.info(f"[{self.name}] 合并重复请求 key={key[:12]}")
+        else:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._release(k, t))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if not task.done() and self._calls.get(key) is task and self._waiters.get(key) == 1:
+                logger.info(f"[{self.name}] 无等待者，取消上游请求 key={key[:12]}")
+                # 取消的同时移除登记，上游收尾期间到达的新调用重新执行，不会加入已取消的任务
+                self._release(key, task)
+                task.cancel()
+            raise
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _release(self, key: str, task: asyncio.Task):
+        """移除 key 的登记（仅当仍指向该任务，避免误删同 key 的新任务）"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,301 @@
+"""
+Nano Banana 任务共享轮询器
+所有在途任务由一个后台协程统一轮询，替代每个任务各自 sleep + 查询
+
+- 集中限速：全局每秒查询次数上限，避免大量在途任务时的轮询风暴
+- 预测式调度：按模型的历史完成耗时分布安排查询时间，
+  预计完成前稀疏查询，接近预计完成时间时密集查询
+- Grsai /v1/draw/result 只支持单个 id 查询，因此无法真正批量，改为集中调度
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingTask:
+    """在途任务"""
+    task_id: str
+    model: str
+    submitted_at: float
+    deadline: float
+    future: asyncio.Future
+    default_interval: float = 2.0
+    min_interval: float = 0.0
+    consecutive_errors: int = 0
+    polls: int = 0
+    last_status: dict = field(default_factory=dict)
+
+
+class TaskPoller:
+    """共享轮询器"""
+
+    # 全局查询速率上限（次/秒）
+    MAX_POLLS_PER_SECOND = float(os.getenv("NANO_BANANA_MAX_POLLS_PER_SECOND", "10"))
+
+    # 单个任务两次查询的最小/最大间隔（秒）
+    MIN_INTERVAL = float(os.getenv("NANO_BANANA_MIN_POLL_INTERVAL", "1.0"))
+    MAX_INTERVAL = float(os.getenv("NANO_BANANA_MAX_POLL_INTERVAL", "15.0"))
+
+    # 每个模型保留的历史完成耗时样本数 / 启用预测所需的最少样本数
+    HISTORY_SIZE = 200
+    MIN_SAMPLES = 5
+
+    # 连续查询失败上限
+    MAX_CONSECUTIVE_ERRORS = 5
+
+    # 提前到达（任务尚未登记）的结果最多保留条数
+    MAX_EARLY_RESULTS = 1000
+
+    def __init__(self, fetch_result: Callable[[str], Awaitable[dict]]):
+        """
+        Args:
+            fetch_result: 查询单个任务结果的协程函数（NanoBananaClient.get_result）
+        """
+        self._fetch_result = fetch_result
+        self._tasks: Dict[str, PendingTask] = {}
+        self._schedule: List[tuple] = []  # (下次查询时间, 序号, task_id)
+        self._sequence = 0
+        self._history: Dict[str, Deque[float]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._polls_running: set = set()
+        self._early_results: "OrderedDict[str, dict]" = OrderedDict()
+        self._next_slot = 0.0
+
+    # ------------------------------------------------------------------
+    # 历史耗时与调度
+    # ------------------------------------------------------------------
+
+    def record_duration(self, model: str, seconds: float):
+        """记录一次任务完成耗时"""
+        self._history.setdefault(model, deque(maxlen=self.HISTORY_SIZE)).append(seconds)
+
+    def _quantiles(self, model: str) -> Optional[tuple]:
+        """返回模型完成耗时的 (p10, p50, p90)，样本不足时返回 None"""
+        samples = self._history.get(model)
+        if not samples or len(samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+
+        def pick(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+        return pick(0.1), pick(0.5), pick(0.9)
+
+    def next_delay(self, model: str, elapsed: float, default_interval: float = 2.0) -> float:
+        """
+        计算距下次查询的等待时间
+
+        - elapsed < p10: 几乎不可能完成，直接等到 p10
+        - p10 ~ p90: 主要完成区间，按分布宽度密集查询
+        - > p90: 超出预期，逐步放宽间隔
+        - 没有足够历史数据时使用 default_interval
+        """
+        quantiles = self._quantiles(model)
+        if quantiles is None:
+            return default_interval
+
+        p10, p50, p90 = quantiles
+        if elapsed < p10:
+            delay = p10 - elapsed
+        elif elapsed < p90:
+            delay = (p90 - p10) / 10
+        else:
+            delay = (elapsed - p90) / 2
+        return min(self.MAX_INTERVAL, max(self.MIN_INTERVAL, delay))
+
+    def _delay_for(self, task: PendingTask, elapsed: float) -> float:
+        return max(task.min_interval, self.next_delay(task.model, elapsed, task.default_interval))
+
+    def _schedule_poll(self, task_id: str, at: float):
+        self._sequence += 1
+        heapq.heappush(self._schedule, (at, self._sequence, task_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    async def wait(
+        self,
+        task_id: str,
+        model: str,
+        max_wait_seconds: float,
+        default_interval: float = 2.0,
+        min_interval: float = 0.0
+    ) -> dict:
+        """
+        登记任务并等待其结束
+        
+        Args:
+            task_id: 上游任务ID
+            model: 模型（用于按模型统计完成耗时）
+            max_wait_seconds: 最大等待时间（秒）
+            default_interval: 该模型没有历史数据时的轮询间隔（秒）
+            min_interval: 该任务的最小查询间隔（秒），有 webhook 兜底时设大，只作安全网
+
+        Returns:
+            与 NanoBananaClient.get_result 相同结构的结果；失败/超时返回 code=-1
+        """
+        # webhook 可能早于登记到达
+        early = self._early_results.pop(task_id, None)
+        if early is not None:
+            return early
+        
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        task = PendingTask(
+            task_id=task_id,
+            model=model,
+            submitted_at=now,
+            deadline=now + max_wait_seconds,
+            future=loop.create_future(),
+            default_interval=default_interval,
+            min_interval=min_interval
+        )
+        self._tasks[task_id] = task
+        self._ensure_running()
+        self._schedule_poll(task_id, now + self._delay_for(task, 0.0))
+
+        try:
+            return await task.future
+        finally:
+            self._tasks.pop(task_id, None)
+
+    def resolve(self, task_id: str, result: dict) -> bool:
+        """
+        由外部（如 webhook）直接提供任务的最终结果
+        
+        任务尚未登记时暂存结果，登记时直接返回。
+
+        Returns:
+            是否有等待中的任务被完成
+        """
+        task = self._tasks.get(task_id)
+        if task is None:
+            self._early_results[task_id] = result
+            while len(self._early_results) > self.MAX_EARLY_RESULTS:
+                self._early_results.popitem(last=False)
+            return False
+        if task.future.done():
+            return False
+        self._finish(task, result)
+        return True
+
+    @property
+    def in_flight(self) -> int:
+        """在途任务数"""
+        return len(self._tasks)
+
+    def stats(self) -> dict:
+        """调度统计"""
+        return {
+            "in_flight": self.in_flight,
+            "models": {
+                model: dict(zip(("p10", "p50", "p90"), self._quantiles(model) or ()), samples=len(samples))
+                for model, samples in self._history.items()
+            }
+        }
+
+    # ------------------------------------------------------------------
+    # 后台轮询
+    # ------------------------------------------------------------------
+
+    def _ensure_running(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    def _finish(self, task: PendingTask, result: dict):
+        data = result.get("data") or {}
+        if result.get("code") == 0 and data.get("status") == "succeeded":
+            self.record_duration(task.model, time.monotonic() - task.submitted_at)
+        if not task.future.done():
+            task.future.set_result(result)
+
+    async def _run(self):
+        """后台循环：按调度表依次查询，集中限速"""
+        while self._tasks or self._schedule:
+            if not self._schedule:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            at, _, task_id = self._schedule[0]
+            now = time.monotonic()
+            if at > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._schedule)
+            task = self._tasks.get(task_id)
+            if task is None or task.future.done():
+                continue
+
+            # 全局限速：按固定时间槽发放查询
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.MAX_POLLS_PER_SECOND
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+            poll = asyncio.create_task(self._poll(task))
+            self._polls_running.add(poll)
+            poll.add_done_callback(self._polls_running.discard)
+
+    async def _poll(self, task: PendingTask):
+        """查询一次任务状态，并安排下一次查询"""
+        task.polls += 1
+        try:
+            result = await self._fetch_result(task.task_id)
+        except Exception as e:
+            result = {"code": -1, "msg": f"查询异常: {str(e)}", "data": None}
+        if task.future.done():
+            return
+
+        now = time.monotonic()
+        elapsed = now - task.submitted_at
+
+        if result.get("code") != 0:
+            task.consecutive_errors += 1
+            if task.consecutive_errors >= self.MAX_CONSECUTIVE_ERRORS:
+                logger.error(f"[TaskPoller] task_id={task.task_id} 连续{self.MAX_CONSECUTIVE_ERRORS}次查询失败，放弃")
+                self._finish(task, {
+                    "code": -1,
+                    "msg": f"查询结果连续失败{self.MAX_CONSECUTIVE_ERRORS}次: {result.get('msg')}",
+                    "data": {"task_id": task.task_id}
+                })
+                return
+        else:
+            task.consecutive_errors = 0
+            data = result.get("data") or {}
+            task.last_status = data
+            status = data.get("status")
+            if status in ("succeeded", "failed"):
+                logger.info(f"[TaskPoller] task_id={task.task_id} {status}，耗时{elapsed:.0f}秒，查询{task.polls}次")
+                self._finish(task, result)
+                return
+
+        if now >= task.deadline:
+            self._finish(task, {
+                "code": -1,
+                "msg": f"生成超时（已等待{elapsed:.0f}秒）",
+                "data": {"task_id": task.task_id}
+            })
+            return
+
+        delay = self._delay_for(task, elapsed)
+        self._schedule_poll(task.task_id, min(now + delay, task.deadline))
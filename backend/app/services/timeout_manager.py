@@ -0,0 +1,106 @@
+"""
+自适应超时
+按 (服务商, 模型, 图片尺寸) 统计最近的响应耗时，用高分位数确定读超时
+
+- 样本不足时使用上限（与原先固定的超时一致），不会误伤正常的慢请求
+- 样本足够后 超时 = 分位数 × 余量系数，并限制在 [下限, 上限] 内
+- 超时的请求按超时值记为一个样本（真实耗时至少这么长），
+  上游整体变慢时超时会随之放宽，而不是持续误判
+
+配置（环境变量）:
+    ADAPTIVE_TIMEOUT_ENABLED      是否启用，默认 true
+    ADAPTIVE_TIMEOUT_QUANTILE     分位数，默认 0.99
+    ADAPTIVE_TIMEOUT_MULTIPLIER   余量系数，默认 1.5
+    ADAPTIVE_TIMEOUT_FLOOR        下限（秒），默认 30
+    ADAPTIVE_TIMEOUT_WINDOW       每个键保留的样本数，默认 200
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES  启用自适应所需的最少样本数，默认 10
+"""
+
+import os
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, str, str]
+
+
+class AdaptiveTimeouts:
+    """按耗时分布学习读超时"""
+
+    def __init__(self):
+        self.enabled = os.getenv("ADAPTIVE_TIMEOUT_ENABLED", "true").lower() == "true"
+        self.quantile = float(os.getenv("ADAPTIVE_TIMEOUT_QUANTILE", "0.99"))
+        self.multiplier = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "1.5"))
+        self.floor = float(os.getenv("ADAPTIVE_TIMEOUT_FLOOR", "30"))
+        self.window = int(os.getenv("ADAPTIVE_TIMEOUT_WINDOW", "200"))
+        self.min_samples = int(os.getenv("ADAPTIVE_TIMEOUT_MIN_SAMPLES", "10"))
+
+        self._samples: Dict[Key, Deque[float]] = {}
+        self._timeouts: Dict[Key, int] = {}
+
+    @staticmethod
+    def _key(provider: str, model: str, size: str) -> Key:
+        model = str(getattr(model, "value", model))
+        size = str(getattr(size, "value", size))
+        return provider, model, size
+
+    def record(self, provider: str, model: str, size: str, seconds: float):
+        """记录一次成功响应的耗时"""
+        key = self._key(provider, model, size)
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def record_timeout(self, provider: str, model: str, size: str, timeout: float):
+        """记录一次超时（以超时值作为样本）"""
+        key = self._key(provider, model, size)
+        self._timeouts[key] = self._timeouts.get(key, 0) + 1
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(timeout)
+
+    def _quantile(self, key: Key) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def read_timeout(self, provider: str, model: str, size: str, ceiling: float) -> float:
+        """
+        获取读超时
+
+        Args:
+            provider / model / size: 统计维度（文本请求 size 传 "text"）
+            ceiling: 超时上限，即原先固定的超时
+
+        Returns:
+            学习到的超时；未启用或样本不足时返回 ceiling
+        """
+        if not self.enabled:
+            return ceiling
+        quantile = self._quantile(self._key(provider, model, size))
+        if quantile is None:
+            return ceiling
+        return min(ceiling, max(self.floor, quantile * self.multiplier))
+
+    def is_learned(self, provider: str, model: str, size: str) -> bool:
+        """该维度是否已有足够样本（超时来自学习而非上限）"""
+        return self.enabled and self._quantile(self._key(provider, model, size)) is not None
+
+    def stats(self) -> dict:
+        """各维度的样本数、分位数和当前超时"""
+        result = {}
+        for key, samples in self._samples.items():
+            ordered = sorted(samples)
+            quantile = self._quantile(key)
+            result["/".join(key)] = {
+                "samples": len(ordered),
+                "p50": round(ordered[len(ordered) // 2], 2),
+                "quantile": round(quantile, 2) if quantile is not None else None,
+                "timeouts": self._timeouts.get(key, 0),
+                "learned_timeout": round(max(self.floor, quantile * self.multiplier), 2) if quantile is not None else None
+            }
+        return result
+
+
+# 全局实例
+adaptive_timeouts = AdaptiveTimeouts()
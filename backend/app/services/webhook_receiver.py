@@ -0,0 +1,94 @@
+"""
+Nano Banana 完成回调接收
+校验回调来源，幂等处理重复投递，并直接唤醒等待中的任务
+"""
+
+import os
+import hmac
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from app.services.nano_banana import nano_banana_client
+
+logger = logging.getLogger(__name__)
+
+# 签名请求头（本地替身发送器或反向代理使用）
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """计算回调签名: sha256=<hex>"""
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+class WebhookReceiver:
+    """回调接收器"""
+
+    # 已处理任务ID的保留条数（用于幂等判断）
+    MAX_PROCESSED = 10000
+
+    # 终态
+    FINAL_STATUSES = ("succeeded", "failed")
+
+    def __init__(self):
+        self._processed: "OrderedDict[str, str]" = OrderedDict()
+
+    @property
+    def secret(self) -> Optional[str]:
+        """动态获取回调密钥"""
+        return os.getenv("NANO_BANANA_WEBHOOK_SECRET")
+
+    def verify(self, body: bytes, token: Optional[str], signature: Optional[str]) -> bool:
+        """
+        校验回调来源
+
+        支持两种方式，满足其一即可:
+        - URL 查询参数 token 与密钥一致（Grsai 回调）
+        - 签名头为请求体的 HMAC-SHA256（本地替身/代理）
+        未配置密钥时拒绝所有回调。
+        """
+        secret = self.secret
+        if not secret:
+            return False
+        if token and hmac.compare_digest(token, secret):
+            return True
+        if signature and hmac.compare_digest(signature, sign_payload(body, secret)):
+            return True
+        return False
+
+    def handle(self, payload: dict) -> dict:
+        """
+        处理一次回调
+
+        Returns:
+            {"task_id", "status", "duplicate", "delivered"}
+        """
+        # 兼容 {"code":0,"data":{...}} 与直接的 data 对象两种形态
+        data = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+        task_id = data.get("id")
+        status = data.get("status")
+        if not task_id:
+            raise ValueError("回调缺少任务ID")
+
+        if task_id in self._processed:
+            logger.info(f"[Webhook] 重复回调 task_id={task_id}，忽略")
+            return {"task_id": task_id, "status": self._processed[task_id], "duplicate": True, "delivered": False}
+
+        # 进度类回调只记录，不结束任务
+        if status not in self.FINAL_STATUSES:
+            return {"task_id": task_id, "status": status, "duplicate": False, "delivered": False}
+
+        self._processed[task_id] = status
+        while len(self._processed) > self.MAX_PROCESSED:
+            self._processed.popitem(last=False)
+
+        delivered = nano_banana_client.poller.resolve(task_id, {"code": 0, "msg": "success", "data": data})
+        logger.info(f"[Webhook] task_id={task_id} status={status} delivered={delivered}")
+        return {"task_id": task_id, "status": status, "duplicate": False, "delivered": delivered}
+
+
+# 全局接收器实例
+webhook_receiver = WebhookReceiver()
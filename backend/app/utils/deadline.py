@@ -0,0 +1,157 @@
+"""
+请求截止时间
+一次请求的总时间预算，通过 contextvar 在 LLM 分析、图片生成、重试、轮询等环节间传递
+
+- 接口入口用 deadline_scope() 设置截止时间（表单字段或 X-Request-Deadline 请求头，默认 REQUEST_DEADLINE_SECONDS）
+- 各环节用 time_left() / httpx_timeout() 按剩余预算确定超时，用 deadline_guard() 在截止时中止
+- asyncio.create_task 会复制当前上下文，并发子任务（多变体、多风格）继承同一截止时间
+- 截止时间已过时抛出 DeadlineExceeded，调用方据此停止重试和降级
+"""
+
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
+
+import httpx
+
+# 默认预算略小于前端 axios 的 300 秒超时，用户放弃后不再继续消耗上游调用
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "290"))
+
+# 单次请求允许设置的最大预算
+MAX_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "900"))
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+
+class DeadlineExceeded(Exception):
+    """请求已超出截止时间"""
+
+
+class Deadline:
+    """截止时间（基于 time.monotonic）"""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """剩余秒数（可能为负）"""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str = ""):
+        """已过截止时间时抛出 DeadlineExceeded"""
+        if self.expired:
+            suffix = f"，{stage}" if stage else ""
+            raise DeadlineExceeded(f"请求已超出截止时间（预算 {self.budget:g} 秒{suffix}）")
+
+    def cap(self, seconds: float, stage: str = "") -> float:
+        """把某环节的超时限制在剩余预算内"""
+        self.check(stage)
+        return min(seconds, self.remaining())
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前请求的截止时间，未设置时返回 None"""
+    return _current.get()
+
+
+def parse_deadline(
+    header_value: Optional[str] = None,
+    seconds: Optional[float] = None,
+    default: Optional[float] = None
+) -> Deadline:
+    """
+    解析请求的截止时间
+
+    Args:
+        header_value: X-Request-Deadline 请求头，剩余秒数；大于 1e9 时视为 Unix 时间戳
+        seconds: 接口参数指定的预算（秒），优先于请求头
+        default: 两者都未指定时的预算，默认 DEFAULT_DEADLINE_SECONDS
+
+    Returns:
+        Deadline，预算限制在 (0, MAX_DEADLINE_SECONDS] 内
+    """
+    budget = DEFAULT_DEADLINE_SECONDS if default is None else default
+    if seconds:
+        budget = float(seconds)
+    elif header_value:
+        try:
+            value = float(header_value)
+            budget = value - time.time() if value > 1e9 else value
+        except ValueError:
+            pass
+    return Deadline(max(0.0, min(budget, MAX_DEADLINE_SECONDS)))
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    在当前上下文中设置截止时间
+
+    用法:
+        with deadline_scope(parse_deadline(header, seconds)):
+            ...
+    """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def time_left(default: float, stage: str = "") -> float:
+    """
+    某环节可用的超时：min(default, 剩余预算)；未设置截止时间时返回 default
+
+    Raises:
+        DeadlineExceeded: 截止时间已过
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return deadline.cap(default, stage)
+
+
+def httpx_timeout(read: float, connect: float = 30.0, write: float = 30.0, pool: float = 30.0, stage: str = "") -> httpx.Timeout:
+    """按剩余预算限制各项超时的 httpx.Timeout"""
+    return httpx.Timeout(
+        connect=time_left(connect, stage),
+        read=time_left(read, stage),
+        write=time_left(write, stage),
+        pool=time_left(pool, stage)
+    )
+
+
+@asynccontextmanager
+async def deadline_guard(stage: str = "") -> AsyncIterator[None]:
+    """
+    截止时间到达时取消块内的操作并抛出 DeadlineExceeded
+
+    httpx 的读超时只限制单次读，流式响应持续有数据时不会触发，
+    因此需要整体的截止保护。未设置截止时间时不做任何限制。
+    """
+    deadline = _current.get()
+    if deadline is None:
+        yield
+        return
+    deadline.check(stage)
+
+    if hasattr(asyncio, "timeout"):
+        try:
+            async with asyncio.timeout(deadline.remaining()):
+                yield
+        except TimeoutError:
+            raise DeadlineExceeded(f"请求已超出截止时间（预算 {deadline.budget:g} 秒，{stage or '执行中'}）")
+    else:
+        # Python < 3.11：只能依赖按预算设置的 httpx 超时
+        yield
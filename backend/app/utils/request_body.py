@@ -0,0 +1,119 @@
+"""
+流式请求体构建工具
+将包含大尺寸 Base64 图片的 JSON 请求体分段写出，避免整体序列化
+
+- EncodedImage: 参考图的 Base64 编码缓存，首次发送时分块编码，之后跨重试/模型复用
+- StreamingJSONBody: JSON 信封 + 分块图片数据，作为 httpx 的 content 直接写入连接
+"""
+
+import json
+import uuid
+import base64
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+
+class EncodedImage:
+    """
+    参考图 Base64 编码（惰性、分块、可复用）
+
+    只保留原始字节和一份编码结果；编码在首次发送时按块进行，
+    后续重试或降级到其他模型时直接复用已编码的部分。
+    """
+
+    # 原始数据分块大小，必须是 3 的倍数，保证每块编码结果可直接拼接
+    RAW_CHUNK_SIZE = 3 * 16 * 1024
+
+    def __init__(self, data: bytes, mime_type: str = "image/jpeg"):
+        self.data = data
+        self.mime_type = mime_type
+        self._encoded = bytearray(self.encoded_length)
+        self._filled = 0
+
+    @property
+    def encoded_length(self) -> int:
+        """编码后的长度（字节）"""
+        return (len(self.data) + 2) // 3 * 4
+
+    def iter_chunks(self):
+        """按块产出编码后的数据，未编码的部分即时编码并缓存"""
+        view = memoryview(self.data)
+        for raw_start in range(0, len(self.data), self.RAW_CHUNK_SIZE):
+            raw_end = min(raw_start + self.RAW_CHUNK_SIZE, len(self.data))
+            start = raw_start // 3 * 4
+            end = start + (raw_end - raw_start + 2) // 3 * 4
+            if end > self._filled:
+                self._encoded[start:end] = base64.b64encode(view[raw_start:raw_end])
+                self._filled = end
+            yield bytes(self._encoded[start:end])
+
+    def to_base64(self) -> str:
+        """返回完整的 Base64 字符串（兼容需要字符串的旧接口）"""
+        if self._filled < self.encoded_length:
+            for _ in self.iter_chunks():
+                pass
+        return self._encoded.decode("ascii")
+
+
+class StreamingJSONBody:
+    """
+    流式 JSON 请求体
+
+    payload 中任意位置的 EncodedImage 会被序列化为 Base64 字符串，
+    但不会在内存中拼接出完整的 JSON 文本。同一个实例可以被多次发送（重试）。
+
+    用法:
+        body = StreamingJSONBody({"inlineData": {"data": encoded_image}})
+        await client.post(url, headers={**headers, **body.headers}, content=body)
+    """
+
+    def __init__(self, payload: Dict[str, Any]):
+        placeholders: Dict[str, EncodedImage] = {}
+        marker = uuid.uuid4().hex
+
+        def _default(obj):
+            if isinstance(obj, EncodedImage):
+                token = f"__inline_{marker}_{len(placeholders)}__"
+                placeholders[token] = obj
+                return token
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+        text = json.dumps(payload, default=_default)
+
+        # 按占位符切分为 [bytes, EncodedImage, bytes, ...]
+        self._segments: List[Union[bytes, EncodedImage]] = []
+        for token, image in placeholders.items():
+            head, text = text.split(token, 1)
+            self._segments.append(head.encode("utf-8"))
+            self._segments.append(image)
+        self._segments.append(text.encode("utf-8"))
+
+    @property
+    def content_length(self) -> int:
+        """请求体总长度（字节）"""
+        return sum(
+            seg.encoded_length if isinstance(seg, EncodedImage) else len(seg)
+            for seg in self._segments
+        )
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """显式声明 Content-Length，避免 chunked 传输"""
+        return {"Content-Length": str(self.content_length)}
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for segment in self._segments:
+            if isinstance(segment, EncodedImage):
+                for chunk in segment.iter_chunks():
+                    yield chunk
+            elif segment:
+                yield segment
+
+
+def as_encoded_image(
+    image: Optional[Union[bytes, EncodedImage]],
+    mime_type: str = "image/jpeg"
+) -> Optional[EncodedImage]:
+    """将原始字节包装为 EncodedImage，已包装的直接返回"""
+    if image is None or isinstance(image, EncodedImage):
+        return image
+    return EncodedImage(image, mime_type)
@@ -0,0 +1,201 @@
+"""
+流式响应解析工具
+从 Gemini generateContent 响应流中定位 inlineData.data，边接收边 Base64 解码写入文件
+
+整个响应体不会被完整读入内存：图片数据按块解码后直接落盘，
+其余 JSON 文本只保留开头一小段用于错误诊断。
+"""
+
+import os
+import base64
+import aiofiles
+from typing import AsyncIterable, Callable, List, Optional, Tuple
+
+
+# inlineData 对象的键名（兼容 snake_case 形式）
+INLINE_KEYS = (b'"inlineData"', b'"inline_data"')
+DATA_KEY = b'"data"'
+
+# 保留用于诊断的非图片文本上限
+ENVELOPE_LIMIT = 4096
+
+
+def detect_mime_type(header: bytes) -> str:
+    """根据文件头检测图片 MIME 类型"""
+    if header[:8] == b'\x89PNG\r\n\x1a\n':
+        return "image/png"
+    elif header[:2] == b'\xff\xd8':
+        return "image/jpeg"
+    elif header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return "image/webp"
+    else:
+        return "image/jpeg"
+
+
+class InlineDataParser:
+    """
+    增量解析器
+
+    feed() 接收任意切分的字节块，返回事件列表:
+        ("start", index)        发现第 index 张图片
+        ("data", index, bytes)  解码后的图片数据
+        ("end", index)          第 index 张图片结束
+    """
+
+    # 扫描状态
+    SCAN_INLINE = 0   # 寻找 inlineData 键
+    SCAN_DATA = 1     # 在 inlineData 对象内寻找 data 键
+    SCAN_VALUE = 2    # 跳过 ':' 和空白，寻找值的起始引号
+    IN_DATA = 3       # 读取 Base64 字符串
+
+    def __init__(self):
+        self.state = self.SCAN_INLINE
+        self.image_count = 0
+        self.envelope = bytearray()
+        self._buffer = b""
+        self._pending = b""  # 不足 4 字节的 Base64 余量
+
+    def _keep_envelope(self, text: bytes):
+        if len(self.envelope) < ENVELOPE_LIMIT:
+            self.envelope.extend(text[:ENVELOPE_LIMIT - len(self.envelope)])
+
+    @staticmethod
+    def _find_key(buffer: bytes, keys: Tuple[bytes, ...]) -> Tuple[int, int]:
+        """查找未被转义的键，返回 (起始位置, 键长度)，未找到返回 (-1, 0)"""
+        best = (-1, 0)
+        for key in keys:
+            start = 0
+            while True:
+                pos = buffer.find(key, start)
+                if pos == -1:
+                    break
+                if pos == 0 or buffer[pos - 1:pos] != b"\\":
+                    if best[0] == -1 or pos < best[0]:
+                        best = (pos, len(key))
+                    break
+                start = pos + 1
+        return best
+
+    def _decode(self, data: bytes) -> bytes:
+        """解码完整的 4 字节组，余量留到下次"""
+        data = self._pending + data.replace(b"\\", b"")
+        usable = len(data) // 4 * 4
+        self._pending = data[usable:]
+        return base64.b64decode(data[:usable]) if usable else b""
+
+    def feed(self, chunk: bytes) -> List[tuple]:
+        events = []
+        buffer = self._buffer + chunk
+        self._buffer = b""
+
+        while buffer:
+            if self.state == self.SCAN_INLINE:
+                pos, length = self._find_key(buffer, INLINE_KEYS)
+                if pos == -1:
+                    # 保留尾部，防止键被切分在两个块之间
+                    tail = max(len(k) for k in INLINE_KEYS)
+                    self._keep_envelope(buffer[:-tail])
+                    self._buffer = buffer[-tail:]
+                    break
+                self._keep_envelope(buffer[:pos + length])
+                buffer = buffer[pos + length:]
+                self.state = self.SCAN_DATA
+
+            elif self.state == self.SCAN_DATA:
+                pos, length = self._find_key(buffer, (DATA_KEY,))
+                if pos == -1:
+                    self._keep_envelope(buffer[:-len(DATA_KEY)])
+                    self._buffer = buffer[-len(DATA_KEY):]
+                    break
+                self._keep_envelope(buffer[:pos + length])
+                buffer = buffer[pos + length:]
+                self.state = self.SCAN_VALUE
+
+            elif self.state == self.SCAN_VALUE:
+                stripped = buffer.lstrip(b" \t\r\n:")
+                if not stripped:
+                    break
+                if stripped[:1] != b'"':
+                    # data 不是字符串，继续寻找下一个 inlineData
+                    self.state = self.SCAN_INLINE
+                    buffer = stripped
+                    continue
+                buffer = stripped[1:]
+                self.state = self.IN_DATA
+                self._pending = b""
+                events.append(("start", self.image_count))
+
+            elif self.state == self.IN_DATA:
+                end = buffer.find(b'"')
+                if end == -1:
+                    # 末尾的反斜杠可能是转义的一半，与下一块一起处理
+                    if buffer.endswith(b"\\"):
+                        self._buffer = b"\\"
+                        buffer = buffer[:-1]
+                    decoded = self._decode(buffer)
+                    if decoded:
+                        events.append(("data", self.image_count, decoded))
+                    break
+                decoded = self._decode(buffer[:end])
+                if self._pending:
+                    decoded += base64.b64decode(self._pending + b"=" * (-len(self._pending) % 4))
+                    self._pending = b""
+                if decoded:
+                    events.append(("data", self.image_count, decoded))
+                events.append(("end", self.image_count))
+                self.image_count += 1
+                buffer = buffer[end + 1:]
+                self.state = self.SCAN_INLINE
+
+        return events
+
+
+async def save_inline_images(
+    byte_stream: AsyncIterable[bytes],
+    path_for_index: Callable[[int], str]
+) -> Tuple[List[dict], bytes]:
+    """
+    将响应流中的图片逐张写入文件
+
+    Args:
+        byte_stream: 响应字节流（如 response.aiter_bytes()）
+        path_for_index: 根据图片序号返回输出文件路径
+
+    Returns:
+        (图片列表 [{"path", "mime_type", "size"}], 非图片文本片段)
+    """
+    parser = InlineDataParser()
+    images: List[dict] = []
+    current: Optional[dict] = None
+    handle = None
+
+    try:
+        async for chunk in byte_stream:
+            for event in parser.feed(chunk):
+                kind, index = event[0], event[1]
+                if kind == "start":
+                    current = {"path": path_for_index(index), "mime_type": None, "size": 0}
+                    handle = await aiofiles.open(current["path"], "wb")
+                elif kind == "data":
+                    if current["mime_type"] is None:
+                        current["mime_type"] = detect_mime_type(event[2][:12])
+                    current["size"] += len(event[2])
+                    await handle.write(event[2])
+                elif kind == "end":
+                    await handle.close()
+                    handle = None
+                    if current["size"]:
+                        images.append(current)
+                    else:
+                        os.remove(current["path"])
+                    current = None
+    except BaseException:
+        # 中途失败时清理未写完的文件
+        if handle is not None:
+            await handle.close()
+        for item in images + ([current] if current else []):
+            if os.path.exists(item["path"]):
+                os.remove(item["path"])
+        raise
+
+    return images, bytes(parser.envelope)
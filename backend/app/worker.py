@@ -0,0 +1,114 @@
+"""
+生成任务 worker 进程
+与 API 进程分开部署，从任务表领取 /generate-async 提交的任务并执行；
+长时间出图不占用 API 进程的事件循环和内存，worker 崩溃也不影响 API
+
+API 进程需设置 JOB_WORKER_MODE=external（只登记任务、提供状态查询），两者共用同一个 JOB_STORE_PATH
+
+用法:
+    python -m app.worker                          # 单进程，并发 JOB_WORKER_CONCURRENCY
+    python -m app.worker --concurrency 4          # 单进程并发 4 个任务
+    python -m app.worker --processes 3            # 3 个子进程，异常退出的子进程自动重启
+
+- SIGTERM / SIGINT 时停止领取新任务，等待执行中的任务最多 --grace 秒
+- Grsai 完成回调发往 API 进程，worker 进程内不使用回调，按模型历史耗时轮询结果
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import subprocess
+
+# 与 API 进程相同的方式加载 .env（各服务模块在导入时读取配置，必须先加载）；
+# 不导入 app.main，worker 进程不需要构建 FastAPI 应用和路由
+from app.env import load_env_file  # noqa: F401
+
+from app.services.endpoint_pool import grsai_endpoints
+from app.services.job_worker import JobWorker, JOB_WORKER_CONCURRENCY, JOB_POLL_INTERVAL
+
+logger = logging.getLogger("app.worker")
+
+# 子进程异常退出后重启前的等待（秒）
+RESTART_DELAY = 2.0
+
+
+async def run_worker(concurrency: int, poll_interval: float, grace: float):
+    """在当前进程运行 worker，直到收到终止信号"""
+    # 回调只会送达 API 进程，这里改为纯轮询
+    os.environ.pop("NANO_BANANA_WEBHOOK_URL", None)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    worker = JobWorker(concurrency=concurrency, poll_interval=poll_interval)
+    grsai_endpoints.start()
+    worker.start()
+    try:
+        await stop.wait()
+        logger.info(f"[Worker] {worker.worker_id} 收到终止信号，等待执行中的任务（最多 {grace:g} 秒）")
+    finally:
+        await worker.stop(grace=grace)
+        await grsai_endpoints.stop()
+    logger.info(f"[Worker] {worker.worker_id} 已退出，共完成 {worker.completed} 个任务")
+
+
+def supervise(processes: int, args: argparse.Namespace) -> int:
+    """启动多个 worker 子进程，异常退出的自动重启；收到终止信号时转发给子进程"""
+    command = [
+        sys.executable, "-m", "app.worker",
+        "--processes", "1",
+        "--concurrency", str(args.concurrency),
+        "--poll-interval", str(args.poll_interval),
+        "--grace", str(args.grace)
+    ]
+    stopping = False
+    children = [subprocess.Popen(command) for _ in range(processes)]
+
+    def handle_signal(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    logger.info(f"[Worker] 已启动 {processes} 个 worker 进程")
+    while not stopping:
+        time.sleep(1.0)
+        for index, child in enumerate(children):
+            code = child.poll()
+            if code is not None and not stopping:
+                logger.warning(f"[Worker] 子进程 {child.pid} 退出（code={code}），{RESTART_DELAY:g} 秒后重启")
+                time.sleep(RESTART_DELAY)
+                children[index] = subprocess.Popen(command)
+    for child in children:
+        child.wait()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="生成任务 worker")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="每个进程并发执行的任务数")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("JOB_WORKER_PROCESSES", "1")),
+                        help="worker 进程数（>1 时由当前进程监管子进程）")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL, help="空闲时检查新任务的间隔（秒）")
+    parser.add_argument("--grace", type=float, default=float(os.getenv("JOB_SHUTDOWN_GRACE", "60")),
+                        help="终止时等待执行中任务的时间（秒）")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.processes > 1:
+        return supervise(args.processes, args)
+    asyncio.run(run_worker(args.concurrency, args.poll_interval, args.grace))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+测试公共配置
+服务模块在导入时读取环境变量，这里在导入 app 之前把上游、数据库和缓存目录都指向测试专用的位置
+"""
+
+import os
+import socket
+import tempfile
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# 本地替身 tools/mock_provider 的端口
+MOCK_PORT = _free_port()
+TEST_DIR = tempfile.mkdtemp(prefix="renovation-tests-")
+
+os.environ.update({
+    "GRSAI_API_URLS": f"http://127.0.0.1:{MOCK_PORT}",
+    "GRSAI_API_KEY": "test-key",
+    "APIYI_KEY": "test-key",
+    "LLM_APIYI_KEY": "test-key",
+    "USE_LLM_PROMPT": "false",
+    "JOB_STORE_PATH": os.path.join(TEST_DIR, "jobs.db"),
+    "RESULT_CACHE_DIR": os.path.join(TEST_DIR, "results"),
+    "REFERENCE_DIR": os.path.join(TEST_DIR, "refs"),
+})
+os.environ.pop("NANO_BANANA_WEBHOOK_URL", None)
+os.environ.pop("PUBLIC_BASE_URL", None)
+
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+_sequence = itertools.count()
+# 任务的提交时间从一小时前开始递增
+_BASE_TIME = datetime.now() - timedelta(hours=1)
+
+
+def make_task(**fields):
+    """待处理任务（created_at 严格递增，便于断言领取顺序）"""
+    from app.models.task import Task, TaskStatus
+
+    created_at = _BASE_TIME + timedelta(milliseconds=next(_sequence))
+    values = {
+        "task_id": f"t{next(_sequence):05d}",
+        "status": TaskStatus.PENDING,
+        "style": "modern",
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+    values.update(fields)
+    return Task(**values)
+
+
+@pytest.fixture
+def store(tmp_path):
+    """临时数据库上的任务表"""
+    from app.services.job_store import JobStore
+
+    job_store = JobStore(str(tmp_path / "jobs.db"))
+    yield job_store
+    job_store.close()
+
+
+@pytest.fixture(scope="session")
+def mock_provider():
+    """在后台线程运行 tools/mock_provider（Nano Banana 任务 1 秒完成），返回其地址"""
+    import time
+    import threading
+
+    import uvicorn
+    from tools.mock_provider import create_app, MockConfig, LatencyModel
+
+    config = MockConfig(fast_latency=LatencyModel.parse("0.01"), task_duration=LatencyModel.parse("1"))
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=MOCK_PORT, log_level="warning", ws="none"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{MOCK_PORT}"
+    server.should_exit = True
+    thread.join(timeout=5)
@@ -0,0 +1,65 @@
+"""
+镜像地址池
+两个 tools/mock_provider 实例作为镜像，探测延迟不同：粘性选择与故障切换
+"""
+
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+
+import uvicorn
+
+from app.services.endpoint_pool import EndpointPool
+from tools.mock_provider import create_app, MockConfig, LatencyModel
+
+
+@asynccontextmanager
+async def mirror(config: MockConfig):
+    """在当前事件循环中运行一个替身镜像，返回 (地址, 服务)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning", ws="none"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.02)
+    try:
+        yield f"http://127.0.0.1:{port}", server
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def test_sticky_selection_and_failover():
+    slow_config = MockConfig(fast_latency=LatencyModel.parse("0.2"))
+    fast_config = MockConfig(fast_latency=LatencyModel.parse("0.05"))
+
+    async def scenario():
+        async with mirror(slow_config) as (slow_url, _), mirror(fast_config) as (fast_url, fast_server):
+            pool = EndpointPool("test", [slow_url, fast_url])
+            pool.failure_threshold = 2
+            steps = []
+
+            # 第一次探测切换到明显更快的镜像
+            await pool.probe()
+            steps.append((pool.url == fast_url, pool.switches))
+
+            # 另一镜像只是略快（未低于 SWITCH_RATIO 倍）时保持不变
+            slow_config.fast_latency = LatencyModel.parse("0.045")
+            for _ in range(3):
+                await pool.probe()
+            steps.append((pool.url == fast_url, pool.switches))
+
+            # 当前镜像下线：一次探测失败不切换，连续失败达到阈值才切换
+            fast_server.should_exit = True
+            await asyncio.sleep(0.5)
+            await pool.probe()
+            steps.append((pool.url == fast_url, pool.switches))
+            await pool.probe()
+            steps.append((pool.url == fast_url, pool.switches))
+            return steps, pool.stats()
+
+    steps, stats = asyncio.run(scenario())
+    assert steps == [(True, 1), (True, 1), (True, 1), (False, 2)]
+    fast = stats["endpoints"][1]
+    assert fast["healthy"] is False and fast["failures"] == 2
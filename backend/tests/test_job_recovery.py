@@ -0,0 +1,189 @@
+"""崩溃恢复: 接管失联 worker 的任务，已提交到上游的继续等待而不重新提交"""
+
+import io
+import os
+import sys
+import base64
+import asyncio
+import subprocess
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from PIL import Image
+
+from app.models.task import TaskStatus
+from app.services import job_worker as job_worker_module
+from app.services.job_worker import JobWorker, JOB_MAX_ATTEMPTS
+from app.services.lazy_result import lazy_results
+from app.services.nano_banana import nano_banana_client
+
+from tests.conftest import make_task
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _reference_base64() -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (120, 80, 40)).save(buffer, "JPEG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+async def _processing(store, **fields):
+    """登记一个由其他 worker 领取、执行中的任务"""
+    task = await store.create(make_task())
+    now = datetime.now()
+    values = {"status": TaskStatus.PROCESSING, "started_at": now, "heartbeat_at": now, "attempts": 1}
+    values.update(fields)
+    return await store.update(task.task_id, **values)
+
+
+async def _wait_finished(store, task_id: str, timeout: float = 20.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        task = await store.get(task_id)
+        if task.finished:
+            return task
+        await asyncio.sleep(0.1)
+    raise AssertionError(f"任务 {task_id} 未在 {timeout} 秒内结束")
+
+
+def test_orphan_detection():
+    worker = JobWorker(concurrency=0, lease_timeout=60)
+    now = datetime.now()
+    fresh, stale = now - timedelta(seconds=5), now - timedelta(seconds=120)
+
+    def orphaned(worker_id, heartbeat_at=fresh):
+        return worker._orphaned(make_task(worker_id=worker_id, heartbeat_at=heartbeat_at), now)
+
+    assert not orphaned(worker.worker_id, stale)                          # 自己的任务
+    assert orphaned(None)                                                 # 已交还
+    assert not orphaned("otherhost:1:abc")                                # 其他主机，仍在续约
+    assert orphaned("otherhost:1:abc", stale)                             # 其他主机，续约超时
+    assert orphaned(f"{worker.host}:{_dead_pid()}:abc")                   # 同一主机，进程已退出
+    assert orphaned(f"{worker.host}:{os.getpid()}:old")                   # 同一进程号，重启前的实例
+    assert not orphaned(f"{worker.host}:{os.getppid()}:abc")              # 同一主机，进程仍在
+    assert orphaned(f"{worker.host}:{_dead_pid()}")                       # 旧格式（无实例标记）
+
+
+def test_reassign_is_a_compare_and_swap(store):
+    async def scenario():
+        task = await _processing(store, worker_id="dead:1:a")
+        first = await store.reassign(task.task_id, "dead:1:a", worker_id="w1")
+        second = await store.reassign(task.task_id, "dead:1:a", worker_id="w2")
+        released = await _processing(store, worker_id=None)
+        adopted = await store.reassign(released.task_id, None, worker_id="w3")
+        return first, second, adopted
+
+    first, second, adopted = asyncio.run(scenario())
+    assert first.worker_id == "w1"
+    assert second is None
+    assert adopted.worker_id == "w3"
+
+
+def test_heartbeat_renews_only_own_processing_jobs(store):
+    async def scenario():
+        old = datetime.now() - timedelta(minutes=5)
+        mine = await _processing(store, worker_id="me", heartbeat_at=old)
+        other = await _processing(store, worker_id="other", heartbeat_at=old)
+        renewed = await store.heartbeat("me")
+        return renewed, await store.get(mine.task_id), await store.get(other.task_id)
+
+    renewed, mine, other = asyncio.run(scenario())
+    assert renewed == 1
+    assert mine.heartbeat_at > other.heartbeat_at
+
+
+@pytest.fixture
+def recovery_env(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_worker_module, "job_store", store)
+    monkeypatch.setattr(lazy_results, "directory", str(tmp_path / "output"))
+    return store
+
+
+def test_recovery_resumes_submitted_jobs_without_resubmitting(recovery_env, mock_provider):
+    store = recovery_env
+    stale = datetime.now() - timedelta(minutes=10)
+
+    async def submit_upstream() -> str:
+        result = await nano_banana_client.generate_image(prompt="modern", image_base64_list=[_reference_base64()])
+        assert result["code"] == 0
+        return result["data"]["id"]
+
+    async def scenario():
+        async with httpx.AsyncClient() as client:
+            submits_before = (await client.get(f"{mock_provider}/stats")).json()["counters"].get("draw_submit", 0)
+
+        upstream_id = await submit_upstream()
+        submitted = await _processing(
+            store, worker_id="crashed:1:a", heartbeat_at=stale, stage="generate", upstream_task_id=upstream_id
+        )
+        not_submitted = await _processing(
+            store, worker_id=f"crashed:{_dead_pid()}:a", heartbeat_at=stale, stage="prompt", prompt="kept prompt"
+        )
+        exhausted = await _processing(store, worker_id="crashed:1:a", heartbeat_at=stale, attempts=JOB_MAX_ATTEMPTS)
+        alive = await _processing(store, worker_id="healthy:1:a")
+
+        worker = JobWorker(concurrency=0, lease_timeout=60)
+        counts = await worker.recover()
+        resumed = await _wait_finished(store, submitted.task_id)
+        again = await worker.recover()
+
+        # 优雅终止时被取消的任务交还后，由下一个 worker 继续等待同一个上游任务
+        upstream_id2 = await submit_upstream()
+        cancelled = await _processing(
+            store, worker_id="crashed:1:a", heartbeat_at=stale, stage="generate", upstream_task_id=upstream_id2
+        )
+        await worker.recover()
+        await asyncio.sleep(0.2)
+        await worker.stop()
+        released = await store.get(cancelled.task_id)
+        successor = JobWorker(concurrency=0, lease_timeout=60)
+        await successor.recover()
+        finished = await _wait_finished(store, cancelled.task_id)
+
+        async with httpx.AsyncClient() as client:
+            submits_after = (await client.get(f"{mock_provider}/stats")).json()["counters"]["draw_submit"]
+        return {
+            "counts": counts,
+            "again": again,
+            "resumed": resumed,
+            "upstream_id": upstream_id,
+            "requeued": await store.get(not_submitted.task_id),
+            "exhausted": await store.get(exhausted.task_id),
+            "alive": await store.get(alive.task_id),
+            "released": released,
+            "finished": finished,
+            "submits": submits_after - submits_before,
+        }
+
+    result = asyncio.run(scenario())
+
+    assert result["counts"] == {"resumed": 1, "requeued": 1, "failed": 1}
+    assert result["again"] == {"resumed": 0, "requeued": 0, "failed": 0}
+
+    resumed = result["resumed"]
+    assert resumed.status == TaskStatus.COMPLETED
+    assert resumed.upstream_task_id == result["upstream_id"]
+    assert resumed.result_urls
+    saved = os.listdir(lazy_results.directory)
+    assert all(url.rsplit("/", 1)[-1] in saved for url in resumed.result_urls)
+
+    requeued = result["requeued"]
+    assert requeued.status == TaskStatus.PENDING
+    assert requeued.worker_id is None and requeued.stage == "queued"
+    assert requeued.prompt == "kept prompt"
+
+    assert result["exhausted"].status == TaskStatus.FAILED
+    assert result["alive"].status == TaskStatus.PROCESSING and result["alive"].worker_id == "healthy:1:a"
+
+    released = result["released"]
+    assert released.status == TaskStatus.PROCESSING and released.worker_id is None
+    assert result["finished"].status == TaskStatus.COMPLETED
+
+    # 只有测试自己提交的两个上游任务，恢复过程没有重新提交
+    assert result["submits"] == 2
@@ -0,0 +1,142 @@
+"""任务调度: 优先级与按用户加权公平排队"""
+
+import asyncio
+
+import pytest
+
+from app.services import job_scheduler as scheduler_module
+from app.services.job_scheduler import JobScheduler, PRIORITY_CLASSES, estimate_cost
+
+from tests.conftest import make_task
+
+
+async def _submit(store, owner: str, count: int, weight: float = 1.0, **fields):
+    for _ in range(count):
+        await store.create(make_task(owner=owner, **fields), weight=weight)
+
+
+async def _claim_owners(store, count: int) -> str:
+    owners = []
+    for _ in range(count):
+        task = await store.claim("host:1:abc")
+        owners.append(task.owner if task else "-")
+    return "".join(owners)
+
+
+def test_owners_are_interleaved_instead_of_first_come_first_served(store):
+    async def scenario():
+        await _submit(store, "A", 10)
+        await _submit(store, "B", 3)
+        await _submit(store, "C", 3)
+        return await _claim_owners(store, 17)
+
+    assert asyncio.run(scenario()) == "ABCABCABCAAAAAAA-"
+
+
+def test_late_owner_is_interleaved_with_existing_backlog(store):
+    async def scenario():
+        await _submit(store, "A", 8)
+        await _submit(store, "B", 8)
+        head = await _claim_owners(store, 4)
+        await _submit(store, "D", 2)
+        return head, await _claim_owners(store, 6)
+
+    head, tail = asyncio.run(scenario())
+    assert head == "ABAB"
+    # D 不必排在 A、B 剩余的 12 个任务之后
+    assert tail == "DABDAB"
+
+
+def test_weights_share_capacity_proportionally(store):
+    async def scenario():
+        await _submit(store, "H", 8, weight=2.0)
+        await _submit(store, "L", 8, weight=1.0)
+        return await _claim_owners(store, 9)
+
+    order = asyncio.run(scenario())
+    assert order.count("H") == 6 and order.count("L") == 3
+
+
+def test_expensive_jobs_consume_more_of_the_owner_share(store):
+    async def scenario():
+        await _submit(store, "P", 3, cost=estimate_cost("nano-banana-pro", "4K"))
+        await _submit(store, "F", 8, cost=estimate_cost("nano-banana", "1K"))
+        return await _claim_owners(store, 11)
+
+    # 一个 4K pro 任务（成本 8）的虚拟完成时间与第 8 个 1K 任务相同
+    assert asyncio.run(scenario()) == "FFFFFFFPFPP"
+
+
+def test_higher_priority_class_is_always_claimed_first(store):
+    async def scenario():
+        await _submit(store, "bulk", 3, priority=PRIORITY_CLASSES["bulk"])
+        await _submit(store, "std", 1, priority=PRIORITY_CLASSES["standard"])
+        await _submit(store, "ui", 1, priority=PRIORITY_CLASSES["interactive"])
+        return [(await store.claim("host:1:abc")).owner for _ in range(5)]
+
+    assert asyncio.run(scenario()) == ["ui", "std", "bulk", "bulk", "bulk"]
+
+
+def test_queue_position_counts_jobs_ahead(store):
+    async def scenario():
+        await _submit(store, "A", 3)
+        late = await store.create(make_task(owner="B"))
+        return await store.queue_position(late)
+
+    # B 的第一个任务排在 A 的第一个任务之后
+    assert asyncio.run(scenario()) == (1, 1.0)
+
+
+@pytest.fixture
+def scheduler(store, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "job_store", store)
+    return JobScheduler()
+
+
+def test_priority_defaults_to_interactive_until_bulk_threshold(scheduler, store):
+    async def scenario():
+        before = await scheduler.resolve_priority("A")
+        await _submit(store, "A", scheduler.bulk_threshold)
+        return before, await scheduler.resolve_priority("A"), await scheduler.resolve_priority("B")
+
+    assert asyncio.run(scenario()) == (
+        PRIORITY_CLASSES["interactive"], PRIORITY_CLASSES["bulk"], PRIORITY_CLASSES["interactive"]
+    )
+
+
+def test_requested_priority_can_only_lower_the_default(scheduler, store):
+    async def scenario():
+        lowered = await scheduler.resolve_priority("A", "bulk")
+        await _submit(store, "A", scheduler.bulk_threshold)
+        return lowered, await scheduler.resolve_priority("A", "interactive")
+
+    assert asyncio.run(scenario()) == (PRIORITY_CLASSES["bulk"], PRIORITY_CLASSES["bulk"])
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.resolve_priority("A", "urgent"))
+
+
+def test_owner_resolution_prefers_api_key_and_hides_it(scheduler, monkeypatch):
+    scheduler.weights = {"secret-key": 3.0}
+    monkeypatch.setattr(scheduler_module.service_tiers, "api_keys", {"tier-key": "premium"})
+    owner, weight = scheduler.resolve_owner(api_key="secret-key", client_ip="1.2.3.4")
+    assert owner.startswith("key:") and "secret-key" not in owner and weight == 3.0
+    owner, weight = scheduler.resolve_owner(api_key="tier-key", client_ip="1.2.3.4")
+    assert owner.startswith("key:") and weight == 1.0
+    assert scheduler.resolve_owner(client_ip="1.2.3.4") == ("ip:1.2.3.4", 1.0)
+
+
+def test_unconfigured_api_key_is_not_an_identity(scheduler):
+    """客户端随意填写的 Key 不能生成新身份，按 IP 计入同一用户"""
+    scheduler.weights = {"secret-key": 3.0}
+    assert scheduler.resolve_owner(api_key="made-up-1", client_ip="1.2.3.4") == ("ip:1.2.3.4", 1.0)
+    assert scheduler.resolve_owner(api_key="made-up-2", client_ip="1.2.3.4") == ("ip:1.2.3.4", 1.0)
+
+
+def test_client_ip_trusts_only_proxy_appended_hops():
+    # 客户端伪造的前缀被忽略，取受信代理追加的地址
+    assert scheduler_module.client_ip("6.6.6.6, 1.2.3.4", "10.0.0.1", trusted_hops=1) == "1.2.3.4"
+    assert scheduler_module.client_ip("6.6.6.6, 1.2.3.4, 10.0.0.2", "10.0.0.1", trusted_hops=2) == "1.2.3.4"
+    assert scheduler_module.client_ip("1.2.3.4", "10.0.0.1", trusted_hops=3) == "1.2.3.4"
+    # 未经代理或不信任代理时使用连接地址
+    assert scheduler_module.client_ip(None, "10.0.0.1", trusted_hops=1) == "10.0.0.1"
+    assert scheduler_module.client_ip("6.6.6.6", "10.0.0.1", trusted_hops=0) == "10.0.0.1"
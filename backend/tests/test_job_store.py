@@ -0,0 +1,94 @@
+"""生成任务表"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from app.models.task import TaskStatus
+from app.services.job_store import JobStore
+
+from tests.conftest import make_task
+
+
+def test_create_update_and_get_round_trip(store):
+    async def scenario():
+        task = await store.create(make_task(custom_prompt="warm"))
+        await store.update(task.task_id, progress=50, result_urls=["/output/a.png", "/output/b.png"])
+        return await store.get(task.task_id), await store.get("missing")
+
+    task, missing = asyncio.run(scenario())
+    assert missing is None
+    assert task.custom_prompt == "warm"
+    assert task.progress == 50
+    assert task.result_urls == ["/output/a.png", "/output/b.png"]
+    assert task.updated_at >= task.created_at
+
+
+def test_claim_marks_processing_and_counts_attempts(store):
+    async def scenario():
+        created = await store.create(make_task())
+        claimed = await store.claim("host:1:abc")
+        return created, claimed, await store.claim("host:1:abc"), await store.counts()
+
+    created, claimed, empty, counts = asyncio.run(scenario())
+    assert claimed.task_id == created.task_id
+    assert claimed.status == TaskStatus.PROCESSING
+    assert claimed.worker_id == "host:1:abc"
+    assert claimed.attempts == 1
+    assert claimed.started_at is not None and claimed.heartbeat_at is not None
+    assert empty is None
+    assert counts == {"processing": 1}
+
+
+def test_concurrent_claims_from_separate_connections_never_overlap(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    seed = JobStore(path)
+
+    async def fill():
+        for _ in range(40):
+            await seed.create(make_task())
+
+    asyncio.run(fill())
+
+    def drain(index: int):
+        # 每个线程一个连接，相当于多个 worker 进程
+        worker_store = JobStore(path)
+        claimed = []
+        try:
+            while True:
+                task = asyncio.run(worker_store.claim(f"host:{index}:x"))
+                if task is None:
+                    return claimed
+                claimed.append(task.task_id)
+        finally:
+            worker_store.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(drain, range(4)))
+
+    claimed = [task_id for result in results for task_id in result]
+    assert len(claimed) == 40
+    assert len(set(claimed)) == 40
+    assert asyncio.run(seed.counts()) == {"processing": 40}
+    seed.close()
+
+
+def test_old_database_gains_missing_columns(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (task_id TEXT PRIMARY KEY, status TEXT NOT NULL, style TEXT NOT NULL, "
+        "created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+    )
+    conn.execute(
+        "INSERT INTO jobs VALUES ('old', 'pending', 'modern', '2026-01-01T00:00:00', '2026-01-01T00:00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+    store = JobStore(path)
+    task = asyncio.run(store.get("old"))
+    assert task.status == TaskStatus.PENDING
+    assert task.priority == 1 and task.upstream_task_id is None
+    assert asyncio.run(store.claim("host:1:abc")).task_id == "old"
+    store.close()
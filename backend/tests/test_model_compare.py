@@ -0,0 +1,30 @@
+"""多模型对比的评分"""
+
+import asyncio
+
+import httpx
+
+from app.main import app
+from app.services.model_compare import model_comparer
+
+
+def test_rating_requires_recorded_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_comparer, "log_path", str(tmp_path / "compare.jsonl"))
+
+    async def scenario():
+        await model_comparer.record({
+            "type": "result", "run_id": "run1", "style": "modern",
+            "model": "nano-banana", "code": 0, "latency": 1.0, "bytes": 10
+        })
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def rate(run_id: str, model: str) -> int:
+                response = await client.post(f"/api/v1/compare/{run_id}/rating", data={"model": model, "score": 4})
+                return response.status_code
+
+            return [await rate("run1", "nano-banana"), await rate("unknown-run", "nano-banana"),
+                    await rate("run1", "nano-banana-pro")]
+
+    assert asyncio.run(scenario()) == [200, 404, 404]
+    rows = model_comparer.summary("modern")
+    assert [(r["model"], r["ratings"]) for r in rows] == [("nano-banana", 1)]
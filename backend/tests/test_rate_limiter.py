@@ -0,0 +1,27 @@
+"""
+令牌桶限流器
+"""
+
+import time
+import asyncio
+
+from app.services.rate_limiter import TokenBucketLimiter
+
+
+def test_pause_does_not_refill_a_burst():
+    """429 暂停结束后按速率逐个放行，不会把暂停时长当作补充时间一次放出整桶"""
+    limiter = TokenBucketLimiter("test", rate=10.0, burst=5, max_concurrency=10, queue_timeout=10.0)
+
+    async def scenario():
+        limiter.pause(0.5)
+        started = time.monotonic()
+        admitted = []
+        for _ in range(3):
+            async with limiter.acquire():
+                admitted.append(time.monotonic() - started)
+        return admitted
+
+    admitted = asyncio.run(scenario())
+    # 暂停 0.5 秒后令牌从 0 开始，以 10 个/秒补充
+    assert admitted[0] >= 0.55
+    assert admitted[2] - admitted[0] >= 0.18
@@ -0,0 +1,109 @@
+"""生成结果缓存: 缓存键与 LRU 淘汰"""
+
+import os
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import generation_pipeline
+from app.services.result_cache import ResultCache, META_FILE
+
+
+def _image(directory, name: str, size: int) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+
+    async def scenario():
+        await cache.put("a", {"data": {}}, [_image(tmp_path, "a.png", 1000)])
+        await cache.put("b", {"data": {}}, [_image(tmp_path, "b.png", 1000)])
+        assert await cache.get("a") is not None  # a 变为最近使用
+        await cache.put("c", {"data": {}}, [_image(tmp_path, "c.png", 1000)])
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    a, b, c = asyncio.run(scenario())
+    assert a is not None and c is not None
+    assert b is None
+    assert cache.evictions == 1
+    assert not os.path.exists(tmp_path / "cache" / "b")
+    assert open(a["files"][0], "rb").read() == b"x" * 1000
+
+
+def test_index_is_rebuilt_from_disk_in_access_order(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ResultCache(directory, max_bytes=10_000)
+
+    async def fill():
+        for i, key in enumerate(["old", "mid", "new"]):
+            await cache.put(key, {"data": {"n": i}}, [_image(tmp_path, f"{key}.png", 1000)])
+            meta = os.path.join(directory, key, META_FILE)
+            os.utime(meta, (1000 + i, 1000 + i))
+
+    asyncio.run(fill())
+    # 写入中途失败的残留目录在重建索引时清理
+    os.makedirs(os.path.join(directory, "partial"))
+
+    reloaded = ResultCache(directory, max_bytes=2500)
+    assert asyncio.run(reloaded.get("old")) is None
+    assert asyncio.run(reloaded.get("new"))["data"] == {"n": 2}
+    assert reloaded.stats()["entries"] == 2
+    assert not os.path.exists(os.path.join(directory, "partial"))
+
+
+@pytest.fixture
+def fake_generation(tmp_path, monkeypatch):
+    """用临时缓存和假的上游替换 generate_images 的依赖，记录上游调用参数"""
+    calls = []
+
+    async def generate_with_fallback(**kwargs):
+        calls.append(kwargs)
+        path = kwargs["output_path"](0)
+        with open(path, "wb") as f:
+            f.write(b"image")
+        return {"code": 0, "msg": "success", "data": {"images": [{"path": path}], "used_model": "m"}}
+
+    monkeypatch.setattr(generation_pipeline, "result_cache", ResultCache(str(tmp_path / "cache"), 10**6))
+    monkeypatch.setattr(generation_pipeline.getgoapi_client, "generate_with_fallback", generate_with_fallback)
+    counter = iter(range(1000))
+    prepared = SimpleNamespace(
+        content_hash="content-a",
+        image=None,
+        output_path=lambda tag: (lambda _i: str(tmp_path / f"{next(counter)}_{tag}.png"))
+    )
+    return prepared, calls
+
+
+def test_cache_key_covers_every_generation_input(fake_generation):
+    prepared, calls = fake_generation
+    base = dict(prompt="modern", aspect_ratio="4:3", image_size="1K", model_priority=["m1", "m2"])
+
+    async def generate(prepared_input=prepared, **changes):
+        return await generation_pipeline.generate_images(prepared_input, **{**base, **changes})
+
+    async def scenario():
+        first = await generate()
+        repeat = await generate()
+        variations = [
+            await generate(prompt="nordic"),
+            await generate(aspect_ratio="16:9"),
+            await generate(image_size="2K"),
+            await generate(model_priority=["m2"]),
+            await generate(number_of_images=2),
+            await generate(SimpleNamespace(**{**vars(prepared), "content_hash": "content-b"})),
+        ]
+        bypass = await generate(use_cache=False)
+        return first, repeat, variations, bypass
+
+    first, repeat, variations, bypass = asyncio.run(scenario())
+    assert first["data"]["cached"] is False
+    assert repeat["data"]["cached"] is True
+    assert all(result["data"]["cached"] is False for result in variations)
+    assert bypass["data"]["cached"] is False
+    # 首次 + 6 个不同输入 + 强制重新生成
+    assert len(calls) == 8
@@ -0,0 +1,43 @@
+"""服务等级解析"""
+
+import pytest
+
+from app.services.rate_limiter import DEFAULT_PRIORITY
+from app.services.service_tiers import ServiceTierRegistry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setenv("SERVICE_TIER_API_KEYS", "key-premium:premium,key-fast:fast")
+    monkeypatch.delenv("SERVICE_TIER_DEFAULT", raising=False)
+    return ServiceTierRegistry()
+
+
+def test_entitled_tier_comes_from_api_key(registry):
+    assert registry.resolve().name == "standard"
+    assert registry.resolve(api_key="key-premium").name == "premium"
+    fast = registry.resolve(api_key="key-fast")
+    assert (fast.priority, fast.hedge_after) == (0, 8.0)
+
+
+def test_upgrade_is_rejected(registry):
+    with pytest.raises(PermissionError):
+        registry.resolve("premium")
+    with pytest.raises(PermissionError):
+        registry.resolve("standard", api_key="key-fast")
+    with pytest.raises(ValueError):
+        registry.resolve("unknown")
+
+
+def test_downgrade_keeps_entitled_priority_and_hedging(registry):
+    """匿名调用方选择 fast 只得到 fast 的模型和尺寸，不会插队也不会对冲"""
+    anonymous = registry.resolve("fast")
+    assert anonymous.name == "fast"
+    assert anonymous.max_image_size == "1K"
+    assert anonymous.priority == DEFAULT_PRIORITY
+    assert anonymous.hedge_after is None
+
+    # premium 可以对冲，降级到 fast 时使用 fast 的对冲时间，排队优先级仍为 premium 的
+    from_premium = registry.resolve("fast", api_key="key-premium")
+    assert from_premium.priority == 2
+    assert from_premium.hedge_after == 8.0
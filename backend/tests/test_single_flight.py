@@ -0,0 +1,131 @@
+"""单飞请求合并"""
+
+import asyncio
+
+from app.services.single_flight import SingleFlight, make_key
+
+
+def test_make_key_is_stable_and_normalizes_enums():
+    from app.services.nano_banana import NanoBananaModel
+
+    assert make_key("a", ["x", "y"]) == make_key("a", ("x", "y"))
+    assert make_key("a", NanoBananaModel.NANO_BANANA) == make_key("a", NanoBananaModel.NANO_BANANA.value)
+    assert make_key("a", "b") != make_key("b", "a")
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("k", fn) for _ in range(3)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert [value for value, _ in results] == ["result"] * 3
+    assert [shared for _, shared in results] == [False, True, True]
+    assert flight.coalesced == 2
+    assert flight.in_flight == 0
+
+
+def test_later_call_after_completion_runs_again():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        first = await flight.do("k", fn)
+        second = await flight.do("k", fn)
+        return first, second
+
+    assert asyncio.run(scenario()) == ((1, False), (2, False))
+
+
+def test_cancelling_one_waiter_keeps_shared_call_running():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = False
+
+        async def fn():
+            nonlocal cancelled
+            try:
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "result"
+
+        first = asyncio.create_task(flight.do("k", fn))
+        second = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        value, shared = await second
+        return value, shared, cancelled, first.cancelled()
+
+    assert asyncio.run(scenario()) == ("result", True, False, True)
+
+
+def test_upstream_cancelled_when_no_waiters_remain():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.do("k", fn)) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        await asyncio.sleep(0)
+        return flight.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_call_after_cancellation_runs_again():
+    """最后一个等待者取消后，上游收尾期间到达的相同调用重新执行，而不是加入已取消的任务"""
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            try:
+                await asyncio.sleep(1)
+                return "result"
+            except asyncio.CancelledError:
+                # 取消后的清理步骤（如通知上游取消任务）
+                await asyncio.sleep(0.1)
+                raise
+
+        first = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        result = await flight.do("k", fn)
+        await asyncio.sleep(0.15)
+        return result, calls, flight.in_flight
+
+    result, calls, in_flight = asyncio.run(scenario())
+    assert result == ("result", False)
+    assert calls == 2
+    assert in_flight == 0
@@ -0,0 +1,100 @@
+"""
+Nano Banana 完成回调
+用 tools/webhook_sender 向运行中的 app 投递回调：校验、幂等、唤醒等待中的任务
+"""
+
+import json
+import time
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+import uvicorn
+
+from app.main import app
+from app.services.nano_banana import nano_banana_client
+from app.services.webhook_receiver import SIGNATURE_HEADER, sign_payload, webhook_receiver
+from tools.webhook_sender import build_payload, send_completion
+
+SECRET = "webhook-test-secret"
+
+
+@asynccontextmanager
+async def running_app():
+    """在当前事件循环中运行 app（不执行 startup，避免启动 worker 和探测），返回回调地址"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off", ws="none"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.02)
+    try:
+        yield f"http://127.0.0.1:{port}/api/v1/webhooks/nano-banana"
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def test_bad_signature_is_rejected(monkeypatch):
+    monkeypatch.setenv("NANO_BANANA_WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        async with running_app() as url:
+            by_token = await send_completion("wh-bad-1", "wrong-secret", url=url)
+            by_signature = await send_completion("wh-bad-2", "wrong-secret", url=url, use_signature=True)
+            # 签名正确但请求体被篡改
+            body = json.dumps(build_payload("wh-bad-3")).encode("utf-8")
+            tampered = body.replace(b"succeeded", b"failed")
+            async with httpx.AsyncClient() as client:
+                response = await client.post(url, content=tampered, headers={SIGNATURE_HEADER: sign_payload(body, SECRET)})
+            return by_token + by_signature, response.status_code
+
+    responses, status_code = asyncio.run(scenario())
+    assert [r["code"] for r in responses] == [-1, -1]
+    assert status_code == 401
+    assert "wh-bad-1" not in webhook_receiver._processed
+    assert "wh-bad-2" not in webhook_receiver._processed
+    assert "wh-bad-3" not in webhook_receiver._processed
+
+
+def test_duplicate_delivery_is_noop(monkeypatch):
+    monkeypatch.setenv("NANO_BANANA_WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        async with running_app() as url:
+            return await send_completion("wh-dup", SECRET, url=url, use_signature=True, repeat=3)
+
+    first, *repeats = asyncio.run(scenario())
+    assert first["code"] == 0 and first["data"]["duplicate"] is False
+    assert all(r["code"] == 0 and r["data"]["duplicate"] is True for r in repeats)
+    assert all(r["data"]["delivered"] is False for r in repeats)
+
+
+def test_delivery_wakes_waiter_before_safety_net(monkeypatch):
+    monkeypatch.setenv("NANO_BANANA_WEBHOOK_SECRET", SECRET)
+    poller = nano_banana_client.poller
+    safety_interval = 30.0
+
+    async def scenario():
+        async with running_app() as url:
+            started = time.monotonic()
+            waiter = asyncio.create_task(poller.wait(
+                "wh-wake", model="nano-banana", max_wait_seconds=60, min_interval=safety_interval
+            ))
+            await asyncio.sleep(0.1)
+            responses = await send_completion(
+                "wh-wake", SECRET, url=url, result_urls=["http://example.invalid/a.png"]
+            )
+            result = await asyncio.wait_for(waiter, timeout=5)
+            return responses[0], result, time.monotonic() - started
+
+    response, result, elapsed = asyncio.run(scenario())
+    assert response["data"]["delivered"] is True
+    assert result["code"] == 0
+    assert result["data"]["status"] == "succeeded"
+    assert result["data"]["results"][0]["url"] == "http://example.invalid/a.png"
+    assert elapsed < safety_interval / 3
+    # 等待结束后轮询器不再保留该任务
+    assert poller.in_flight == 0
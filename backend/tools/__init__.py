@@ -0,0 +1 @@
+# 本地开发与测试工具（替身服务、压测脚本等）
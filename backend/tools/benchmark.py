@@ -0,0 +1,375 @@
+"""
+端到端压测工具
+在本地替身服务（tools.mock_provider）上驱动 FastAPI 应用，测量单个 worker 的承载能力
+
+- 默认在进程内运行应用（httpx ASGITransport），与单个 uvicorn worker 的事件循环一致；
+  也可用 --target 指向已启动的服务
+- 替身服务在后台线程中运行，上游延迟与故障率可配置
+- 闭环模式（--concurrency）: 固定并发数持续发请求
+- 开环模式（--rate）: 按泊松到达率发请求，不受响应速度影响
+- 报告吞吐、延迟 p50/p95/p99、错误数、事件循环延迟、RSS，
+  结果写入 JSON（带 git 提交号），便于对比不同提交
+
+用法:
+    python -m tools.benchmark --scenario generate --concurrency 8 --requests 200
+    python -m tools.benchmark --scenario generate,segment-point,inpaint --rate 4 --duration 60
+    python -m tools.benchmark --scenario generate --image-latency lognormal:2,0.3 --rate-limit-rate 0.05
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from tools.mock_provider import MockConfig, LatencyModel, create_app as create_mock_app
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "bench_results")
+
+SCENARIOS = ("generate", "segment-point", "inpaint")
+
+
+# ---------- 环境 ----------
+
+def git_commit() -> Dict[str, object]:
+    """当前 git 提交号及工作区是否有未提交修改"""
+    def _run(*args: str) -> str:
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=10
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {
+        "commit": _run("rev-parse", "--short", "HEAD") or "unknown",
+        "subject": _run("log", "-1", "--format=%s"),
+        "dirty": bool(_run("status", "--porcelain", "--untracked-files=no"))
+    }
+
+
+def current_rss_mb() -> float:
+    """当前常驻内存（MB），非 Linux 平台返回峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 为 KB
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def start_mock(config: MockConfig, port: int):
+    """在后台线程启动替身服务，返回 uvicorn.Server"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(create_mock_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="mock-provider", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("替身服务启动超时")
+        time.sleep(0.05)
+    return server
+
+
+def point_app_at_mock(port: int):
+    """把上游地址指向替身服务（必须在导入 app 之前调用）"""
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "APIYI_BASE_URL": base,
+        "LLM_APIYI_BASE_URL": base,
+        "GRSAI_API_URL": base,
+        "GRSAI_API_URLS": base,
+        "HF_INFERENCE_BASE_URL": f"{base}/hf-inference",
+        "APIYI_KEY": os.getenv("APIYI_KEY") or "mock",
+        "LLM_APIYI_KEY": os.getenv("LLM_APIYI_KEY") or "mock",
+        "GRSAI_API_KEY": os.getenv("GRSAI_API_KEY") or "mock",
+    })
+
+
+# ---------- 请求构造 ----------
+
+class InputFactory:
+    """生成测试图片；unique=True 时每张图内容不同，避免命中缓存和请求合并"""
+
+    def __init__(self, width: int, height: int, unique: bool):
+        self.width = width
+        self.height = height
+        self.unique = unique
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        self._base = Image.fromarray(pixels)
+        self._counter = 0
+        self._fixed = self._encode(self._base)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        mask[height // 4: height * 3 // 4, width // 4: width * 3 // 4] = 255
+        buffer = io.BytesIO()
+        Image.fromarray(mask, mode="L").save(buffer, format="PNG")
+        self.mask_base64 = base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    @staticmethod
+    def _encode(image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def image(self) -> bytes:
+        if not self.unique:
+            return self._fixed
+        self._counter += 1
+        image = self._base.copy()
+        # 左上角写入计数，改变内容哈希
+        image.paste((self._counter % 256, (self._counter >> 8) % 256, 0), (0, 0, 16, 16))
+        return self._encode(image)
+
+
+def build_request(scenario: str, inputs: InputFactory, args: argparse.Namespace) -> Callable[[httpx.AsyncClient], object]:
+    """返回一个发起单次请求的协程函数"""
+    image = inputs.image()
+    files = {"image": ("bench.jpg", image, "image/jpeg")}
+
+    if scenario == "generate":
+        data = {"style": args.style, "image_size": args.image_size, "variants": str(args.variants)}
+        return lambda client: client.post("/api/v1/generate", files=files, data=data)
+    if scenario == "segment-point":
+        data = {"x": str(inputs.width // 2), "y": str(inputs.height // 2)}
+        return lambda client: client.post("/api/v1/segment/by-point", files=files, data=data)
+    if scenario == "inpaint":
+        data = {"mask_base64": inputs.mask_base64, "prompt": "modern sofa"}
+        return lambda client: client.post("/api/v1/segment/inpaint", files=files, data=data)
+    raise ValueError(f"未知场景: {scenario}")
+
+
+# ---------- 测量 ----------
+
+class LoopLagMonitor:
+    """采样事件循环延迟（定时器实际唤醒时间与预期的差值）"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.rss_samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        tick = 0
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+            tick += 1
+            if tick % 10 == 0:
+                self.rss_samples.append(current_rss_mb())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(latencies: List[float], errors: Dict[str, int], elapsed: float, lag: LoopLagMonitor) -> dict:
+    completed = len(latencies)
+    return {
+        "requests": completed + sum(errors.values()),
+        "succeeded": completed,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_seconds": {
+            "mean": round(float(np.mean(latencies)), 4) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag.samples, 50) * 1000, 2),
+            "p99": round(percentile(lag.samples, 99) * 1000, 2),
+            "max": round(max(lag.samples) * 1000, 2) if lag.samples else 0.0
+        },
+        "rss_mb": {
+            "end": round(current_rss_mb(), 1),
+            "max_sampled": round(max(lag.rss_samples), 1) if lag.rss_samples else round(current_rss_mb(), 1),
+            "peak": round(peak_rss_mb(), 1)
+        }
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, inputs: InputFactory, args: argparse.Namespace) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    rng = random.Random(args.seed)
+
+    async def one():
+        send = build_request(scenario, inputs, args)
+        start = time.perf_counter()
+        try:
+            response = await send(client)
+            ok = response.status_code == 200
+            reason = f"http_{response.status_code}"
+        except httpx.HTTPError as e:
+            ok, reason = False, type(e).__name__
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors[reason] = errors.get(reason, 0) + 1
+
+    lag = LoopLagMonitor()
+    lag.start()
+    started = time.perf_counter()
+
+    if args.rate:
+        # 开环：泊松到达，持续 duration 秒（或发满 requests 个）
+        tasks = []
+        stop_at = started + args.duration
+        while time.perf_counter() < stop_at and (not args.requests or len(tasks) < args.requests):
+            tasks.append(asyncio.create_task(one()))
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+    else:
+        # 闭环：concurrency 个并发发送者共享请求配额
+        remaining = [args.requests or float("inf")]
+        stop_at = started + args.duration if args.duration else None
+
+        async def sender():
+            while remaining[0] > 0 and (stop_at is None or time.perf_counter() < stop_at):
+                remaining[0] -= 1
+                await one()
+
+        await asyncio.gather(*(sender() for _ in range(args.concurrency)))
+
+    elapsed = time.perf_counter() - started
+    await lag.stop()
+    return summarize(latencies, errors, elapsed, lag)
+
+
+# ---------- 入口 ----------
+
+def mock_config_from_args(args: argparse.Namespace) -> MockConfig:
+    config = MockConfig(
+        image_latency=LatencyModel.parse(args.image_latency),
+        text_latency=LatencyModel.parse(args.text_latency),
+        segment_latency=LatencyModel.parse(args.segment_latency),
+        inpaint_latency=LatencyModel.parse(args.inpaint_latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    )
+    if args.image_pixels:
+        config.image_pixels = args.image_pixels
+    return config
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mock_server = None
+    if args.target:
+        transport = None
+        base_url = args.target
+    else:
+        point_app_at_mock(args.mock_port)
+        os.environ.setdefault("RESULT_CACHE_ENABLED", "false")
+        mock_server = start_mock(mock_config_from_args(args), args.mock_port)
+        from app.main import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+
+    inputs = InputFactory(args.input_width, args.input_height, unique=not args.same_input)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+            for scenario in args.scenario:
+                print(f"[benchmark] {scenario} ...", file=sys.stderr)
+                results[scenario] = await run_scenario(client, scenario, inputs, args)
+                print(f"[benchmark] {scenario}: {json.dumps(results[scenario], ensure_ascii=False)}", file=sys.stderr)
+    finally:
+        if mock_server is not None:
+            mock_server.should_exit = True
+
+    return {
+        "git": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "mode": "target" if args.target else "in-process",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="端到端压测")
+    parser.add_argument("--scenario", default="generate",
+                        type=lambda s: [x.strip() for x in s.split(",") if x.strip()],
+                        help=f"逗号分隔，可选 {', '.join(SCENARIOS)}")
+    parser.add_argument("--target", help="压测已启动的服务（如 http://127.0.0.1:8000），默认进程内运行应用")
+    parser.add_argument("--concurrency", type=int, default=8, help="闭环模式并发数")
+    parser.add_argument("--rate", type=float, default=0.0, help="开环模式每秒到达数（设置后忽略 concurrency）")
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数（0 表示只受 duration 限制）")
+    parser.add_argument("--duration", type=float, default=0.0, help="每个场景的最长时间（秒），开环模式必填")
+    parser.add_argument("--timeout", type=float, default=300.0, help="单个请求超时（秒）")
+    parser.add_argument("--style", default="modern_minimalist")
+    parser.add_argument("--image-size", default="1K")
+    parser.add_argument("--variants", type=int, default=1)
+    parser.add_argument("--input-width", type=int, default=1024)
+    parser.add_argument("--input-height", type=int, default=768)
+    parser.add_argument("--same-input", action="store_true", help="所有请求使用同一张图（测试缓存和请求合并）")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--image-latency", default="lognormal:2,0.3")
+    parser.add_argument("--text-latency", default="lognormal:0.5,0.3")
+    parser.add_argument("--segment-latency", default="lognormal:0.3,0.3")
+    parser.add_argument("--inpaint-latency", default="lognormal:1.5,0.3")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--image-pixels", type=int, default=0, help="替身返回图片的长边像素")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="结果 JSON 路径，默认 bench_results/<时间>_<提交号>.json")
+    args = parser.parse_args(argv)
+
+    unknown = [s for s in args.scenario if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    if args.rate and not args.duration:
+        parser.error("开环模式（--rate）需要指定 --duration")
+    if not args.rate and not (args.requests or args.duration):
+        parser.error("闭环模式需要 --requests 或 --duration")
+
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['git']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,455 @@
+"""
+上游服务替身（mock provider）
+在本地模拟本项目调用的全部付费接口，用于离线联调、压测和故障注入
+
+模拟的接口:
+    POST /v1beta/models/{model}:generateContent   API易 Gemini（图片生成 / LLM 分析，支持 fileData 引用）
+    POST /upload/v1beta/files                     Gemini Files API 断点续传上传（start / upload, finalize）
+    POST /v1/draw/nano-banana                     Grsai Nano Banana 提交（轮询 / 进度流 / 回调）
+    POST /v1/draw/result                          Grsai Nano Banana 结果查询
+    POST /hf-inference/models/{owner}/{name}      Hugging Face SAM3 分割
+    POST /api/v1/images/inpaint                   Grsai 局部替换
+    GET  /files/{name}                            结果图片下载（Nano Banana / 局部替换返回的 URL）
+    GET  /                                        镜像探测（延迟为 fast_latency）
+    GET  /stats                                   各接口请求计数
+
+让服务端指向替身（.env）:
+    APIYI_BASE_URL=http://127.0.0.1:9000
+    LLM_APIYI_BASE_URL=http://127.0.0.1:9000
+    GRSAI_API_URLS=http://127.0.0.1:9000
+    HF_INFERENCE_BASE_URL=http://127.0.0.1:9000/hf-inference
+    APIYI_KEY / LLM_APIYI_KEY / GRSAI_API_KEY 设为任意非空值
+
+用法:
+    python -m tools.mock_provider --port 9000
+    python -m tools.mock_provider --image-latency lognormal:25,0.35 --error-rate 0.02 --rate-limit-rate 0.05
+
+模拟 Grsai 国内 / 海外两个镜像（地址池按探测延迟选择较快的一个）:
+    python -m tools.mock_provider --port 9001 --fast-latency 0.02
+    python -m tools.mock_provider --port 9002 --fast-latency 0.3
+    GRSAI_API_URLS=http://127.0.0.1:9002,http://127.0.0.1:9001
+
+延迟分布写法: 固定 "1.5" 或 "fixed:1.5"、"uniform:1,3"、"normal:均值,标准差"、"lognormal:中位数,sigma"（秒）
+"""
+
+import io
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import base64
+from dataclasses import dataclass, field, fields
+from typing import Dict, Optional, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from tools.webhook_sender import build_payload as build_webhook_payload
+
+# imageSize -> 长边像素
+SIZE_PIXELS = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+
+@dataclass
+class LatencyModel:
+    """延迟分布（秒）"""
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        kind, _, args = spec.partition(":")
+        if not args:
+            return cls("fixed", float(kind))
+        values = [float(v) for v in args.split(",")]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {kind}")
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(self.a, self.b))
+        if self.kind == "lognormal":
+            # a 为中位数，b 为对数标准差
+            return self.a * float(np.exp(rng.gauss(0.0, self.b)))
+        return self.a
+
+
+@dataclass
+class MockConfig:
+    """替身行为配置"""
+    # 各类接口的响应延迟
+    image_latency: LatencyModel = field(default_factory=lambda: LatencyModel("lognormal", 20.0, 0.3))
+    text_latency: LatencyModel = field(default_factory=lambda: LatencyModel("lognormal", 4.0, 0.3))
+    segment_latency: LatencyModel = field(default_factory=lambda: LatencyModel("lognormal", 1.5, 0.3))
+    inpaint_latency: LatencyModel = field(default_factory=lambda: LatencyModel("lognormal", 15.0, 0.3))
+    # Nano Banana 任务从提交到完成的耗时
+    task_duration: LatencyModel = field(default_factory=lambda: LatencyModel("lognormal", 30.0, 0.3))
+    # 轮询、下载等轻量接口的延迟
+    fast_latency: LatencyModel = field(default_factory=lambda: LatencyModel("fixed", 0.05))
+    # 故障注入: 返回 5xx / 429 的概率，以及 429 的 Retry-After
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 2.0
+    # Nano Banana 任务失败的概率
+    task_failure_rate: float = 0.0
+    # 生成图片的长边像素（0 表示按请求的 imageSize）和格式
+    image_pixels: int = 0
+    image_format: str = "PNG"
+    # 进度流推送间隔（秒）
+    progress_interval: float = 1.0
+    seed: Optional[int] = None
+
+
+class MockProvider:
+    """替身服务状态（任务表、图片缓存、计数）"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.tasks: Dict[str, dict] = {}
+        self.files: Dict[str, Tuple[bytes, str]] = {}
+        self.uploads: Dict[str, str] = {}
+        self.counters: Dict[str, int] = {}
+        self._images: Dict[Tuple[int, int, str], bytes] = {}
+        self._background: set = set()
+        self.webhook_client = httpx.AsyncClient(timeout=10.0)
+
+    # ---------- 通用 ----------
+
+    def count(self, name: str):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def inject_fault(self) -> Optional[Response]:
+        """按配置概率返回 429 / 503"""
+        roll = self.rng.random()
+        if roll < self.config.rate_limit_rate:
+            self.count("rate_limited")
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Too Many Requests (mock)"}},
+                status_code=429,
+                headers={"Retry-After": str(self.config.retry_after)}
+            )
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.count("errors")
+            return JSONResponse({"error": {"code": 503, "message": "Service Unavailable (mock)"}}, status_code=503)
+        return None
+
+    async def delay(self, latency: LatencyModel):
+        await asyncio.sleep(latency.sample(self.rng))
+
+    def image_bytes(self, image_size: str = "1K", aspect_ratio: str = "1:1") -> Tuple[bytes, str]:
+        """生成（并缓存）指定尺寸的噪声图，噪声使文件大小接近真实照片"""
+        long_side = self.config.image_pixels or SIZE_PIXELS.get(image_size, 1024)
+        try:
+            w, h = (float(v) for v in aspect_ratio.split(":"))
+        except ValueError:
+            w, h = 1.0, 1.0
+        width, height = (long_side, int(long_side * h / w)) if w >= h else (int(long_side * w / h), long_side)
+        fmt = self.config.image_format.upper()
+        key = (width, height, fmt)
+        if key not in self._images:
+            pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format=fmt)
+            self._images[key] = buffer.getvalue()
+        return self._images[key], f"image/{fmt.lower()}"
+
+    def store_file(self, data: bytes, mime_type: str) -> str:
+        name = f"{uuid.uuid4().hex}.{mime_type.split('/')[-1]}"
+        self.files[name] = (data, mime_type)
+        return name
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # ---------- Gemini generateContent ----------
+
+    async def generate_content(self, payload: dict) -> Response:
+        config = payload.get("generationConfig", {})
+        wants_image = "IMAGE" in config.get("responseModalities", [])
+        self.count("gemini_image" if wants_image else "gemini_text")
+        for content in payload.get("contents", []):
+            for part in content.get("parts", []):
+                if "fileData" in part:
+                    self.count("gemini_file_refs")
+                    if part["fileData"].get("fileUri", "").rsplit("/", 1)[-1] not in self.files:
+                        return JSONResponse({"error": {"code": 400, "message": "file not found (mock)"}}, status_code=400)
+
+        fault = self.inject_fault()
+        if fault is not None:
+            return fault
+
+        if not wants_image:
+            await self.delay(self.config.text_latency)
+            text = json.dumps(MOCK_ANALYSIS, ensure_ascii=False)
+            return JSONResponse({"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]})
+
+        await self.delay(self.config.image_latency)
+        image_config = config.get("imageConfig", {})
+        data, mime_type = self.image_bytes(image_config.get("imageSize", "1K"), image_config.get("aspectRatio", "1:1"))
+        body = json.dumps({
+            "candidates": [{
+                "content": {
+                    "parts": [{"inlineData": {"mimeType": mime_type, "data": base64.b64encode(data).decode("ascii")}}],
+                    "role": "model"
+                },
+                "finishReason": "STOP"
+            }]
+        })
+        return Response(body, media_type="application/json")
+
+    async def upload_start(self, headers, base_url: str) -> Response:
+        self.count("file_upload_start")
+        if headers.get("x-goog-upload-command") != "start":
+            return JSONResponse({"error": {"code": 400, "message": "expected start command"}}, status_code=400)
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = headers.get("x-goog-upload-header-content-type", "image/jpeg")
+        return JSONResponse({}, headers={"X-Goog-Upload-URL": f"{base_url}upload/v1beta/files/{upload_id}"})
+
+    async def upload_finalize(self, upload_id: str, data: bytes, base_url: str) -> Response:
+        self.count("file_upload")
+        mime_type = self.uploads.pop(upload_id, None)
+        if mime_type is None:
+            return JSONResponse({"error": {"code": 404, "message": "upload not found"}}, status_code=404)
+        await self.delay(self.config.fast_latency)
+        name = self.store_file(data, mime_type)
+        return JSONResponse({"file": {
+            "name": f"files/{name}",
+            "uri": f"{base_url}files/{name}",
+            "mimeType": mime_type,
+            "sizeBytes": str(len(data))
+        }})
+
+    # ---------- Grsai Nano Banana ----------
+
+    def _task_view(self, task: dict) -> dict:
+        """按已过去的时间推算任务状态"""
+        elapsed = time.monotonic() - task["submitted_at"]
+        if elapsed >= task["duration"]:
+            if task["fail"]:
+                return build_webhook_payload(task["id"], "failed", failure_reason="mock failure")
+            return build_webhook_payload(task["id"], "succeeded", [task["url"]])
+        view = build_webhook_payload(task["id"], "running")
+        view["progress"] = min(99, int(100 * elapsed / task["duration"]))
+        return view
+
+    async def submit_draw(self, payload: dict, base_url: str) -> Response:
+        self.count("draw_submit")
+        fault = self.inject_fault()
+        if fault is not None:
+            return fault
+        await self.delay(self.config.fast_latency)
+
+        # 参考图 URL 由上游拉取（验证签名 URL 可访问）
+        for url in payload.get("urls", []):
+            if url.startswith("http"):
+                try:
+                    (await self.webhook_client.get(url)).raise_for_status()
+                    self.count("reference_fetches")
+                except httpx.HTTPError:
+                    self.count("reference_fetch_failed")
+                    return JSONResponse({"code": -1, "msg": f"cannot fetch reference: {url}", "data": None})
+
+        data, mime_type = self.image_bytes(payload.get("imageSize", "1K"), payload.get("aspectRatio", "1:1"))
+        task = {
+            "id": uuid.uuid4().hex[:16],
+            "submitted_at": time.monotonic(),
+            "duration": self.config.task_duration.sample(self.rng),
+            "fail": self.rng.random() < self.config.task_failure_rate,
+            "url": f"{base_url}files/{self.store_file(data, mime_type)}"
+        }
+        self.tasks[task["id"]] = task
+
+        web_hook = payload.get("webHook") or ""
+        if web_hook.startswith("http"):
+            self.spawn(self._deliver_webhook(task, web_hook))
+
+        if payload.get("shutProgress", True) is False:
+            return StreamingResponse(self._progress_stream(task), media_type="text/event-stream")
+        return JSONResponse({"code": 0, "msg": "success", "data": {"id": task["id"]}})
+
+    async def _progress_stream(self, task: dict):
+        while True:
+            view = self._task_view(task)
+            yield f"data: {json.dumps(view)}\n\n"
+            if view["status"] != "running":
+                return
+            remaining = task["duration"] - (time.monotonic() - task["submitted_at"])
+            await asyncio.sleep(max(0.0, min(self.config.progress_interval, remaining)))
+
+    async def _deliver_webhook(self, task: dict, url: str):
+        await asyncio.sleep(task["duration"])
+        try:
+            await self.webhook_client.post(url, json=self._task_view(task))
+            self.count("webhooks_sent")
+        except httpx.HTTPError:
+            self.count("webhooks_failed")
+
+    async def draw_result(self, payload: dict) -> Response:
+        self.count("draw_result")
+        fault = self.inject_fault()
+        if fault is not None:
+            return fault
+        await self.delay(self.config.fast_latency)
+        task = self.tasks.get(payload.get("id", ""))
+        if task is None:
+            return JSONResponse({"code": -22, "msg": "task not found", "data": None})
+        return JSONResponse({"code": 0, "msg": "success", "data": self._task_view(task)})
+
+    # ---------- SAM3 / Inpaint ----------
+
+    async def segment(self, payload: dict) -> Response:
+        self.count("segment")
+        fault = self.inject_fault()
+        if fault is not None:
+            return fault
+        await self.delay(self.config.segment_latency)
+
+        image = Image.open(io.BytesIO(base64.b64decode(payload.get("inputs", {}).get("image", ""))))
+        width, height = image.size
+        box = [width // 4, height // 4, width * 3 // 4, height * 3 // 4]
+        mask = np.zeros((height, width), dtype=np.uint8)
+        mask[box[1]:box[3], box[0]:box[2]] = 255
+        buffer = io.BytesIO()
+        Image.fromarray(mask, mode="L").save(buffer, format="PNG")
+        return JSONResponse({
+            "masks": [base64.b64encode(buffer.getvalue()).decode("ascii")],
+            "boxes": [box],
+            "scores": [0.95]
+        })
+
+    async def inpaint(self, payload: dict, base_url: str) -> Response:
+        self.count("inpaint")
+        fault = self.inject_fault()
+        if fault is not None:
+            return fault
+        await self.delay(self.config.inpaint_latency)
+
+        # 原图原样返回，尺寸与输入一致
+        data = base64.b64decode(payload.get("input_image", ""))
+        name = self.store_file(data, "image/jpeg")
+        return JSONResponse({"code": 0, "message": "success", "data": {"output_urls": [f"{base_url}files/{name}"]}})
+
+    async def get_file(self, name: str) -> Response:
+        self.count("files")
+        await self.delay(self.config.fast_latency)
+        item = self.files.get(name)
+        if item is None:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return Response(item[0], media_type=item[1])
+
+
+# LLM 分析的固定返回（同时满足风格分析和空间事实分析）
+MOCK_ANALYSIS = {
+    "room_analysis": {
+        "room_type": "living room",
+        "space_description": "rectangular open space, about 20 square meters",
+        "physical_features": "large window on the left wall, 2.8m ceiling, bare concrete floor",
+        "lighting_analysis": "soft natural daylight from the left"
+    },
+    "design_recommendations": {
+        "layout_suggestion": "sofa facing the window, TV wall on the right",
+        "furniture_placement": "sofa centered, coffee table in front, armchair near the window",
+        "color_scheme": "warm white walls, light oak wood, beige textiles",
+        "lighting_design": "recessed downlights plus a floor lamp beside the sofa"
+    }
+}
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """创建替身服务应用"""
+    provider = MockProvider(config or MockConfig())
+    app = FastAPI(title="Mock Provider")
+    app.state.provider = provider
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate_content(model_action: str, request: Request):
+        if not model_action.endswith(":generateContent"):
+            return JSONResponse({"error": "unsupported action"}, status_code=404)
+        return await provider.generate_content(await request.json())
+
+    @app.post("/upload/v1beta/files")
+    async def upload_start(request: Request):
+        return await provider.upload_start(request.headers, str(request.base_url))
+
+    @app.post("/upload/v1beta/files/{upload_id}")
+    async def upload_finalize(upload_id: str, request: Request):
+        return await provider.upload_finalize(upload_id, await request.body(), str(request.base_url))
+
+    @app.post("/v1/draw/nano-banana")
+    async def draw(request: Request):
+        return await provider.submit_draw(await request.json(), str(request.base_url))
+
+    @app.post("/v1/draw/result")
+    async def draw_result(request: Request):
+        return await provider.draw_result(await request.json())
+
+    @app.post("/hf-inference/models/{owner}/{name}")
+    async def segment(owner: str, name: str, request: Request):
+        return await provider.segment(await request.json())
+
+    @app.post("/api/v1/images/inpaint")
+    async def inpaint(request: Request):
+        return await provider.inpaint(await request.json(), str(request.base_url))
+
+    @app.get("/files/{name}")
+    async def get_file(name: str):
+        return await provider.get_file(name)
+
+    @app.get("/")
+    async def probe():
+        provider.count("probe")
+        await provider.delay(provider.config.fast_latency)
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    async def stats():
+        return {"counters": provider.counters, "tasks": len(provider.tasks), "files": len(provider.files)}
+
+    return app
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    values = {}
+    for f in fields(MockConfig):
+        value = getattr(args, f.name, None)
+        if value is None:
+            continue
+        values[f.name] = LatencyModel.parse(value) if f.name.endswith(("_latency", "_duration")) else value
+    return MockConfig(**values)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="上游服务替身（mock provider）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for name in ("image_latency", "text_latency", "segment_latency", "inpaint_latency", "task_duration", "fast_latency"):
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help="延迟分布，如 lognormal:20,0.3")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, help="返回 503 的概率")
+    parser.add_argument("--rate-limit-rate", dest="rate_limit_rate", type=float, help="返回 429 的概率")
+    parser.add_argument("--retry-after", dest="retry_after", type=float, help="429 的 Retry-After（秒）")
+    parser.add_argument("--task-failure-rate", dest="task_failure_rate", type=float, help="Nano Banana 任务失败概率")
+    parser.add_argument("--image-pixels", dest="image_pixels", type=int, help="生成图片长边像素（默认按 imageSize）")
+    parser.add_argument("--image-format", dest="image_format", choices=["PNG", "JPEG"])
+    parser.add_argument("--progress-interval", dest="progress_interval", type=float, help="进度流推送间隔（秒）")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""
+Nano Banana 回调替身发送器
+模拟 Grsai 向本服务投递任务完成回调，用于本地联调和测试
+
+用法:
+    python -m tools.webhook_sender --task-id abc123 --secret my-secret
+    python -m tools.webhook_sender --task-id abc123 --secret my-secret --status failed --repeat 2
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+from typing import List, Optional
+
+import httpx
+
+from app.services.webhook_receiver import SIGNATURE_HEADER, sign_payload
+
+DEFAULT_URL = "http://localhost:8000/api/v1/webhooks/nano-banana"
+
+
+def build_payload(
+    task_id: str,
+    status: str = "succeeded",
+    result_urls: Optional[List[str]] = None,
+    failure_reason: str = ""
+) -> dict:
+    """构造与 Grsai 结果查询接口 data 字段一致的回调体"""
+    return {
+        "id": task_id,
+        "status": status,
+        "progress": 100 if status == "succeeded" else 0,
+        "results": [{"url": url, "content": ""} for url in (result_urls or [])],
+        "failure_reason": failure_reason if status == "failed" else "",
+        "error": ""
+    }
+
+
+async def send_completion(
+    task_id: str,
+    secret: str,
+    url: str = DEFAULT_URL,
+    status: str = "succeeded",
+    result_urls: Optional[List[str]] = None,
+    use_signature: bool = False,
+    repeat: int = 1
+) -> List[dict]:
+    """
+    发送完成回调
+
+    Args:
+        task_id: 任务ID
+        secret: 回调密钥
+        url: 回调地址
+        status: succeeded / failed / running
+        result_urls: 结果图片地址
+        use_signature: True 使用签名头，False 使用 token 查询参数（与 Grsai 一致）
+        repeat: 重复投递次数（验证幂等）
+
+    Returns:
+        每次投递的响应 JSON
+    """
+    payload = build_payload(task_id, status, result_urls, failure_reason="mock failure")
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    params = {}
+    if use_signature:
+        headers[SIGNATURE_HEADER] = sign_payload(body, secret)
+    else:
+        params["token"] = secret
+
+    responses = []
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        for _ in range(repeat):
+            response = await client.post(url, content=body, headers=headers, params=params)
+            responses.append(response.json())
+    return responses
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Nano Banana 回调替身发送器")
+    parser.add_argument("--url", default=DEFAULT_URL, help="回调地址")
+    parser.add_argument("--task-id", required=True, help="任务ID")
+    parser.add_argument("--secret", required=True, help="回调密钥 (NANO_BANANA_WEBHOOK_SECRET)")
+    parser.add_argument("--status", default="succeeded", choices=["succeeded", "failed", "running"])
+    parser.add_argument("--result-url", action="append", default=[], help="结果图片地址，可多次指定")
+    parser.add_argument("--signature", action="store_true", help="使用签名头而不是 token 参数")
+    parser.add_argument("--repeat", type=int, default=1, help="重复投递次数")
+    args = parser.parse_args(argv)
+
+    responses = asyncio.run(send_completion(
+        task_id=args.task_id,
+        secret=args.secret,
+        url=args.url,
+        status=args.status,
+        result_urls=args.result_url,
+        use_signature=args.signature,
+        repeat=args.repeat
+    ))
+    for response in responses:
+        print(json.dumps(response, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())